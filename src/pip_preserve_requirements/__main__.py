@@ -1,20 +1,23 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import sys
+from enum import Enum
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import typer
 
-from ._cache import Cache
 from ._compat import tomllib
-from ._config import Config
-from ._tag_name_factory import TagNameFactory
-from ._tag_requirements import tag_requirements_files
 
 app = typer.Typer()
 
 
+class OutputFormat(str, Enum):
+    text = "text"
+    json = "json"
+
+
 def _project_root_callback(
     ctx: typer.Context,
     _param: Any,
@@ -28,6 +31,9 @@ def _project_root_callback(
             .get("tool", {})
             .get("pip-preserve-requirements", {})
         )
+        if "cache_dir" in ctx.default_map:
+            # relative to the project root, not to the current directory
+            ctx.default_map["cache_dir"] = str(value / ctx.default_map["cache_dir"])
     return value
 
 
@@ -36,12 +42,36 @@ def command(
     requirements_files: list[Path] = typer.Argument(  # noqa: B008
         ...,
         metavar="REQUIREMENTS_FILE...",
-        file_okay=True,
-        dir_okay=False,
-        exists=True,
-        help=("The requirements files to look for requirements tag."),
+        help=(
+            "The requirements files to look for requirements tag. "
+            "Directories are searched recursively for files matching the "
+            "include patterns. Glob patterns are expanded."
+        ),
     ),
     *,
+    include: list[str] = typer.Option(  # noqa: B008
+        ["*requirements*.txt", "**/requirements/*.txt"],
+        "--include",
+        help=(
+            "Glob patterns of the requirements files to find in directories. "
+            "Patterns without a slash match file names, others match paths "
+            "relative to the directory."
+        ),
+    ),
+    exclude: list[str] = typer.Option(  # noqa: B008
+        [],
+        "--exclude",
+        help=(
+            "Glob patterns of files to ignore in directories. "
+            "Files ignored by git are always ignored."
+        ),
+    ),
+    parse_jobs: int = typer.Option(
+        1,
+        "--parse-jobs",
+        min=1,
+        help="The number of processes used to parse requirements files.",
+    ),
     tag_prefix: str = typer.Option(
         "ppr-", "--tag-prefix", help="The prefix to use when creating git tag names."
     ),
@@ -53,6 +83,160 @@ def command(
             "If not, ensure commits are tagged with the requested prefix."
         ),
     ),
+    jobs: int = typer.Option(
+        4,
+        "--jobs",
+        "-j",
+        min=1,
+        help="The maximum number of concurrent remote operations.",
+    ),
+    jobs_per_host: int = typer.Option(
+        4,
+        "--jobs-per-host",
+        min=1,
+        help="The maximum number of concurrent remote operations per host.",
+    ),
+    ssh_multiplexing: bool = typer.Option(
+        True,
+        "--ssh-multiplexing/--no-ssh-multiplexing",
+        help=(
+            "Share one SSH connection per host between the git commands, "
+            "and close them at the end of the run."
+        ),
+    ),
+    mirrors_max_age: int = typer.Option(
+        30,
+        "--mirrors-max-age",
+        min=0,
+        help="Remove local repository mirrors not used for this number of days.",
+    ),
+    mirrors_max_size: int = typer.Option(
+        2048,
+        "--mirrors-max-size",
+        min=0,
+        help=(
+            "The maximum total size of local repository mirrors, in MB. "
+            "Least recently used mirrors are removed first."
+        ),
+    ),
+    positive_cache_ttl: Optional[int] = typer.Option(  # noqa: FA100
+        None,
+        "--positive-cache-ttl",
+        min=0,
+        help=(
+            "The number of seconds during which tags found in cache are "
+            "assumed to still exist on the remote. By default they never expire."
+        ),
+    ),
+    negative_cache_ttl: int = typer.Option(
+        600,
+        "--negative-cache-ttl",
+        min=0,
+        help=(
+            "The number of seconds during which cached remote tag lookups "
+            "are reused, to find commits that have no tag yet."
+        ),
+    ),
+    cache_dir: Optional[Path] = typer.Option(  # noqa: B008, FA100
+        None,
+        "--cache-dir",
+        envvar="PIP_PRESERVE_REQUIREMENTS_CACHE_DIR",
+        file_okay=False,
+        help=(
+            "The directory of the cache of tags and repository mirrors, "
+            "which may be shared by projects. By default, the cache is in "
+            ".pip_preserve_requirements_cache in the project root."
+        ),
+    ),
+    shared_cache: bool = typer.Option(
+        False,
+        "--shared-cache",
+        help=(
+            "Use the cache directory of the user, shared by all projects, "
+            "unless --cache-dir is set."
+        ),
+    ),
+    refresh: bool = typer.Option(
+        False,
+        "--refresh",
+        help="Ignore cached tags and listings, and check the remotes again.",
+    ),
+    check: bool = typer.Option(
+        False,
+        "--check",
+        help=(
+            "Only report pinned references that are not in a vault or not "
+            "tagged according to the cache, and exit with an error if any. "
+            "Requirements files and remotes are not modified."
+        ),
+    ),
+    check_probes: int = typer.Option(
+        0,
+        "--check-probes",
+        min=0,
+        help=(
+            "With --check, the maximum number of remote repositories to list "
+            "for commits that have no tag in cache."
+        ),
+    ),
+    all_files: bool = typer.Option(
+        False,
+        "--all",
+        help=(
+            "Process all requirements files. By default, files that were "
+            "processed successfully with the same content and options "
+            "are skipped."
+        ),
+    ),
+    follow_includes: bool = typer.Option(
+        False,
+        "--follow-includes",
+        help=(
+            "Also process the files included with -r and -c by the "
+            "requirements files, recursively."
+        ),
+    ),
+    fast_scan: bool = typer.Option(
+        False,
+        "--fast-scan",
+        help=(
+            "Scan requirements files line by line and rewrite only the URLs "
+            "of pinned references, leaving the rest of the files untouched. "
+            "Files with includes or line continuations are fully parsed."
+        ),
+    ),
+    output_format: OutputFormat = typer.Option(  # noqa: B008
+        OutputFormat.text,
+        "--format",
+        help=(
+            "With json, write the outcome of each requirement to stdout as a "
+            "JSON object per line, as soon as it is known."
+        ),
+    ),
+    verbose: int = typer.Option(
+        0,
+        "--verbose",
+        "-v",
+        count=True,
+        help="Show more details about the operations performed.",
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help=(
+            "Print a report of the time spent in remote operations, "
+            "subprocesses, cache queries and file processing."
+        ),
+    ),
+    profile_output: Optional[Path] = typer.Option(  # noqa: B008, FA100
+        None,
+        "--profile-output",
+        dir_okay=False,
+        help=(
+            "Write the timed operations to this file, in the OpenTelemetry "
+            "protocol JSON format."
+        ),
+    ),
     project_root: Path = typer.Option(  # noqa: B008
         ".",
         "--project-root",
@@ -72,12 +256,74 @@ def command(
     ),
 ) -> None:
     """Ensure pinned VCS references in pip requirements files have a git tag."""
-    config = Config.from_pyproject_toml(project_root)
-    cache = Cache(project_root)
-    tag_name_factory = TagNameFactory(tag_prefix, match_any_tag)
-    tag_requirements_files(
-        requirements_files, config.vcs_vaults, cache, tag_name_factory
-    )
+    # import lazily, so --help and shell completion are fast
+    from ._cache import Cache, user_cache_dir
+    from ._config import Config
+    from ._discover import discover_requirements_files
+    from ._includes import walk_includes
+    from ._profile import profiling
+    from ._results import ResultsWriter
+    from ._ssh import shared_ssh_connections
+    from ._tag_name_factory import TagNameFactory
+    from ._tag_requirements import check_requirements_files, tag_requirements_files
+    from ._utils import increase_verbosity
+
+    for _ in range(verbose):
+        increase_verbosity()
+    # without probes, --check does not access remotes
+    ssh_multiplexing = ssh_multiplexing and (not check or check_probes > 0)
+    with profiling(profile, profile_output), shared_ssh_connections(ssh_multiplexing):
+        config = Config.from_pyproject_toml(project_root)
+        if cache_dir is None and shared_cache:
+            cache_dir = user_cache_dir()
+        cache = Cache(
+            project_root,
+            positive_ttl=positive_cache_ttl,
+            negative_ttl=negative_cache_ttl,
+            refresh=refresh,
+            cache_dir=cache_dir,
+        )
+        tag_name_factory = TagNameFactory(tag_prefix, match_any_tag)
+        results_writer = None
+        if output_format == OutputFormat.json:
+            results_writer = ResultsWriter(sys.stdout)
+        try:
+            requirements_files = discover_requirements_files(
+                requirements_files, include, exclude
+            )
+        except FileNotFoundError as e:
+            raise typer.BadParameter(str(e), param_hint="REQUIREMENTS_FILE...") from e
+        if follow_includes:
+            requirements_files = walk_includes(requirements_files)
+        if check:
+            missing = check_requirements_files(
+                requirements_files,
+                config.vcs_vaults,
+                cache,
+                tag_name_factory,
+                max_probes=check_probes,
+                incremental=not all_files,
+                fast_scan=fast_scan,
+                parse_jobs=parse_jobs,
+                results_writer=results_writer,
+            )
+            raise typer.Exit(1 if missing else 0)
+        tag_requirements_files(
+            requirements_files,
+            config.vcs_vaults,
+            cache,
+            tag_name_factory,
+            jobs=jobs,
+            jobs_per_host=jobs_per_host,
+            incremental=not all_files,
+            fast_scan=fast_scan,
+            parse_jobs=parse_jobs,
+            results_writer=results_writer,
+        )
+        cache.evict_mirrors(
+            max_age=mirrors_max_age * 24 * 3600,
+            max_size=mirrors_max_size * 1024 * 1024,
+        )
 
 
 def main() -> None:
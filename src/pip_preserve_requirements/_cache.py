@@ -1,19 +1,113 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
 import sqlite3
-from collections.abc import Sequence
+import sys
+import threading
+import time
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
 from pathlib import Path
 
+from ._concurrency import FileLock
+from ._profile import profiled
+
+# the version of the tags database schema, stored in its user_version
+SCHEMA_VERSION = 5
+
+# the number of seconds to wait for other processes writing to the database
+BUSY_TIMEOUT = 60
+
+# the open database connections, by path, when they are kept open between
+# caches, and the lock serializing their use
+_open_connections: dict[Path, tuple[sqlite3.Connection, threading.RLock]] | None = None
+
+
+def keep_connections_open() -> None:
+    """Reuse the database connections of caches, for long running processes."""
+    global _open_connections
+    if _open_connections is None:
+        _open_connections = {}
+
+
+def user_cache_dir() -> Path:
+    """The cache directory of the user, shared by all projects.
+
+    It is in $XDG_CACHE_HOME, defaulting to ~/.cache, or in the platform
+    specific cache directory on Windows and macOS.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "pip-preserve-requirements"
+
 
 class Cache:
-    def __init__(self, project_root: Path):
-        self._cache_dir = project_root / ".pip_preserve_requirements_cache"
+    """Cache of remote tags and local repository mirrors.
+
+    Cached tags are considered valid for positive_ttl seconds (forever if None).
+    Remote tag listings, which tell which commits have no tag, and tags found
+    missing on remotes are considered valid for negative_ttl seconds. With
+    refresh, entries recorded before the cache is created are ignored.
+
+    The cache is in cache_dir, defaulting to .pip_preserve_requirements_cache in
+    the project root. It may be shared by projects and by concurrent processes,
+    as long as it is on a local file system.
+    """
+
+    def __init__(
+        self,
+        project_root: Path,
+        positive_ttl: float | None = None,
+        negative_ttl: float = 0,
+        refresh: bool = False,
+        cache_dir: Path | None = None,
+    ):
+        if cache_dir is None:
+            cache_dir = project_root / ".pip_preserve_requirements_cache"
+        self._cache_dir = cache_dir
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._refreshed_at = time.time() if refresh else None
+        # the mirrors used through this cache, which may have grown
+        self._used_mirror_dirs: set[Path] = set()
+        if _open_connections is not None and self._tags_db_path in _open_connections:
+            conn, lock = _open_connections.pop(self._tags_db_path)
+            if self._tags_db_path.is_file():
+                self._tags_db_conn, self._lock = conn, lock
+                _open_connections[self._tags_db_path] = (conn, lock)
+                return
+            # the cache directory was removed meanwhile
+            conn.close()
+        # the cache is shared by worker threads
+        self._lock = threading.RLock()
         self._tags_db_conn = self._initialize()
+        if _open_connections is not None:
+            _open_connections[self._tags_db_path] = (self._tags_db_conn, self._lock)
+
+    @property
+    def _tags_db_path(self) -> Path:
+        return self._cache_dir.resolve() / "tags.db"
+
+    def _min_checked_at(self, ttl: float | None) -> float:
+        """The oldest check time of valid cache entries."""
+        min_checked_at = -1.0
+        if ttl is not None:
+            min_checked_at = time.time() - ttl
+        if self._refreshed_at is not None:
+            min_checked_at = max(min_checked_at, self._refreshed_at)
+        return min_checked_at
 
     def _initialize(self) -> sqlite3.Connection:
-        if not self._cache_dir.is_dir():
-            self._cache_dir.mkdir()
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
         gitignore_path = self._cache_dir / ".gitignore"
         if not gitignore_path.is_file():
             gitignore_path.write_text("*")
@@ -21,39 +115,198 @@ class Cache:
         if not cachedir_tag_path.is_file():
             cachedir_tag_path.write_text("Signature: 8a477f597d28d172789f06886806bc55")
         tags_db_path = self._cache_dir / "tags.db"
-        conn = sqlite3.connect(tags_db_path, isolation_level=None)
+        conn = sqlite3.connect(
+            tags_db_path,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        self._migrate(conn)
+        return conn
+
+    @classmethod
+    @contextmanager
+    def _transaction(cls, conn: sqlite3.Connection) -> Iterator[None]:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @classmethod
+    def _migrate(cls, conn: sqlite3.Connection) -> None:
+        """Upgrade the database schema to SCHEMA_VERSION."""
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        with cls._transaction(conn):
+            # another process may have migrated the database meanwhile
+            (version,) = conn.execute("PRAGMA user_version").fetchone()
+            if version < 1:
+                cls._migrate_to_1(conn)
+            if version < 2:
+                cls._migrate_to_2(conn)
+            if version < 3:
+                cls._migrate_to_3(conn)
+            if version < 4:
+                cls._migrate_to_4(conn)
+            if version < 5:
+                cls._migrate_to_5(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @classmethod
+    def _migrate_to_1(cls, conn: sqlite3.Connection) -> None:
+        """Create the initial versioned schema, keeping data from unversioned
+        databases, which had no index and possibly duplicate tags."""
+        tables = {
+            name
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
         conn.execute(
             """
-                CREATE TABLE IF NOT EXISTS tags (
+                CREATE TABLE tags_v1 (
                     provider TEXT NOT NULL,
                     owner TEXT NOT NULL,
                     repo TEXT NOT NULL,
                     sha TEXT NOT NULL,
-                    tag TEXT NOT NULL
+                    tag TEXT NOT NULL,
+                    checked_at REAL
                 );
             """
         )
-        return conn
+        if "tags" in tables:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(tags)")]
+            checked_at = "checked_at" if "checked_at" in columns else "NULL"
+            conn.execute(
+                "INSERT INTO tags_v1 (provider, owner, repo, sha, tag, checked_at) "
+                f"SELECT provider, owner, repo, sha, tag, MAX({checked_at}) "
+                "FROM tags GROUP BY provider, owner, repo, sha, tag "
+                "ORDER BY MIN(rowid)"
+            )
+            conn.execute("DROP TABLE tags")
+        conn.execute("ALTER TABLE tags_v1 RENAME TO tags")
+        conn.execute(
+            "CREATE UNIQUE INDEX tags_commit_tag "
+            "ON tags (provider, owner, repo, sha, tag)"
+        )
+        conn.execute(
+            """
+                CREATE TABLE remote_listings_v1 (
+                    provider TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    repo TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    digest TEXT NOT NULL
+                );
+            """
+        )
+        if "remote_listings" in tables:
+            conn.execute(
+                "INSERT INTO remote_listings_v1 "
+                "SELECT provider, owner, repo, MAX(fetched_at), digest "
+                "FROM remote_listings GROUP BY provider, owner, repo"
+            )
+            conn.execute("DROP TABLE remote_listings")
+        conn.execute("ALTER TABLE remote_listings_v1 RENAME TO remote_listings")
+        conn.execute(
+            "CREATE UNIQUE INDEX remote_listings_repo "
+            "ON remote_listings (provider, owner, repo)"
+        )
 
+    @classmethod
+    def _migrate_to_2(cls, conn: sqlite3.Connection) -> None:
+        """Add the table of successfully processed requirements files."""
+        conn.execute(
+            """
+                CREATE TABLE processed_files (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    config_digest TEXT NOT NULL,
+                    processed_at REAL NOT NULL
+                );
+            """
+        )
+
+    @classmethod
+    def _migrate_to_3(cls, conn: sqlite3.Connection) -> None:
+        """Record the prefix of the tags of remote listings,
+        existing listings being complete."""
+        conn.execute(
+            "ALTER TABLE remote_listings ADD COLUMN tag_prefix TEXT NOT NULL DEFAULT ''"
+        )
+
+    @classmethod
+    def _migrate_to_4(cls, conn: sqlite3.Connection) -> None:
+        """Add the table of tags looked up by name and not found on remotes."""
+        conn.execute(
+            """
+                CREATE TABLE missing_tags (
+                    provider TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    repo TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    checked_at REAL NOT NULL,
+                    PRIMARY KEY (provider, owner, repo, tag)
+                );
+            """
+        )
+
+    @classmethod
+    def _migrate_to_5(cls, conn: sqlite3.Connection) -> None:
+        """Add the table of the sizes of local mirrors, as last measured."""
+        conn.execute(
+            """
+                CREATE TABLE mirror_sizes (
+                    path TEXT NOT NULL PRIMARY KEY,
+                    size INTEGER NOT NULL
+                );
+            """
+        )
+
+    @profiled("cache.get_commit_tags")
     def get_commit_tags(
         self, provider: str, owner: str, repo: str, sha: str
     ) -> Sequence[str]:
         query = (
             "SELECT tag FROM tags WHERE "
-            "provider = ? AND owner = ? AND repo = ? AND sha = ?"
+            "provider = ? AND owner = ? AND repo = ? AND sha = ? "
+            "AND COALESCE(checked_at, 0) >= ? "
+            "ORDER BY rowid"
         )
-        params = [provider, owner, repo, sha]
-        return [tag for (tag,) in self._tags_db_conn.execute(query, params).fetchall()]
+        params = [provider, owner, repo, sha, self._min_checked_at(self.positive_ttl)]
+        with self._lock:
+            rows = self._tags_db_conn.execute(query, params).fetchall()
+        return [tag for (tag,) in rows]
 
+    def _upsert_tags(self, rows: Iterable[tuple[str, str, str, str, str]]) -> None:
+        query = (
+            "INSERT INTO tags (provider, owner, repo, sha, tag, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (provider, owner, repo, sha, tag) "
+            "DO UPDATE SET checked_at = excluded.checked_at"
+        )
+        now = time.time()
+        self._tags_db_conn.executemany(query, ((*row, now) for row in rows))
+
+    @profiled("cache.add_commit_tag")
     def add_commit_tag(
         self, provider: str, owner: str, repo: str, sha: str, tag: str
     ) -> None:
-        query = (
-            "INSERT INTO tags (provider, owner, repo, sha, tag) VALUES (?, ?, ?, ?, ?)"
-        )
-        params = [provider, owner, repo, sha, tag]
-        self._tags_db_conn.execute(query, params)
+        with self._lock, self._transaction(self._tags_db_conn):
+            self._upsert_tags([(provider, owner, repo, sha, tag)])
+            self._tags_db_conn.execute(
+                "DELETE FROM missing_tags "
+                "WHERE provider = ? AND owner = ? AND repo = ? AND tag = ?",
+                [provider, owner, repo, tag],
+            )
 
+    @profiled("cache.remove_commit_tags")
     def remove_commit_tags(
         self, provider: str, owner: str, repo: str, sha: str
     ) -> None:
@@ -61,11 +314,245 @@ class Cache:
             "DELETE FROM tags WHERE provider = ? AND owner = ? AND repo = ? AND sha = ?"
         )
         params = [provider, owner, repo, sha]
-        self._tags_db_conn.execute(query, params)
+        with self._lock:
+            self._tags_db_conn.execute(query, params)
 
+    @profiled("cache.update_commit_tags")
     def update_commit_tags(
         self, provider: str, owner: str, repo: str, sha: str, tags: Sequence[str]
     ) -> None:
-        self.remove_commit_tags(provider, owner, repo, sha)
-        for tag in tags:
-            self.add_commit_tag(provider, owner, repo, sha, tag)
+        with self._lock, self._transaction(self._tags_db_conn):
+            self.remove_commit_tags(provider, owner, repo, sha)
+            self._upsert_tags((provider, owner, repo, sha, tag) for tag in tags)
+
+    @profiled("cache.get_remote_tags")
+    def get_remote_tags(
+        self, provider: str, owner: str, repo: str, tag_prefix: str = ""
+    ) -> dict[str, list[str]] | None:
+        """Return the tags starting with tag_prefix of the last listing of the
+        remote repository, indexed by commit sha, or None if there is no valid
+        listing including these tags."""
+        query = (
+            "SELECT 1 FROM remote_listings WHERE "
+            "provider = ? AND owner = ? AND repo = ? AND fetched_at >= ? "
+            "AND substr(?, 1, length(tag_prefix)) = tag_prefix"
+        )
+        params = [
+            provider,
+            owner,
+            repo,
+            self._min_checked_at(self.negative_ttl),
+            tag_prefix,
+        ]
+        remote_tags: dict[str, list[str]] = {}
+        with self._lock:
+            if not self._tags_db_conn.execute(query, params).fetchone():
+                return None
+            query = (
+                "SELECT sha, tag FROM tags WHERE "
+                "provider = ? AND owner = ? AND repo = ? "
+                "AND substr(tag, 1, length(?)) = ? "
+                "ORDER BY rowid"
+            )
+            params = [provider, owner, repo, tag_prefix, tag_prefix]
+            for sha, tag in self._tags_db_conn.execute(query, params):
+                remote_tags.setdefault(sha, []).append(tag)
+        return remote_tags
+
+    @classmethod
+    def _remote_tags_digest(cls, remote_tags: Mapping[str, Sequence[str]]) -> str:
+        h = hashlib.sha256()
+        for sha, tag in sorted(
+            (sha, tag) for sha, tags in remote_tags.items() for tag in tags
+        ):
+            h.update(f"{sha} {tag}\n".encode())
+        return h.hexdigest()
+
+    @profiled("cache.update_remote_tags")
+    def update_remote_tags(
+        self,
+        provider: str,
+        owner: str,
+        repo: str,
+        remote_tags: Mapping[str, Sequence[str]],
+        tag_prefix: str = "",
+    ) -> None:
+        """Record a listing of the tags starting with tag_prefix of the remote
+        repository, replacing the tags with that prefix previously cached
+        for that repository."""
+        digest = self._remote_tags_digest(remote_tags)
+        with self._lock, self._transaction(self._tags_db_conn):
+            self._tags_db_conn.execute(
+                "DELETE FROM tags WHERE provider = ? AND owner = ? AND repo = ? "
+                "AND substr(tag, 1, length(?)) = ?",
+                [provider, owner, repo, tag_prefix, tag_prefix],
+            )
+            self._upsert_tags(
+                (provider, owner, repo, sha, tag)
+                for sha, tags in remote_tags.items()
+                for tag in tags
+            )
+            self._tags_db_conn.execute(
+                "INSERT INTO remote_listings "
+                "(provider, owner, repo, fetched_at, digest, tag_prefix) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (provider, owner, repo) DO UPDATE SET "
+                "fetched_at = excluded.fetched_at, digest = excluded.digest, "
+                "tag_prefix = excluded.tag_prefix",
+                [provider, owner, repo, time.time(), digest, tag_prefix],
+            )
+
+    @profiled("cache.is_tag_missing")
+    def is_tag_missing(self, provider: str, owner: str, repo: str, tag: str) -> bool:
+        """Whether the tag was recently found missing on the remote repository."""
+        query = (
+            "SELECT 1 FROM missing_tags WHERE "
+            "provider = ? AND owner = ? AND repo = ? AND tag = ? AND checked_at >= ?"
+        )
+        params = [provider, owner, repo, tag, self._min_checked_at(self.negative_ttl)]
+        with self._lock:
+            return bool(self._tags_db_conn.execute(query, params).fetchone())
+
+    @profiled("cache.set_tags_missing")
+    def set_tags_missing(
+        self, provider: str, owner: str, repo: str, tags: Iterable[str]
+    ) -> None:
+        """Record tags looked up by name and not found on the remote repository."""
+        query = (
+            "INSERT INTO missing_tags (provider, owner, repo, tag, checked_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (provider, owner, repo, tag) "
+            "DO UPDATE SET checked_at = excluded.checked_at"
+        )
+        now = time.time()
+        with self._lock, self._transaction(self._tags_db_conn):
+            self._tags_db_conn.executemany(
+                query, ((provider, owner, repo, tag, now) for tag in tags)
+            )
+
+    @profiled("cache.is_file_processed")
+    def is_file_processed(self, path: Path, digest: str, config_digest: str) -> bool:
+        """Whether the file was processed successfully with the same content
+        and configuration, recently enough for its tags to be valid."""
+        query = (
+            "SELECT 1 FROM processed_files WHERE "
+            "path = ? AND digest = ? AND config_digest = ? AND processed_at >= ?"
+        )
+        params = [
+            str(path.resolve()),
+            digest,
+            config_digest,
+            self._min_checked_at(self.positive_ttl),
+        ]
+        with self._lock:
+            return bool(self._tags_db_conn.execute(query, params).fetchone())
+
+    @profiled("cache.set_file_processed")
+    def set_file_processed(self, path: Path, digest: str, config_digest: str) -> None:
+        query = (
+            "INSERT INTO processed_files "
+            "(path, digest, config_digest, processed_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET digest = excluded.digest, "
+            "config_digest = excluded.config_digest, "
+            "processed_at = excluded.processed_at"
+        )
+        params = [str(path.resolve()), digest, config_digest, time.time()]
+        with self._lock, self._transaction(self._tags_db_conn):
+            self._tags_db_conn.execute(query, params)
+
+    @property
+    def mirrors_dir(self) -> Path:
+        return self._cache_dir / "mirrors"
+
+    def mirror_dir(self, provider: str, owner: str, repo: str) -> Path:
+        """The location of the persistent local mirror of a repository.
+
+        Its modification time is updated, to record its last use.
+        """
+        if repo.endswith(".git"):
+            repo = repo[: -len(".git")]
+        mirror_dir = self.mirrors_dir / provider / owner / f"{repo}.git"
+        if mirror_dir.is_dir():
+            os.utime(mirror_dir)
+        self._used_mirror_dirs.add(mirror_dir)
+        return mirror_dir
+
+    def _get_mirror_dirs(self) -> list[Path]:
+        if not self.mirrors_dir.is_dir():
+            return []
+        return [p for p in self.mirrors_dir.glob("*/*/*.git") if p.is_dir()]
+
+    @classmethod
+    def _get_dir_size(cls, path: Path) -> int:
+        size = 0
+        for dirpath, _dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass
+        return size
+
+    @classmethod
+    def _remove_mirror(cls, mirror_dir: Path) -> bool:
+        """Remove a mirror, unless it is in use by another process."""
+        lock = FileLock.for_directory(mirror_dir)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            shutil.rmtree(mirror_dir, ignore_errors=True)
+        finally:
+            lock.release()
+        return True
+
+    def _mirror_key(self, mirror_dir: Path) -> str:
+        return mirror_dir.relative_to(self.mirrors_dir).as_posix()
+
+    def evict_mirrors(self, max_age: float, max_size: int) -> None:
+        """Remove mirrors not used for more than max_age seconds, then remove
+        least recently used mirrors until their total size is at most max_size
+        bytes. Mirrors in use by other processes are kept.
+
+        Mirrors only grow when they are used, so nothing is done unless
+        mirrors were used through this cache. Only their size is measured,
+        the size of the other mirrors being recorded in the database.
+        """
+        if not self._used_mirror_dirs:
+            return
+        with self._lock:
+            recorded_sizes = dict(
+                self._tags_db_conn.execute("SELECT path, size FROM mirror_sizes")
+            )
+        now = time.time()
+        mirrors = []
+        measured_sizes = {}
+        for mirror_dir in self._get_mirror_dirs():
+            mtime = mirror_dir.stat().st_mtime
+            if now - mtime > max_age and self._remove_mirror(mirror_dir):
+                continue
+            key = self._mirror_key(mirror_dir)
+            size = recorded_sizes.get(key)
+            if size is None or mirror_dir in self._used_mirror_dirs:
+                size = measured_sizes[key] = self._get_dir_size(mirror_dir)
+            mirrors.append((mtime, mirror_dir, size))
+        total_size = sum(size for _, _, size in mirrors)
+        kept_keys = set()
+        for _mtime, mirror_dir, size in sorted(mirrors):
+            if total_size > max_size and self._remove_mirror(mirror_dir):
+                total_size -= size
+            else:
+                kept_keys.add(self._mirror_key(mirror_dir))
+        with self._lock, self._transaction(self._tags_db_conn):
+            self._tags_db_conn.executemany(
+                "DELETE FROM mirror_sizes WHERE path = ?",
+                ((key,) for key in recorded_sizes.keys() - kept_keys),
+            )
+            self._tags_db_conn.executemany(
+                "INSERT INTO mirror_sizes (path, size) VALUES (?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size",
+                (
+                    (key, size)
+                    for key, size in measured_sizes.items()
+                    if key in kept_keys
+                ),
+            )
@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from types import TracebackType
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock_file(fd: int, blocking: bool) -> bool:
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.1)
+            else:
+                return True
+
+    def _unlock_file(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock_file(fd: int, blocking: bool) -> bool:
+        try:
+            fcntl.flock(
+                fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            )
+        except BlockingIOError:
+            return False
+        return True
+
+    def _unlock_file(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class HostLimiter:
+    """Limit the number of concurrent remote operations per host."""
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.Semaphore] = {}
+
+    def _semaphore(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.Semaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    @contextmanager
+    def limit(self, *hosts: str) -> Iterator[None]:
+        # acquire in a stable order, to avoid deadlocks between
+        # operations involving several hosts
+        with ExitStack() as stack:
+            for host in sorted(set(hosts)):
+                stack.enter_context(self._semaphore(host))
+            yield
+
+
+class FileLock:
+    """An exclusive lock held on a file, across processes.
+
+    The lock file is created if needed and never removed, so that processes
+    always lock the same file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: int | None = None
+
+    @classmethod
+    def for_directory(cls, directory: Path) -> FileLock:
+        """The lock guarding a directory, in a sibling file."""
+        return cls(directory.with_name(f"{directory.name}.lock"))
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire the lock, returning False if it is held elsewhere
+        and not blocking."""
+        assert self._fd is None, "lock already acquired"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            locked = _lock_file(fd, blocking)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        assert self._fd is not None, "lock not acquired"
+        fd, self._fd = self._fd, None
+        try:
+            _unlock_file(fd)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> FileLock:
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.release()
@@ -1,24 +1,87 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import copy
+import dataclasses
+import functools
+import typing
 from pathlib import Path
-
-from pydantic import BaseModel
+from typing import Any, Optional
 
 from ._compat import tomllib
 from ._schemas import VcsVault
 
 
-class Config(BaseModel):
-    vcs_vaults: list[VcsVault] = []
+def _load_dataclass(cls: type[Any], data: Any) -> Any:
+    """Instantiate a dataclass whose fields have simple types, if the data
+    has exactly the expected types. Return None otherwise."""
+    if not isinstance(data, dict):
+        return None
+    kwargs = {}
+    types = typing.get_type_hints(cls)
+    for field in dataclasses.fields(cls):
+        if field.name not in data:
+            if field.default is dataclasses.MISSING:
+                return None
+            continue
+        value = data[field.name]
+        if type(value) is not types[field.name]:
+            return None
+        kwargs[field.name] = value
+    return cls(**kwargs)
+
+
+@dataclasses.dataclass
+class Config:
+    vcs_vaults: list[VcsVault] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def _from_dict_fast(cls, config_dict: dict[str, Any]) -> Optional["Config"]:
+        vcs_vaults_data = config_dict.get("vcs_vaults", [])
+        if not isinstance(vcs_vaults_data, list):
+            return None
+        vcs_vaults = []
+        for vcs_vault_data in vcs_vaults_data:
+            vcs_vault = _load_dataclass(VcsVault, vcs_vault_data)
+            if vcs_vault is None:
+                return None
+            vcs_vaults.append(vcs_vault)
+        return cls(vcs_vaults=vcs_vaults)
+
+    @classmethod
+    def from_dict(cls, config_dict: dict[str, Any]) -> "Config":
+        """Validate the configuration, ignoring unknown keys.
+
+        Configurations with the expected types are loaded directly, others are
+        validated with pydantic, which is comparatively slow to import.
+        """
+        config = cls._from_dict_fast(config_dict)
+        if config is None:
+            import pydantic
+
+            config = pydantic.TypeAdapter(cls).validate_python(config_dict)
+        return config
 
     @classmethod
     def from_pyproject_toml(cls, project_root: Path) -> "Config":
         pyproject_toml_path = project_root / "pyproject.toml"
         if not pyproject_toml_path.is_file():
             return Config()
-        pyproject_toml = tomllib.loads(pyproject_toml_path.read_text(encoding="utf-8"))
-        config_dict = pyproject_toml.get("tool", {}).get(
-            "pip-preserve-requirements", {}
+        stat = pyproject_toml_path.stat()
+        # a copy, so callers can't change the cached configuration
+        return copy.deepcopy(
+            _load_pyproject_toml(
+                pyproject_toml_path.resolve(), stat.st_mtime_ns, stat.st_size
+            )
         )
-        return Config(**config_dict)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_pyproject_toml(
+    pyproject_toml_path: Path, _mtime_ns: int, _size: int
+) -> Config:
+    """Load the configuration once per version of the file, for long running
+    processes such as the daemon."""
+    pyproject_toml = tomllib.loads(pyproject_toml_path.read_text(encoding="utf-8"))
+    config_dict = pyproject_toml.get("tool", {}).get("pip-preserve-requirements", {})
+    return Config.from_dict(config_dict)
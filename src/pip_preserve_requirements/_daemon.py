@@ -0,0 +1,264 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""A local daemon running commands with warm caches, and its thin client.
+
+The client forwards its arguments and working directory to the daemon over a
+Unix socket, and receives the output and exit code of the command. Frames are
+JSON objects, one per line. The client only imports the standard library, so
+it starts quickly.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+from collections.abc import Sequence
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import Any, TextIO
+
+PROG_NAME = "pip-preserve-requirements"
+SOCKET_ENV_VAR = "PIP_PRESERVE_REQUIREMENTS_DAEMON_SOCKET"
+UNSUPPORTED_MESSAGE = (
+    "The daemon is not supported on this platform, which has no Unix sockets."
+)
+
+
+def default_socket_path() -> Path:
+    """The socket of the daemon of the user, in $XDG_RUNTIME_DIR if set,
+    or in the cache directory of the user."""
+    if os.environ.get(SOCKET_ENV_VAR):
+        return Path(os.environ[SOCKET_ENV_VAR])
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return Path(os.environ["XDG_RUNTIME_DIR"]) / f"{PROG_NAME}.sock"
+    from ._cache import user_cache_dir
+
+    return user_cache_dir() / "daemon.sock"
+
+
+def _connect(socket_path: Path) -> socket.socket | None:
+    """Connect to the daemon, returning None if it is not running."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.fspath(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return sock
+
+
+def run_client(
+    args: Sequence[str],
+    socket_path: Path,
+    stdout: TextIO,
+    stderr: TextIO,
+) -> int | None:
+    """Run the command in the daemon, writing its output as it comes.
+
+    Return its exit code, or None if the daemon is not running.
+    """
+    sock = _connect(socket_path)
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as f:
+        request = {"args": list(args), "cwd": os.getcwd()}
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        for line in f:
+            frame = json.loads(line)
+            if "stdout" in frame:
+                stdout.write(frame["stdout"])
+                stdout.flush()
+            elif "stderr" in frame:
+                stderr.write(frame["stderr"])
+                stderr.flush()
+            elif "exit_code" in frame:
+                return int(frame["exit_code"])
+    stderr.write("The daemon closed the connection.\n")
+    return 1
+
+
+def client_main() -> None:
+    """Run the command in the daemon if it is running, or in-process otherwise."""
+    socket_path = default_socket_path()
+    exit_code = run_client(sys.argv[1:], socket_path, sys.stdout, sys.stderr)
+    if exit_code is None:
+        from .__main__ import main
+
+        main()
+        return
+    sys.exit(exit_code)
+
+
+def _send_frame(wfile: io.BufferedIOBase, frame: dict[str, Any]) -> None:
+    wfile.write(json.dumps(frame).encode() + b"\n")
+    wfile.flush()
+
+
+class _FrameWriter(io.TextIOBase):
+    """A text stream sending what is written to the client, as frames."""
+
+    def __init__(
+        self, wfile: io.BufferedIOBase, name: str, lock: threading.Lock
+    ) -> None:
+        self._wfile = wfile
+        self._name = name
+        self._lock = lock
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        if not isinstance(s, str):
+            # click probes whether streams accept bytes
+            raise TypeError(f"write() argument must be str, not {type(s).__name__}")
+        if s:
+            with self._lock:
+                _send_frame(self._wfile, {self._name: s})
+        return len(s)
+
+
+class Daemon:
+    """Run commands sent over a Unix socket, one at a time.
+
+    Imported modules, the parsed configurations, the tags database
+    connections and the connections to forge APIs stay warm between commands.
+    Commands run with the environment of the daemon.
+    """
+
+    def __init__(self, socket_path: Path) -> None:
+        self.socket_path = socket_path
+        # commands change the working directory and redirect the standard
+        # streams of the process, so they can't run concurrently
+        self._lock = threading.Lock()
+
+    def _warm_up(self) -> None:
+        from . import _cache, _tag_requirements  # noqa: F401
+
+        _cache.keep_connections_open()
+        # pip_requirements_parser and pydantic are slow to import
+        import pip_requirements_parser  # type: ignore[import-untyped] # noqa: F401
+        import pydantic  # noqa: F401
+
+    def run_command(
+        self, args: Sequence[str], cwd: str, wfile: io.BufferedIOBase
+    ) -> int:
+        """Run the command, sending its output to the client."""
+        from typer.main import get_command
+
+        from . import _utils
+        from .__main__ import app
+
+        frame_lock = threading.Lock()
+        stdout = _FrameWriter(wfile, "stdout", frame_lock)
+        stderr = _FrameWriter(wfile, "stderr", frame_lock)
+        with self._lock, redirect_stdout(stdout), redirect_stderr(stderr):
+            previous_cwd = os.getcwd()
+            previous_verbosity = _utils._verbosity
+            os.chdir(cwd)
+            try:
+                get_command(app).main(list(args), prog_name=PROG_NAME)
+            except SystemExit as e:
+                if e.code is None:
+                    return 0
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                stderr.write(traceback.format_exc())
+                return 1
+            finally:
+                os.chdir(previous_cwd)
+                _utils._verbosity = previous_verbosity
+        return 0
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn, conn.makefile("rwb") as f:
+            line = f.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            exit_code = self.run_command(request["args"], request["cwd"], f)
+            _send_frame(f, {"exit_code": exit_code})
+
+    def _bind(self) -> socket.socket:
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError(UNSUPPORTED_MESSAGE)
+        if _connect(self.socket_path) is not None:
+            raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+        # remove the socket of a daemon that did not exit cleanly
+        self.socket_path.unlink(missing_ok=True)
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user may connect
+        previous_umask = os.umask(0o177)
+        try:
+            sock.bind(os.fspath(self.socket_path))
+        finally:
+            os.umask(previous_umask)
+        sock.listen()
+        return sock
+
+    def serve(self, ready: threading.Event | None = None) -> None:
+        """Serve commands until the socket is closed by shutdown()."""
+        self._warm_up()
+        self._sock = self._bind()
+        if ready is not None:
+            ready.set()
+        try:
+            while True:
+                try:
+                    conn, _ = self._sock.accept()
+                except OSError:
+                    # the socket was closed
+                    break
+                thread = threading.Thread(
+                    target=self._handle, args=(conn,), daemon=True
+                )
+                thread.start()
+        finally:
+            self.socket_path.unlink(missing_ok=True)
+
+    def shutdown(self) -> None:
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._sock.close()
+
+
+def daemon_main() -> None:
+    import typer
+
+    def serve(
+        socket_path: Path = typer.Option(  # noqa: B008
+            None,
+            "--socket",
+            help=(
+                "The Unix socket to listen on. By default, "
+                f"${SOCKET_ENV_VAR}, or a socket in $XDG_RUNTIME_DIR "
+                "or in the cache directory of the user."
+            ),
+        ),
+    ) -> None:
+        """Run commands sent by pip-preserve-requirements-client, with warm
+        caches, until interrupted."""
+        if not hasattr(socket, "AF_UNIX"):
+            typer.echo(UNSUPPORTED_MESSAGE, err=True)
+            raise typer.Exit(1)
+        if socket_path is None:
+            socket_path = default_socket_path()
+        from ._ssh import shared_ssh_connections
+
+        typer.echo(f"Listening on {socket_path}", err=True)
+        try:
+            # SSH connections are shared between commands, until they are idle
+            with shared_ssh_connections():
+                Daemon(socket_path).serve()
+        except KeyboardInterrupt:
+            pass
+
+    typer.run(serve)
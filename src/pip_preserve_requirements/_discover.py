@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import glob
+import os
+import re
+import subprocess
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+from ._profile import run_subprocess
+
+_GLOB_CHARS_RE = re.compile(r"[*?[]")
+
+
+def _translate(pattern: str) -> re.Pattern[str]:
+    """Translate a gitignore style glob pattern to a regular expression.
+
+    ``*`` and ``?`` do not match ``/``, while ``**`` matches any number of
+    directories.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            regex += "[" + pattern[i + 1 : end].replace("!", "^", 1) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex)
+
+
+class PathPattern:
+    """A glob pattern, matching the file name if it has no slash,
+    or the path relative to its base directory otherwise."""
+
+    def __init__(self, pattern: str) -> None:
+        self.anchored = "/" in pattern
+        self._regex = _translate(pattern.lstrip("/"))
+
+    def matches(self, rel_path: str) -> bool:
+        if not self.anchored:
+            rel_path = rel_path.rsplit("/", 1)[-1]
+        return self._regex.fullmatch(rel_path) is not None
+
+
+def _git_files(directory: Path) -> list[str] | None:
+    """The files of the git working tree in the directory, tracked or not
+    ignored by git, relative to the directory, or None if the directory is not
+    in a git working tree."""
+    try:
+        result = run_subprocess(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            cwd=directory,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # files of submodules are not listed; submodules and nested repositories
+    # are, as directories
+    return [rel_path for rel_path in result.stdout.split("\0") if rel_path]
+
+
+def _walk(directory: Path, rel_path: str = "") -> Iterable[str]:
+    """The files in the directory, outside git, relative to the directory."""
+    with os.scandir(directory) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.name == ".git":
+            continue
+        entry_rel_path = f"{rel_path}/{entry.name}" if rel_path else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(Path(entry.path), entry_rel_path)
+        else:
+            yield entry_rel_path
+
+
+def _find(
+    directory: Path,
+    include: Sequence[PathPattern],
+    exclude: Sequence[PathPattern],
+) -> list[Path]:
+    rel_paths = _git_files(directory)
+    if rel_paths is None:
+        rel_paths = list(_walk(directory))
+    return [
+        directory / rel_path
+        for rel_path in sorted(rel_paths, key=lambda rel_path: rel_path.split("/"))
+        if any(pattern.matches(rel_path) for pattern in include)
+        and not any(pattern.matches(rel_path) for pattern in exclude)
+        # tracked files may have been deleted
+        and (directory / rel_path).is_file()
+    ]
+
+
+def _expand(path: Path) -> list[Path]:
+    if path.exists() or not _GLOB_CHARS_RE.search(str(path)):
+        return [path]
+    return [Path(p) for p in sorted(glob.glob(str(path), recursive=True))]
+
+
+def discover_requirements_files(
+    paths: Iterable[Path], include: Sequence[str], exclude: Sequence[str] = ()
+) -> list[Path]:
+    """Return the requirements files designated by the given paths.
+
+    Paths may be files, directories or glob patterns. Directories are
+    searched recursively for files matching the include patterns and none
+    of the exclude patterns, relative to the directory. In a git working
+    tree, files ignored by git are skipped. Each file is returned once.
+    """
+    include_patterns = [PathPattern(pattern) for pattern in include]
+    exclude_patterns = [PathPattern(pattern) for pattern in exclude]
+    seen: set[str] = set()
+    result = []
+    for path in paths:
+        expanded_paths = _expand(path)
+        if not expanded_paths or not expanded_paths[0].exists():
+            raise FileNotFoundError(f"No requirements file found for {path}")
+        for expanded_path in expanded_paths:
+            if expanded_path.is_dir():
+                files = _find(expanded_path, include_patterns, exclude_patterns)
+            else:
+                files = [expanded_path]
+            for file in files:
+                real_path = os.path.realpath(file)
+                if real_path not in seen:
+                    seen.add(real_path)
+                    result.append(file)
+    return result
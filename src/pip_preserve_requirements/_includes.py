@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import os
+import re
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from ._utils import log_warning
+
+_INCLUDE_RE = re.compile(
+    r"^\s*(-r|--requirement|-c|--constraint)"
+    # short options may be followed by the path without separator
+    r"(\s*=\s*|\s+|(?<=-[rc]))"
+    r"(?P<path>\S+)"
+)
+_URL_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+def find_includes(requirements_file_path: Path) -> Iterator[Path]:
+    """Return the files included with -r or -c by a requirements file.
+
+    Like pip, relative paths are relative to the including file.
+    """
+    with requirements_file_path.open(encoding="utf-8", errors="replace") as f:
+        for line in f:
+            mo = _INCLUDE_RE.match(line)
+            if mo is None:
+                continue
+            include = mo.group("path")
+            if _URL_RE.match(include):
+                log_warning(f"{requirements_file_path}: can't follow {include}")
+                continue
+            yield requirements_file_path.parent / include
+
+
+def walk_includes(requirements_file_paths: Iterable[Path]) -> list[Path]:
+    """Return the requirements files and the files they include, recursively.
+
+    Each physical file is returned once, in depth first order. Include cycles
+    and missing included files are reported.
+    """
+    seen: set[Path] = set()
+    result = []
+
+    def visit(path: Path, stack: list[Path]) -> None:
+        real_path = Path(os.path.realpath(path))
+        if real_path in stack:
+            cycle = [*stack[stack.index(real_path) :], real_path]
+            log_warning("Include cycle: " + " -> ".join(str(p) for p in cycle))
+            return
+        if real_path in seen:
+            return
+        seen.add(real_path)
+        result.append(path)
+        for include in find_includes(path):
+            if not include.is_file():
+                log_warning(f"{path}: included file {include} not found")
+                continue
+            visit(include, [*stack, real_path])
+
+    for path in requirements_file_paths:
+        visit(path, [])
+    return result
@@ -0,0 +1,283 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import contextvars
+import dataclasses
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, TypeVar, cast
+from urllib.parse import urlsplit
+
+import typer
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+# the ids of the open spans of the current thread, or asyncio task
+_span_stack: contextvars.ContextVar[tuple[int, ...]] = contextvars.ContextVar(
+    "span_stack", default=()
+)
+
+
+@dataclasses.dataclass
+class Span:
+    """A timed operation, with attributes such as the remote host."""
+
+    name: str
+    span_id: int
+    parent_id: int | None
+    # seconds since the epoch
+    start: float
+    duration: float = 0.0
+    attributes: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+
+class Profiler:
+    """Record the spans of a run, from any thread."""
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self.trace_id = os.urandom(16).hex()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._start = time.time()
+        self._perf_start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, attributes: dict[str, Any]) -> Iterator[None]:
+        stack = _span_stack.get()
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        perf_start = time.perf_counter()
+        span = Span(
+            name,
+            span_id,
+            stack[-1] if stack else None,
+            self._start + perf_start - self._perf_start,
+            attributes=attributes,
+        )
+        token = _span_stack.set((*stack, span_id))
+        try:
+            yield
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            _span_stack.reset(token)
+            span.duration = time.perf_counter() - perf_start
+            with self._lock:
+                self.spans.append(span)
+
+    def report(self, top: int = 10) -> str:
+        """An aggregated report of the recorded spans."""
+        lines = [f"Profile: {time.perf_counter() - self._perf_start:.2f}s"]
+        by_name: dict[str, list[float]] = {}
+        by_repo: dict[str, float] = {}
+        cache_lookups = cache_hits = 0
+        subprocesses = output_bytes = 0
+        for span in self.spans:
+            by_name.setdefault(span.name, []).append(span.duration)
+            if "repo" in span.attributes:
+                repo = span.attributes["repo"]
+                by_repo[repo] = by_repo.get(repo, 0.0) + span.duration
+            if "cached" in span.attributes:
+                cache_lookups += 1
+                cache_hits += bool(span.attributes["cached"])
+            if span.name == "subprocess":
+                subprocesses += 1
+                output_bytes += span.attributes.get("bytes", 0)
+        lines.append(f"{'operation':<32}{'count':>8}{'total':>10}{'max':>10}")
+        for name, durations in sorted(by_name.items(), key=lambda i: -sum(i[1])):
+            lines.append(
+                f"{name:<32}{len(durations):>8}"
+                f"{sum(durations):>9.2f}s{max(durations):>9.2f}s"
+            )
+        lines.append(f"Subprocesses: {subprocesses} ({output_bytes} bytes of output)")
+        if cache_lookups:
+            lines.append(
+                f"Cache hit ratio: {cache_hits}/{cache_lookups} "
+                f"({100 * cache_hits / cache_lookups:.0f}%)"
+            )
+        if by_repo:
+            lines.append("Top repositories by remote time:")
+            for repo, duration in sorted(by_repo.items(), key=lambda i: -i[1])[:top]:
+                lines.append(f"  {repo:<60}{duration:>9.2f}s")
+        return "\n".join(lines)
+
+    @classmethod
+    def _otlp_value(cls, value: Any) -> dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            # 64 bit integers are strings in OTLP JSON
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def to_otlp_json(self) -> str:
+        """Export the spans in the OpenTelemetry protocol JSON format,
+        as accepted by OpenTelemetry collectors."""
+        spans = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": f"{span.span_id:016x}",
+                "name": span.name,
+                # SPAN_KIND_INTERNAL
+                "kind": 1,
+                "startTimeUnixNano": str(int(span.start * 1e9)),
+                "endTimeUnixNano": str(int((span.start + span.duration) * 1e9)),
+                "attributes": [
+                    {"key": key, "value": self._otlp_value(value)}
+                    for key, value in span.attributes.items()
+                ],
+            }
+            if span.parent_id is not None:
+                otlp_span["parentSpanId"] = f"{span.parent_id:016x}"
+            spans.append(otlp_span)
+        resource_attributes = [
+            {"key": "service.name", "value": {"stringValue": __package__}},
+        ]
+        return json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": resource_attributes},
+                        "scopeSpans": [
+                            {"scope": {"name": __name__}, "spans": spans},
+                        ],
+                    }
+                ]
+            },
+            indent=1,
+        )
+
+
+_profiler: Profiler | None = None
+
+
+def enable_profiling() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable_profiling() -> None:
+    global _profiler
+    _profiler = None
+
+
+@contextmanager
+def profiling(report: bool, output: Path | None = None) -> Iterator[None]:
+    """Profile the enclosed operations, then print an aggregated report to
+    stderr, and export the spans to the output file, if any."""
+    if not report and output is None:
+        yield
+        return
+    profiler = enable_profiling()
+    try:
+        yield
+    finally:
+        disable_profiling()
+        if report:
+            typer.echo(profiler.report(), err=True)
+        if output is not None:
+            output.write_text(profiler.to_otlp_json(), encoding="utf-8")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+    """Time the operation, if profiling is enabled.
+
+    The attributes are yielded, for the operation to record its results.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield attributes
+        return
+    with profiler.span(name, attributes):
+        yield attributes
+
+
+def profiled(name: str) -> Callable[[_F], _F]:
+    """Decorate a function, to time its calls if profiling is enabled."""
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.span(name, {}):
+                return func(*args, **kwargs)
+
+        return cast(_F, wrapper)
+
+    return decorator
+
+
+def repo_attributes(url: str) -> dict[str, str]:
+    """The host and repository attributes of a remote repository URL."""
+    split_result = urlsplit(url)
+    if not split_result.hostname:
+        return {}
+    return {
+        "host": split_result.hostname,
+        "repo": split_result.hostname + split_result.path.removesuffix(".git"),
+    }
+
+
+@contextmanager
+def subprocess_span(cmd: Sequence[str]) -> Iterator[dict[str, Any]]:
+    """Time a subprocess, recording its command and the remote repository it
+    accesses, if any.
+
+    The attributes are yielded, for the caller to record the return code and
+    output size.
+    """
+    if _profiler is None:
+        yield {}
+        return
+    # the program and its subcommand, without global options such as -c
+    command = [cmd[0]]
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ("-c", "-C"):
+            next(args, None)
+        elif not arg.startswith("-"):
+            command.append(arg)
+            break
+    with span("subprocess", command=" ".join(command)) as attributes:
+        for arg in cmd:
+            if "://" in arg:
+                attributes.update(repo_attributes(arg))
+                break
+        yield attributes
+
+
+def run_subprocess(
+    cmd: Sequence[str], **kwargs: Any
+) -> subprocess.CompletedProcess[Any]:
+    """Run a subprocess, recording its command, output size, and the remote
+    repository it accesses, if any."""
+    if _profiler is None:
+        return subprocess.run(cmd, **kwargs)
+    with subprocess_span(cmd) as attributes:
+        try:
+            result = subprocess.run(cmd, **kwargs)
+        except subprocess.CalledProcessError as e:
+            attributes["returncode"] = e.returncode
+            raise
+        attributes["returncode"] = result.returncode
+        if result.stdout is not None:
+            attributes["bytes"] = len(result.stdout)
+        return result
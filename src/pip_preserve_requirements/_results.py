@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import threading
+import time
+from typing import TextIO
+
+# the actions reported for requirements
+CACHED = "cached"  # a tag is known from the cache, the remote was not accessed
+VERIFIED = "verified"  # a tag was found on the remote
+TAGGED = "tagged"  # a tag was created on the remote
+PUSHED = "pushed"  # the commit was pushed to a vault and tagged
+SKIPPED = "skipped"  # the requirement can't be preserved
+MISSING = "missing"  # with --check, the requirement is not preserved
+FAILED = "failed"  # the tag could not be placed
+
+
+@dataclasses.dataclass
+class RequirementResult:
+    """The outcome of preserving, or checking, a pinned requirement."""
+
+    file: str
+    # the line number in the file, starting at 1
+    line: int
+    url: str
+    # the URL of the requirement in its vault, if it is preserved
+    vaulted_url: str | None
+    action: str
+    # whether the tags of the commit were known from the cache
+    cached: bool
+    error: str | None = None
+
+
+class ResultsWriter:
+    """Write results as JSON lines, as soon as they are known, from any thread.
+
+    Each record has the elapsed time since the writer was created, in seconds.
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def write(self, result: RequirementResult) -> None:
+        record = dataclasses.asdict(result)
+        record["elapsed"] = round(time.perf_counter() - self._start, 3)
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._stream.write(line)
+            self._stream.flush()
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import dataclasses
+import re
+from pathlib import Path
+
+# options that need the full parser
+_INCLUDE_RE = re.compile(r"^(-r|--requirement|-c|--constraint)")
+_EDITABLE_RE = re.compile(r"^(-e|--editable)(\s+|\s*=\s*)(?P<url>[^\s;]+)")
+_NAME_AT_URL_RE = re.compile(
+    r"^[A-Za-z0-9][A-Za-z0-9._-]*\s*(\[[^\]]*\])?\s*@\s*(?P<url>[^\s;]+)"
+)
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*\s*(\[[^\]]*\])?\s*([<>=!~;#]|$)")
+# a URL or a path
+_LINK_RE = re.compile(r"^(?P<url>[^\s;]*[/\\:][^\s;]*)")
+
+
+class UnsupportedRequirementsFile(Exception):
+    """The file must be processed with the full parser."""
+
+
+@dataclasses.dataclass
+class ScannedLink:
+    url: str
+
+
+@dataclasses.dataclass
+class ScannedRequirement:
+    """A requirement with a link, mimicking InstallRequirement.link."""
+
+    link: ScannedLink
+    line_number: int
+    # the position of the URL in the line
+    start: int
+    end: int
+
+
+class ScannedRequirementsFile:
+    """A requirements file scanned line by line, for the requirements
+    that have a link, such as ``name @ git+https://...``, ``-e git+https://...``
+    or a bare URL.
+
+    Only their URL is rewritten, the rest of the file is left untouched.
+    Files using features the scanner does not handle, such as includes or
+    line continuations, must be processed with pip_requirements_parser.
+    """
+
+    def __init__(self, lines: list[str], requirements: list[ScannedRequirement]):
+        # the lines, with their original line endings
+        self.lines = lines
+        self.requirements = requirements
+
+    @classmethod
+    def from_file(cls, path: Path) -> ScannedRequirementsFile:
+        lines = []
+        requirements = []
+        try:
+            with path.open(encoding="utf-8", newline="") as f:
+                for line_number, line in enumerate(f):
+                    lines.append(line)
+                    requirement = _scan_line(line.rstrip("\r\n"), line_number)
+                    if requirement is not None:
+                        requirements.append(requirement)
+        except UnicodeDecodeError as e:
+            raise UnsupportedRequirementsFile(f"{path}: {e}") from e
+        return cls(lines, requirements)
+
+    def dumps(self) -> str:
+        """The file content, with the current URL of each requirement."""
+        lines = list(self.lines)
+        for requirement in self.requirements:
+            line = lines[requirement.line_number]
+            lines[requirement.line_number] = (
+                line[: requirement.start]
+                + requirement.link.url
+                + line[requirement.end :]
+            )
+        return "".join(lines)
+
+
+def _scan_line(line: str, line_number: int) -> ScannedRequirement | None:
+    stripped = line.lstrip()
+    if not stripped or stripped.startswith("#"):
+        return None
+    if line.endswith("\\"):
+        raise UnsupportedRequirementsFile("line continuation")
+    if "${" in line:
+        raise UnsupportedRequirementsFile("environment variable")
+    if stripped.startswith("-"):
+        if _INCLUDE_RE.match(stripped):
+            raise UnsupportedRequirementsFile("include")
+        mo = _EDITABLE_RE.match(stripped)
+    else:
+        mo = _NAME_AT_URL_RE.match(stripped) or _LINK_RE.match(stripped)
+        if mo is None:
+            if _NAME_RE.match(stripped):
+                return None
+            raise UnsupportedRequirementsFile(f"line {line_number + 1}")
+    if mo is None:
+        # other options
+        return None
+    offset = len(line) - len(stripped)
+    return ScannedRequirement(
+        link=ScannedLink(mo.group("url")),
+        line_number=line_number,
+        start=offset + mo.start("url"),
+        end=offset + mo.end("url"),
+    )
+
+
+def scan_requirements_file(path: Path) -> ScannedRequirementsFile | None:
+    """Scan the file, or return None if it needs the full parser."""
+    try:
+        return ScannedRequirementsFile.from_file(path)
+    except UnsupportedRequirementsFile:
+        return None
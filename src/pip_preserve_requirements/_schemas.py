@@ -1,14 +1,20 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
-from pydantic import BaseModel
+import dataclasses
 
 
-class VcsVault(BaseModel):
+@dataclasses.dataclass
+class VcsVault:
     provider: str
     owner: str
     ssh_only: bool = False
     default: bool = False
+    # a git --filter spec, such as blob:none, to fetch pinned commits partially
+    fetch_filter: str = ""
+    # whether the repositories of the vault are forks of the source
+    # repositories, so pinned commits may already be in them
+    forks: bool = False
 
     def repo_url(self, repo: str, for_push: bool = True) -> str:
         if for_push or self.ssh_only:
@@ -0,0 +1,146 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""Share one SSH connection per host between the git commands of a run."""
+
+from __future__ import annotations
+
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from ._profile import run_subprocess
+from ._utils import log_debug
+
+# the number of seconds an idle master connection stays open, in case the
+# run ends without closing it
+CONTROL_PERSIST = 120
+
+# scp-like URLs, such as git@github.com:owner/repo
+_SCP_LIKE_URL_RE = re.compile(r"^[\w.-]+@[\w.-]+:")
+
+# whether multiplexing is enabled, by the outermost shared_ssh_connections()
+_enabled = False
+# whether multiplexing was set up, on the first SSH remote operation
+_set_up = False
+# the SSH command multiplexing options were added to, and the directory of
+# the control sockets, once set up
+_base_command: str | None = None
+_control_dir: Path | None = None
+_lock = threading.Lock()
+
+
+def _base_ssh_command() -> str | None:
+    """The SSH command git would use, or None if it is not a command to which
+    OpenSSH options can be added."""
+    if "GIT_SSH_COMMAND" in os.environ:
+        return os.environ["GIT_SSH_COMMAND"]
+    if "GIT_SSH" in os.environ:
+        # a program, which may not be OpenSSH, such as plink
+        return None
+    core_ssh_command = run_subprocess(
+        ["git", "config", "--get", "core.sshCommand"],
+        text=True,
+        capture_output=True,
+    ).stdout.strip()
+    return core_ssh_command or "ssh"
+
+
+def ssh_command(base_ssh_command: str, control_dir: Path) -> str:
+    """Add options to an SSH command, so that it reuses the master connection
+    to its host, or starts one."""
+    control_path = control_dir / "%C"
+    # the first value of an option wins, so options of the base command,
+    # such as ControlMaster=no, take precedence
+    return (
+        f"{base_ssh_command} -o ControlMaster=auto "
+        f"-o ControlPath={shlex.quote(str(control_path))} "
+        f"-o ControlPersist={CONTROL_PERSIST}"
+    )
+
+
+def _is_ssh_url(url: str) -> bool:
+    return url.startswith("ssh://") or _SCP_LIKE_URL_RE.match(url) is not None
+
+
+def use_shared_ssh_connections(url: str) -> None:
+    """Before a git command accesses the remote repository at url, let it share
+    SSH connections, if it uses SSH and shared connections are enabled.
+
+    They are set up on the first such command, so runs that access no remote
+    with SSH don't pay for it.
+    """
+    global _set_up, _base_command, _control_dir
+    if not _enabled or _set_up or not _is_ssh_url(url):
+        return
+    with _lock:
+        if not _enabled or _set_up:
+            return
+        _set_up = True
+        base_command = _base_ssh_command()
+        if base_command is None:
+            return
+        # in the temporary directory, since the path of sockets is limited
+        # to about 100 characters
+        control_dir = Path(tempfile.mkdtemp(prefix="ppr-ssh-"))
+        os.environ["GIT_SSH_COMMAND"] = ssh_command(base_command, control_dir)
+        _base_command = base_command
+        _control_dir = control_dir
+
+
+def _exit_masters(base_ssh_command: str, control_dir: Path) -> None:
+    for control_path in control_dir.iterdir():
+        log_debug(f"Closing SSH master connection {control_path.name}")
+        try:
+            # like git, run the command with the shell; a host is required,
+            # but the master is found by its socket
+            run_subprocess(
+                [
+                    "sh",
+                    "-c",
+                    f'{base_ssh_command} "$@"',
+                    base_ssh_command,
+                    *("-o", f"ControlPath={control_path}", "-O", "exit", "host"),
+                ],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+            )
+        except OSError:
+            pass
+
+
+@contextmanager
+def shared_ssh_connections(enabled: bool = True) -> Iterator[None]:
+    """Let git open at most one SSH connection per host, shared by the
+    enclosed operations, and close them on exit.
+
+    Connections are set up by use_shared_ssh_connections(). Nested uses keep
+    the connections of the outermost one.
+    """
+    global _enabled, _set_up, _base_command, _control_dir
+    if not enabled or _enabled or os.name == "nt":
+        yield
+        return
+    previous_ssh_command = os.environ.get("GIT_SSH_COMMAND")
+    _enabled = True
+    try:
+        yield
+    finally:
+        with _lock:
+            base_command, control_dir = _base_command, _control_dir
+            _enabled = _set_up = False
+            _base_command = _control_dir = None
+        if base_command is not None and control_dir is not None:
+            if previous_ssh_command is None:
+                del os.environ["GIT_SSH_COMMAND"]
+            else:
+                os.environ["GIT_SSH_COMMAND"] = previous_ssh_command
+            _exit_masters(base_command, control_dir)
+            shutil.rmtree(control_dir, ignore_errors=True)
@@ -3,22 +3,56 @@
 
 from __future__ import annotations
 
-from collections.abc import Sequence
+import dataclasses
+import hashlib
+import itertools
+import json
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-
-from pip_requirements_parser import (  # type: ignore[import-untyped]
-    Link,
-    RequirementsFile,
-)
+from typing import TYPE_CHECKING, Callable
 
 from ._cache import Cache
+from ._concurrency import HostLimiter
 from ._norm_reqs import normalize_req_lines
 from ._pip_vcs_url import PipVcsUrl, UnsupportedVcsUrlError
+from ._profile import span
+from ._results import (
+    CACHED,
+    FAILED,
+    MISSING,
+    PUSHED,
+    SKIPPED,
+    TAGGED,
+    VERIFIED,
+    RequirementResult,
+    ResultsWriter,
+)
+from ._scan_reqs import (
+    ScannedLink,
+    ScannedRequirement,
+    ScannedRequirementsFile,
+    scan_requirements_file,
+)
 from ._schemas import VcsVault
 from ._tag_name_factory import TagNameFactory
-from ._utils import log_info, log_warning
+from ._utils import (
+    file_digest,
+    log_debug,
+    log_error,
+    log_info,
+    log_warning,
+    write_text_if_changed,
+)
+from ._vcs import TagRequest, VcsError
 from ._vcs_registry import VcsRegistry, vcs_registry
 
+if TYPE_CHECKING:
+    from pip_requirements_parser import (  # type: ignore[import-untyped]
+        InstallRequirement,
+        RequirementsFile,
+    )
+
 
 def get_vault_for_pip_vcs_url(
     pip_vcs_url: PipVcsUrl, vcs_vaults: Sequence[VcsVault]
@@ -37,114 +71,848 @@ def get_vault_for_pip_vcs_url(
     return default_vault, True
 
 
-def _tag_commit_if_needed(
+RepoKey = tuple[str, str, str]
+
+
+def _repo_key(pip_vcs_url: PipVcsUrl) -> RepoKey:
+    return (pip_vcs_url.provider, pip_vcs_url.owner, pip_vcs_url.repo)
+
+
+class RemoteTagsIndex:
+    """In-memory index of remote tags, looked up at most once per commit.
+
+    Unless any tag is accepted, only the tag expected on each commit is looked
+    up, so only those tags are parsed and cached. Otherwise all tags of each
+    repository are listed.
+    """
+
+    def __init__(
+        self,
+        cache: Cache,
+        tag_name_factory: TagNameFactory,
+        vcs_registry: VcsRegistry = vcs_registry,
+    ) -> None:
+        self._cache = cache
+        self._tag_name_factory = tag_name_factory
+        self._vcs_registry = vcs_registry
+        self._tags_by_repo: dict[RepoKey, dict[str, list[str]]] = {}
+        # the repositories listed and the commits looked up on remotes
+        self._remote_repos: set[RepoKey] = set()
+        self._remote_commits: set[tuple[RepoKey, str]] = set()
+        # the errors of the lookups done by prefetch(), by repository
+        self._errors: dict[RepoKey, Exception] = {}
+
+    def _fetch(self, pip_vcs_url: PipVcsUrl) -> dict[str, list[str]]:
+        key = _repo_key(pip_vcs_url)
+        if key not in self._tags_by_repo:
+            with span("tags.list", cached=True) as attributes:
+                # use a recent listing from the cache, if any
+                remote_tags = self._cache.get_remote_tags(*key)
+                if remote_tags is None:
+                    attributes["cached"] = False
+                    remote_tags = self._vcs_registry(pip_vcs_url.vcs).get_remote_tags(
+                        pip_vcs_url.vcs_url()
+                    )
+                    self._cache.update_remote_tags(*key, remote_tags)
+                    self._remote_repos.add(key)
+            self._tags_by_repo[key] = remote_tags
+        return self._tags_by_repo[key]
+
+    def _get_cached_expected_tags(self, pip_vcs_url: PipVcsUrl) -> list[str] | None:
+        """Return the expected tag of the commit if it is on the remote, no tag
+        if it is not, according to the cache, or None if that is not known."""
+        key = _repo_key(pip_vcs_url)
+        tag = self._tag_name_factory.make_tag(pip_vcs_url.revision)
+        with span("tags.lookup", cached=True) as attributes:
+            remote_tags = self._cache.get_remote_tags(*key, tag)
+            if remote_tags is not None:
+                return list(remote_tags.get(pip_vcs_url.revision, []))
+            if self._cache.is_tag_missing(*key, tag):
+                return []
+            attributes["cached"] = False
+            return None
+
+    def _fetch_expected(self, pip_vcs_urls: Sequence[PipVcsUrl]) -> None:
+        """Look up the expected tags of commits of the same repository."""
+        key = _repo_key(pip_vcs_urls[0])
+        repo_tags = self._tags_by_repo.setdefault(key, {})
+        tags_to_fetch: dict[str, str] = {}
+        for pip_vcs_url in pip_vcs_urls:
+            sha = pip_vcs_url.revision
+            if sha in repo_tags:
+                continue
+            cached_tags = self._get_cached_expected_tags(pip_vcs_url)
+            if cached_tags is not None:
+                repo_tags[sha] = cached_tags
+            else:
+                tags_to_fetch[self._tag_name_factory.make_tag(sha)] = sha
+        if not tags_to_fetch:
+            return
+        with span("tags.fetch", tags=len(tags_to_fetch)):
+            tag_commits = self._vcs_registry(
+                pip_vcs_urls[0].vcs
+            ).get_remote_tag_commits(pip_vcs_urls[0].vcs_url(), list(tags_to_fetch))
+        missing_tags = []
+        for tag, sha in tags_to_fetch.items():
+            self._remote_commits.add((key, sha))
+            if tag_commits.get(tag) == sha:
+                self._cache.add_commit_tag(*key, sha, tag)
+                repo_tags[sha] = [tag]
+            else:
+                # the tag is absent, or on another commit and can't be used
+                missing_tags.append(tag)
+                repo_tags[sha] = []
+        self._cache.set_tags_missing(*key, missing_tags)
+
+    def _fetch_limited(
+        self, pip_vcs_urls: Sequence[PipVcsUrl], host_limiter: HostLimiter
+    ) -> None:
+        with host_limiter.limit(pip_vcs_urls[0].provider):
+            if self._tag_name_factory.match_any_tag:
+                self._fetch(pip_vcs_urls[0])
+            else:
+                self._fetch_expected(pip_vcs_urls)
+
+    def prefetch(
+        self,
+        pip_vcs_urls: Iterable[PipVcsUrl],
+        executor: Executor,
+        host_limiter: HostLimiter,
+        on_result: Callable[[RepoKey], None] | None = None,
+    ) -> None:
+        """Look up the tags of the given urls, with one request per repository.
+
+        A failed lookup is reported, and raised again when the tags of a
+        commit of that repository are requested, without affecting the
+        other repositories. on_result is called with each repository, as
+        soon as its lookup is done.
+        """
+        repos: dict[RepoKey, list[PipVcsUrl]] = {}
+        for pip_vcs_url in pip_vcs_urls:
+            repos.setdefault(_repo_key(pip_vcs_url), []).append(pip_vcs_url)
+        futures = {
+            executor.submit(self._fetch_limited, repo_pip_vcs_urls, host_limiter): key
+            for key, repo_pip_vcs_urls in repos.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                log_error(
+                    f"Could not look up the tags of {repos[key][0].vcs_url()}: {e}"
+                )
+                self._errors[key] = e
+            if on_result is not None:
+                on_result(key)
+
+    def get_commit_tags(self, pip_vcs_url: PipVcsUrl) -> list[str]:
+        error = self._errors.get(_repo_key(pip_vcs_url))
+        if error is not None:
+            raise error
+        if self._tag_name_factory.match_any_tag:
+            return list(self._fetch(pip_vcs_url).get(pip_vcs_url.revision, []))
+        self._fetch_expected([pip_vcs_url])
+        return list(self._tags_by_repo[_repo_key(pip_vcs_url)][pip_vcs_url.revision])
+
+    def is_from_remote(self, pip_vcs_url: PipVcsUrl) -> bool:
+        """Whether the tags of the commit were looked up on the remote during
+        this run, rather than found in the cache."""
+        key = _repo_key(pip_vcs_url)
+        return (
+            key in self._remote_repos
+            or (key, pip_vcs_url.revision) in self._remote_commits
+        )
+
+    def get_known_commit_tags(self, pip_vcs_url: PipVcsUrl) -> list[str] | None:
+        """Return the tags of the commit if they were already looked up,
+        in this run or recently according to the cache, without
+        accessing the network. Return None otherwise."""
+        key = _repo_key(pip_vcs_url)
+        if not self._tag_name_factory.match_any_tag:
+            repo_tags = self._tags_by_repo.setdefault(key, {})
+            if pip_vcs_url.revision not in repo_tags:
+                cached_tags = self._get_cached_expected_tags(pip_vcs_url)
+                if cached_tags is None:
+                    return None
+                repo_tags[pip_vcs_url.revision] = cached_tags
+            return list(repo_tags[pip_vcs_url.revision])
+        remote_tags = self._tags_by_repo.get(key)
+        if remote_tags is None:
+            remote_tags = self._cache.get_remote_tags(*key)
+            if remote_tags is None:
+                return None
+            self._tags_by_repo[key] = remote_tags
+        return list(remote_tags.get(pip_vcs_url.revision, []))
+
+
+def _has_cached_tag(
+    pip_vcs_url: PipVcsUrl, cache: Cache, tag_name_factory: TagNameFactory
+) -> bool:
+    with span("tags.cached", cached=False) as attributes:
+        for tag in cache.get_commit_tags(
+            pip_vcs_url.provider,
+            pip_vcs_url.owner,
+            pip_vcs_url.repo,
+            pip_vcs_url.revision,
+        ):
+            if tag_name_factory.matches_tag(tag):
+                attributes["cached"] = True
+                return True
+        return False
+
+
+@dataclasses.dataclass
+class _TagPlacement:
+    """A tag to place on a commit and push to a target repository."""
+
+    pip_vcs_url: PipVcsUrl
+    target_pip_vcs_url: PipVcsUrl
+    tag: str
+    # the fetch filter of the vault of the target repository
+    fetch_filter: str = ""
+    # whether the target repository is a fork of the source repository
+    target_is_fork: bool = False
+
+    @property
+    def target_url(self) -> str:
+        return self.target_pip_vcs_url.vcs_url(for_push=True)
+
+    def tag_request(self, cache: Cache) -> TagRequest:
+        return TagRequest(
+            self.pip_vcs_url.vcs_url(),
+            self.pip_vcs_url.revision,
+            self.tag,
+            mirror_dir=cache.mirror_dir(*_repo_key(self.pip_vcs_url)),
+            fetch_filter=self.fetch_filter,
+            target_is_fork=self.target_is_fork,
+        )
+
+    def update_cache(self, cache: Cache) -> None:
+        # other tags of the commit, from listings, are already in cache
+        cache.add_commit_tag(
+            *_repo_key(self.target_pip_vcs_url), self.pip_vcs_url.revision, self.tag
+        )
+
+
+def _plan_tag_commit(
     pip_vcs_url: PipVcsUrl,
     cache: Cache,
     tag_name_factory: TagNameFactory,
-    vcs_registry: VcsRegistry = vcs_registry,
-) -> None:
-    for tag in cache.get_commit_tags(
-        pip_vcs_url.provider,
-        pip_vcs_url.owner,
-        pip_vcs_url.repo,
-        pip_vcs_url.revision,
-    ):
-        if tag_name_factory.matches_tag(tag):
-            # we have a tag in cache, assume it has not been removed on the remote
-            return
-    remote_tags = vcs_registry(pip_vcs_url.vcs).get_remote_tags_for_commit(
-        pip_vcs_url.vcs_url(), pip_vcs_url.revision
-    )
-    new_tags = []
+    remote_tags_index: RemoteTagsIndex,
+    fetch_filter: str = "",
+) -> _TagPlacement | None:
+    """Return the tag to place on the commit, if it has no matching tag yet."""
+    if _has_cached_tag(pip_vcs_url, cache, tag_name_factory):
+        # we have a tag in cache, assume it has not been removed on the remote
+        return None
+    remote_tags = remote_tags_index.get_commit_tags(pip_vcs_url)
     for tag in remote_tags:
         if tag_name_factory.matches_tag(tag):
-            # a tag already exists on the remote
-            break
-    else:
-        # no matching tag found on the remote, create one
-        tag = tag_name_factory.make_tag(pip_vcs_url.revision)
-        log_info(f"Creating tag {tag} on {pip_vcs_url.vcs_url()}")
-        vcs_registry(pip_vcs_url.vcs).place_tag_on_commit(
-            pip_vcs_url.vcs_url(),
-            pip_vcs_url.vcs_url(for_push=True),
-            pip_vcs_url.revision,
-            tag,
-        )
-        new_tags.append(tag)
-    # update the cache with the tags found on the remote
-    cache.update_commit_tags(
-        pip_vcs_url.provider,
-        pip_vcs_url.owner,
-        pip_vcs_url.repo,
-        pip_vcs_url.revision,
-        remote_tags + new_tags,
-    )
+            # a tag already exists on the remote, and the listing is in cache
+            return None
+    # no matching tag found on the remote, create one
+    tag = tag_name_factory.make_tag(pip_vcs_url.revision)
+    log_info(f"Creating tag {tag} on {pip_vcs_url.vcs_url()}")
+    return _TagPlacement(pip_vcs_url, pip_vcs_url, tag, fetch_filter)
 
 
-def _push_and_tag_commit_to_vault(
+def _plan_push_to_vault(
     pip_vcs_url: PipVcsUrl,
     vcs_vault: VcsVault,
     cache: Cache,
     tag_name_factory: TagNameFactory,
-    vcs_registry: VcsRegistry = vcs_registry,
-) -> PipVcsUrl:
-    vault_pip_vcs_url = pip_vcs_url.with_provider(
-        provider=vcs_vault.provider, owner=vcs_vault.owner, ssh_only=vcs_vault.ssh_only
-    )
+) -> _TagPlacement:
+    vault_pip_vcs_url = _vault_pip_vcs_url(pip_vcs_url, vcs_vault)
     tag = tag_name_factory.make_tag(pip_vcs_url.revision)
     source_url = pip_vcs_url.vcs_url()
     target_url = vault_pip_vcs_url.vcs_url(for_push=True)
     log_info(f"Pushing {source_url} to {target_url} and tagging as {tag}")
-    vcs_registry(pip_vcs_url.vcs).place_tag_on_commit(
-        source_url,
-        target_url,
-        pip_vcs_url.revision,
+    return _TagPlacement(
+        pip_vcs_url,
+        vault_pip_vcs_url,
         tag,
+        vcs_vault.fetch_filter,
+        target_is_fork=vcs_vault.forks,
     )
-    cache.add_commit_tag(
-        vault_pip_vcs_url.provider,
-        vault_pip_vcs_url.owner,
-        vault_pip_vcs_url.repo,
-        pip_vcs_url.revision,
-        tag,
+
+
+def _place_tag(
+    tag_placement: _TagPlacement, cache: Cache, vcs_registry: VcsRegistry
+) -> None:
+    tag_request = tag_placement.tag_request(cache)
+    vcs_registry(tag_placement.pip_vcs_url.vcs).place_tag_on_commit(
+        tag_request.source_repo,
+        tag_placement.target_url,
+        tag_request.sha,
+        tag_request.tag,
+        mirror_dir=tag_request.mirror_dir,
+        fetch_filter=tag_request.fetch_filter,
     )
-    return vault_pip_vcs_url
+    tag_placement.update_cache(cache)
 
 
-def tag_requirements_file(
-    requirements_file_path: Path,
-    vcs_vaults: Sequence[VcsVault],
+def _place_tags(
+    tag_placements: Sequence[_TagPlacement],
+    cache: Cache,
+    vcs_registry: VcsRegistry,
+    host_limiter: HostLimiter,
+) -> dict[str, Exception | None]:
+    """Place tags that have the same target repository, with a single push.
+
+    Return the outcome for each tag.
+    """
+    first_tag_placement = tag_placements[0]
+    hosts = [
+        first_tag_placement.target_pip_vcs_url.provider,
+        *(tag_placement.pip_vcs_url.provider for tag_placement in tag_placements),
+    ]
+    with host_limiter.limit(*hosts):
+        results = vcs_registry(
+            first_tag_placement.pip_vcs_url.vcs
+        ).place_tags_on_commits(
+            first_tag_placement.target_url,
+            [tag_placement.tag_request(cache) for tag_placement in tag_placements],
+        )
+    errors: dict[str, Exception | None] = {}
+    for tag_placement in tag_placements:
+        error = results.get(tag_placement.tag)
+        if tag_placement.tag not in results:
+            error = VcsError(f"No result for tag {tag_placement.tag}")
+        if error is None:
+            tag_placement.update_cache(cache)
+        errors[tag_placement.tag] = error
+    return errors
+
+
+def _tag_commit_if_needed(
+    pip_vcs_url: PipVcsUrl,
     cache: Cache,
     tag_name_factory: TagNameFactory,
     vcs_registry: VcsRegistry = vcs_registry,
+    remote_tags_index: RemoteTagsIndex | None = None,
 ) -> None:
-    requirements_file = RequirementsFile.from_file(requirements_file_path)
+    if remote_tags_index is None:
+        remote_tags_index = RemoteTagsIndex(cache, tag_name_factory, vcs_registry)
+    tag_placement = _plan_tag_commit(
+        pip_vcs_url, cache, tag_name_factory, remote_tags_index
+    )
+    if tag_placement is not None:
+        _place_tag(tag_placement, cache, vcs_registry)
+
+
+def _vault_pip_vcs_url(pip_vcs_url: PipVcsUrl, vcs_vault: VcsVault) -> PipVcsUrl:
+    return pip_vcs_url.with_provider(
+        provider=vcs_vault.provider, owner=vcs_vault.owner, ssh_only=vcs_vault.ssh_only
+    )
+
+
+def _push_and_tag_commit_to_vault(
+    pip_vcs_url: PipVcsUrl,
+    vcs_vault: VcsVault,
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    vcs_registry: VcsRegistry = vcs_registry,
+) -> PipVcsUrl:
+    tag_placement = _plan_push_to_vault(pip_vcs_url, vcs_vault, cache, tag_name_factory)
+    _place_tag(tag_placement, cache, vcs_registry)
+    return tag_placement.target_pip_vcs_url
+
+
+# identifies a tag placement: (vcs, target url, tag)
+PlacementKey = tuple[str, str, str]
+
+
+@dataclasses.dataclass
+class _VcsRequirement:
+    requirements_file_path: Path
+    requirement: InstallRequirement | ScannedRequirement
+    # None if the requirement URL is not supported
+    pip_vcs_url: PipVcsUrl | None
+    vcs_vault: VcsVault | None
+    needs_push: bool
+    # the tag placement this requirement depends on, if any
+    placement_key: PlacementKey | None = None
+    # the error that prevented planning its tag placement, if any
+    error: Exception | None = None
+
+    def action_key(self) -> tuple[str, ...] | None:
+        """A key identifying the remote action to perform for this requirement,
+        so it is done only once when the same commit is pinned several times."""
+        if self.pip_vcs_url is None:
+            return None
+        key = ("tag", *_repo_key(self.pip_vcs_url), self.pip_vcs_url.revision)
+        if self.needs_push:
+            if self.vcs_vault is None:
+                return None
+            return (*key, self.vcs_vault.provider, self.vcs_vault.owner)
+        return key
+
+    def result(
+        self, action: str, cached: bool = False, error: str | None = None
+    ) -> RequirementResult:
+        requirement = self.requirement
+        if isinstance(requirement, ScannedRequirement):
+            line = requirement.line_number + 1
+        else:
+            line = requirement.line_number
+        vaulted_url = None
+        if action not in (SKIPPED, MISSING, FAILED):
+            assert self.pip_vcs_url is not None
+            vaulted_url = requirement.link.url
+            if self.needs_push:
+                assert self.vcs_vault is not None
+                vaulted_url = str(_vault_pip_vcs_url(self.pip_vcs_url, self.vcs_vault))
+        return RequirementResult(
+            file=str(self.requirements_file_path),
+            line=line,
+            url=requirement.link.url,
+            vaulted_url=vaulted_url,
+            action=action,
+            cached=cached,
+            error=error,
+        )
+
+
+def _parse_requirements_file(
+    requirements_file_path: Path, fast_scan: bool
+) -> RequirementsFile | ScannedRequirementsFile:
+    with span("parse", path=str(requirements_file_path), parser="scan") as attributes:
+        scanned_file = scan_requirements_file(requirements_file_path)
+        if scanned_file is not None:
+            # files without links are not rewritten, so they need not be parsed
+            if fast_scan or not scanned_file.requirements:
+                return scanned_file
+        elif fast_scan:
+            log_debug(f"Using the full parser for {requirements_file_path}")
+        attributes["parser"] = "full"
+        # pip_requirements_parser is slow to import
+        from pip_requirements_parser import RequirementsFile
+
+        return RequirementsFile.from_file(requirements_file_path)
+
+
+def _parse_requirements_files(
+    requirements_file_paths: Sequence[Path], fast_scan: bool, parse_jobs: int
+) -> Iterator[tuple[Path, RequirementsFile | ScannedRequirementsFile]]:
+    """Parse the requirements files in order, using parse_jobs processes."""
+    if parse_jobs <= 1 or len(requirements_file_paths) <= 1:
+        for requirements_file_path in requirements_file_paths:
+            yield (
+                requirements_file_path,
+                _parse_requirements_file(requirements_file_path, fast_scan),
+            )
+        return
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # forking while other threads, such as the event loop of remote
+    # operations or those of the daemon, hold locks may deadlock the children
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=parse_jobs, mp_context=mp_context) as executor:
+        yield from zip(
+            requirements_file_paths,
+            executor.map(
+                _parse_requirements_file,
+                requirements_file_paths,
+                itertools.repeat(fast_scan),
+                chunksize=max(1, len(requirements_file_paths) // (parse_jobs * 4)),
+            ),
+        )
+
+
+def _get_vcs_requirements(
+    requirements_file_path: Path,
+    requirements_file: RequirementsFile | ScannedRequirementsFile,
+    vcs_vaults: Sequence[VcsVault],
+) -> list[_VcsRequirement]:
+    """Return the requirements of the file that have a link."""
+    vcs_requirements = []
     for requirement in requirements_file.requirements:
         if not requirement.link:
             continue
         try:
             pip_vcs_url = PipVcsUrl.from_url(requirement.link.url)
         except UnsupportedVcsUrlError:
+            vcs_requirements.append(
+                _VcsRequirement(requirements_file_path, requirement, None, None, False)
+            )
+            continue
+        vcs_vault, needs_push = get_vault_for_pip_vcs_url(pip_vcs_url, vcs_vaults)
+        vcs_requirements.append(
+            _VcsRequirement(
+                requirements_file_path, requirement, pip_vcs_url, vcs_vault, needs_push
+            )
+        )
+    return vcs_requirements
+
+
+def _urls_to_check(
+    vcs_requirements: Iterable[_VcsRequirement],
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+) -> Iterator[PipVcsUrl]:
+    """Return the urls that need a remote tag check, i.e. those that are
+    not pushed to a vault and have no matching tag in cache."""
+    for vcs_requirement in vcs_requirements:
+        pip_vcs_url = vcs_requirement.pip_vcs_url
+        if pip_vcs_url is None or vcs_requirement.needs_push:
+            continue
+        if _has_cached_tag(pip_vcs_url, cache, tag_name_factory):
+            continue
+        yield pip_vcs_url
+
+
+def _plan_vcs_requirement(
+    vcs_requirement: _VcsRequirement,
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    remote_tags_index: RemoteTagsIndex,
+) -> _TagPlacement | None:
+    pip_vcs_url = vcs_requirement.pip_vcs_url
+    assert pip_vcs_url is not None
+    if vcs_requirement.needs_push:
+        assert vcs_requirement.vcs_vault is not None
+        return _plan_push_to_vault(
+            pip_vcs_url, vcs_requirement.vcs_vault, cache, tag_name_factory
+        )
+    return _plan_tag_commit(
+        pip_vcs_url,
+        cache,
+        tag_name_factory,
+        remote_tags_index,
+        fetch_filter=(
+            vcs_requirement.vcs_vault.fetch_filter
+            if vcs_requirement.vcs_vault is not None
+            else ""
+        ),
+    )
+
+
+def _set_requirement_url(
+    requirement: InstallRequirement | ScannedRequirement, url: str
+) -> None:
+    if isinstance(requirement, ScannedRequirement):
+        requirement.link = ScannedLink(url)
+    else:
+        from pip_requirements_parser import Link
+
+        requirement.link = Link(url)
+
+
+def _write_requirements_file(
+    requirements_file_path: Path,
+    requirements_file: RequirementsFile | ScannedRequirementsFile,
+) -> None:
+    with span("write", path=str(requirements_file_path)) as attributes:
+        if isinstance(requirements_file, ScannedRequirementsFile):
+            # keep the original formatting and line endings
+            attributes["written"] = write_text_if_changed(
+                requirements_file_path, requirements_file.dumps(), newline=""
+            )
+        else:
+            attributes["written"] = write_text_if_changed(
+                requirements_file_path, normalize_req_lines(requirements_file.dumps())
+            )
+
+
+def _update_requirements_file(
+    requirements_file_path: Path,
+    requirements_file: RequirementsFile | ScannedRequirementsFile,
+    vcs_requirements: Sequence[_VcsRequirement],
+    results: dict[PlacementKey, Exception | None],
+) -> bool:
+    """Rewrite the requirements file, once all its requirements are resolved.
+
+    Raise the first error that occurred while preserving its requirements.
+    Return whether all its requirements are preserved.
+    """
+    preserved = True
+    for vcs_requirement in vcs_requirements:
+        requirement = vcs_requirement.requirement
+        pip_vcs_url = vcs_requirement.pip_vcs_url
+        if pip_vcs_url is None:
             log_warning(
                 f"Can't preserve unsupported requirement URL: {requirement.link.url}"
             )
+            preserved = False
             continue
-        vcs_vault, needs_push = get_vault_for_pip_vcs_url(pip_vcs_url, vcs_vaults)
-        if needs_push:
-            if vcs_vault is None:
-                log_warning(
-                    f"No vault defined for: {requirement.link.url}. "
-                    f"Make sure to configure a vcs_vault with default = true."
+        if vcs_requirement.needs_push and vcs_requirement.vcs_vault is None:
+            log_warning(
+                f"No vault defined for: {requirement.link.url}. "
+                f"Make sure to configure a vcs_vault with default = true."
+            )
+            preserved = False
+            continue
+        if vcs_requirement.error is not None:
+            raise vcs_requirement.error
+        if vcs_requirement.placement_key is not None:
+            error = results[vcs_requirement.placement_key]
+            if error is not None:
+                raise error
+        if vcs_requirement.needs_push:
+            assert vcs_requirement.vcs_vault is not None
+            _set_requirement_url(
+                requirement,
+                str(_vault_pip_vcs_url(pip_vcs_url, vcs_requirement.vcs_vault)),
+            )
+    _write_requirements_file(requirements_file_path, requirements_file)
+    return preserved
+
+
+# tag placements grouped by (vcs, target url), then by tag
+Batches = dict[tuple[str, str], dict[str, _TagPlacement]]
+
+
+def _plan_tag_placements(
+    vcs_requirements: Sequence[_VcsRequirement],
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    remote_tags_index: RemoteTagsIndex,
+) -> Batches:
+    """Plan the tags to place, once per distinct commit,
+    grouped by target repository.
+
+    Requirements whose placement could not be planned, because the lookup
+    of their tags failed, get the error.
+    """
+    placement_keys: dict[tuple[str, ...], PlacementKey | None] = {}
+    errors: dict[tuple[str, ...], Exception] = {}
+    batches: Batches = {}
+    for vcs_requirement in vcs_requirements:
+        action_key = vcs_requirement.action_key()
+        if action_key is None:
+            continue
+        if action_key in errors:
+            vcs_requirement.error = errors[action_key]
+            continue
+        if action_key not in placement_keys:
+            try:
+                tag_placement = _plan_vcs_requirement(
+                    vcs_requirement, cache, tag_name_factory, remote_tags_index
                 )
+            except Exception as e:
+                errors[action_key] = vcs_requirement.error = e
                 continue
-            pip_vcs_url = _push_and_tag_commit_to_vault(
-                pip_vcs_url, vcs_vault, cache, tag_name_factory, vcs_registry
+            if tag_placement is None:
+                placement_keys[action_key] = None
+            else:
+                batch_key = (tag_placement.pip_vcs_url.vcs, tag_placement.target_url)
+                batches.setdefault(batch_key, {}).setdefault(
+                    tag_placement.tag, tag_placement
+                )
+                placement_keys[action_key] = (*batch_key, tag_placement.tag)
+        vcs_requirement.placement_key = placement_keys[action_key]
+    return batches
+
+
+def _merge_batches(all_batches: Iterable[Batches]) -> Batches:
+    """Merge tag placements planned separately, so that each target
+    repository is still pushed to once."""
+    merged: Batches = {}
+    for batches in all_batches:
+        for batch_key, tag_placements in batches.items():
+            merged_tag_placements = merged.setdefault(batch_key, {})
+            for tag, tag_placement in tag_placements.items():
+                merged_tag_placements.setdefault(tag, tag_placement)
+    return merged
+
+
+def _run_tag_placements(
+    batches: Batches,
+    executor: Executor,
+    cache: Cache,
+    vcs_registry: VcsRegistry,
+    host_limiter: HostLimiter,
+    on_result: Callable[[PlacementKey, Exception | None], None] | None = None,
+) -> dict[PlacementKey, Exception | None]:
+    """Place the tags, with one push per target repository.
+
+    Return the outcome of each placement, reporting each failure. on_result
+    is called with the outcome of each placement, as soon as it is known.
+    """
+    futures = {
+        executor.submit(
+            _place_tags,
+            list(tag_placements.values()),
+            cache,
+            vcs_registry,
+            host_limiter,
+        ): batch_key
+        for batch_key, tag_placements in batches.items()
+    }
+    results: dict[PlacementKey, Exception | None] = {}
+    for future in as_completed(futures):
+        batch_key = futures[future]
+        try:
+            errors = future.result()
+        except Exception as e:
+            errors = dict.fromkeys(batches[batch_key], e)
+        for tag, error in errors.items():
+            if error is not None:
+                log_error(f"Could not place tag {tag} on {batch_key[1]}: {error}")
+            results[(*batch_key, tag)] = error
+            if on_result is not None:
+                on_result((*batch_key, tag), error)
+    return results
+
+
+def _config_digest(
+    vcs_vaults: Sequence[VcsVault], tag_name_factory: TagNameFactory, fast_scan: bool
+) -> str:
+    """A digest of the configuration affecting how requirements are preserved,
+    and how files are rewritten."""
+    config = {
+        "vcs_vaults": [dataclasses.asdict(vcs_vault) for vcs_vault in vcs_vaults],
+        "tag_prefix": tag_name_factory.tag_prefix,
+        "match_any_tag": tag_name_factory.match_any_tag,
+        # fast scans leave lines as they are, while the parser normalizes them
+        "fast_scan": fast_scan,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def _is_unchanged(
+    requirements_file_path: Path, cache: Cache, config_digest: str
+) -> bool:
+    """Whether the file was processed successfully with the same content
+    and configuration in a previous run."""
+    if not cache.is_file_processed(
+        requirements_file_path, file_digest(requirements_file_path), config_digest
+    ):
+        return False
+    log_debug(f"Skipping unchanged {requirements_file_path}")
+    return True
+
+
+def _files_to_process(
+    requirements_file_paths: Sequence[Path],
+    cache: Cache,
+    config_digest: str,
+    incremental: bool,
+) -> list[Path]:
+    if not incremental:
+        return list(requirements_file_paths)
+    return [
+        requirements_file_path
+        for requirements_file_path in requirements_file_paths
+        if not _is_unchanged(requirements_file_path, cache, config_digest)
+    ]
+
+
+def _planned_result(
+    vcs_requirement: _VcsRequirement, remote_tags_index: RemoteTagsIndex
+) -> RequirementResult:
+    """The result of a requirement that needs no tag placement."""
+    pip_vcs_url = vcs_requirement.pip_vcs_url
+    if vcs_requirement.error is not None:
+        return vcs_requirement.result(FAILED, error=str(vcs_requirement.error))
+    if pip_vcs_url is None:
+        return vcs_requirement.result(SKIPPED, error="unsupported requirement URL")
+    if vcs_requirement.action_key() is None:
+        return vcs_requirement.result(SKIPPED, error="no vault")
+    if remote_tags_index.is_from_remote(pip_vcs_url):
+        return vcs_requirement.result(VERIFIED)
+    return vcs_requirement.result(CACHED, cached=True)
+
+
+def _write_planned_results(
+    vcs_requirements: Sequence[_VcsRequirement],
+    remote_tags_index: RemoteTagsIndex,
+    results_writer: ResultsWriter,
+) -> None:
+    """Write the results of the planned requirements that need no tag
+    placement."""
+    for vcs_requirement in vcs_requirements:
+        if vcs_requirement.placement_key is None:
+            results_writer.write(_planned_result(vcs_requirement, remote_tags_index))
+
+
+def _write_placement_results(
+    vcs_requirements: Sequence[_VcsRequirement],
+    remote_tags_index: RemoteTagsIndex,
+    results_writer: ResultsWriter,
+) -> Callable[[PlacementKey, Exception | None], None]:
+    """Return a function writing the results of the requirements that depend
+    on a tag placement, once it is done."""
+    by_placement_key: dict[PlacementKey, list[_VcsRequirement]] = {}
+    for vcs_requirement in vcs_requirements:
+        if vcs_requirement.placement_key is not None:
+            by_placement_key.setdefault(vcs_requirement.placement_key, []).append(
+                vcs_requirement
             )
-            requirement.link = Link(str(pip_vcs_url))
-        else:
-            _tag_commit_if_needed(pip_vcs_url, cache, tag_name_factory, vcs_registry)
-    requirements_file_path.write_text(
-        normalize_req_lines(requirements_file.dumps()), encoding="utf-8"
+
+    def on_result(placement_key: PlacementKey, error: Exception | None) -> None:
+        for vcs_requirement in by_placement_key.get(placement_key, []):
+            assert vcs_requirement.pip_vcs_url is not None
+            if error is not None:
+                result = vcs_requirement.result(FAILED, error=str(error))
+            elif vcs_requirement.needs_push:
+                result = vcs_requirement.result(PUSHED)
+            else:
+                result = vcs_requirement.result(
+                    TAGGED,
+                    cached=not remote_tags_index.is_from_remote(
+                        vcs_requirement.pip_vcs_url
+                    ),
+                )
+            results_writer.write(result)
+
+    return on_result
+
+
+def _look_up_and_plan(
+    vcs_requirements: Sequence[_VcsRequirement],
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    remote_tags_index: RemoteTagsIndex,
+    executor: Executor,
+    host_limiter: HostLimiter,
+    results_writer: ResultsWriter | None,
+) -> Batches:
+    """Look up the tags of each remote repository once, and plan the tags to
+    place on its commits as soon as they are known.
+
+    The results of the requirements that need no tag placement are written
+    to results_writer, if any, as each repository is planned.
+    """
+    vcs_requirements_by_repo: dict[RepoKey | None, list[_VcsRequirement]] = {}
+    for vcs_requirement in vcs_requirements:
+        pip_vcs_url = vcs_requirement.pip_vcs_url
+        vcs_requirements_by_repo.setdefault(
+            _repo_key(pip_vcs_url) if pip_vcs_url is not None else None, []
+        ).append(vcs_requirement)
+    batches_by_repo: dict[RepoKey | None, Batches] = {}
+
+    def plan(key: RepoKey | None) -> None:
+        batches_by_repo[key] = _plan_tag_placements(
+            vcs_requirements_by_repo[key], cache, tag_name_factory, remote_tags_index
+        )
+        if results_writer is not None:
+            _write_planned_results(
+                vcs_requirements_by_repo[key], remote_tags_index, results_writer
+            )
+
+    urls_to_check = list(_urls_to_check(vcs_requirements, cache, tag_name_factory))
+    repos_to_check = {_repo_key(pip_vcs_url) for pip_vcs_url in urls_to_check}
+    # repositories that need no lookup are planned from the cache right away
+    for key in vcs_requirements_by_repo:
+        if key not in repos_to_check:
+            plan(key)
+    remote_tags_index.prefetch(urls_to_check, executor, host_limiter, plan)
+    # merge in the order of the requirements, for deterministic pushes
+    return _merge_batches(batches_by_repo[key] for key in vcs_requirements_by_repo)
+
+
+def tag_requirements_file(
+    requirements_file_path: Path,
+    vcs_vaults: Sequence[VcsVault],
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    vcs_registry: VcsRegistry = vcs_registry,
+) -> None:
+    tag_requirements_files(
+        [requirements_file_path], vcs_vaults, cache, tag_name_factory, vcs_registry
     )
 
 
@@ -154,8 +922,171 @@ def tag_requirements_files(
     cache: Cache,
     tag_name_factory: TagNameFactory,
     vcs_registry: VcsRegistry = vcs_registry,
+    jobs: int = 1,
+    jobs_per_host: int = 1,
+    incremental: bool = False,
+    fast_scan: bool = False,
+    parse_jobs: int = 1,
+    results_writer: ResultsWriter | None = None,
 ) -> None:
-    for requirements_file in requirements_files:
-        tag_requirements_file(
-            requirements_file, vcs_vaults, cache, tag_name_factory, vcs_registry
+    """Preserve the pinned VCS references of the requirements files.
+
+    In incremental mode, files that were processed successfully with the same
+    content and configuration in a previous run are skipped.
+    With fast_scan, files are scanned line by line and only the URLs of
+    the requirements are rewritten, when they do not need the full parser.
+    Files are parsed in parse_jobs processes.
+    The outcome of each requirement is written to results_writer, if any,
+    as soon as it is known.
+    """
+    config_digest = _config_digest(vcs_vaults, tag_name_factory, fast_scan)
+    # parse all files first, so we can plan remote operations globally
+    parsed_files = []
+    for requirements_file_path, requirements_file in _parse_requirements_files(
+        _files_to_process(requirements_files, cache, config_digest, incremental),
+        fast_scan,
+        parse_jobs,
+    ):
+        vcs_requirements = _get_vcs_requirements(
+            requirements_file_path, requirements_file, vcs_vaults
+        )
+        parsed_files.append(
+            (requirements_file_path, requirements_file, vcs_requirements)
+        )
+    all_vcs_requirements = [
+        vcs_requirement
+        for _, _, vcs_requirements in parsed_files
+        for vcs_requirement in vcs_requirements
+    ]
+    remote_tags_index = RemoteTagsIndex(cache, tag_name_factory, vcs_registry)
+    host_limiter = HostLimiter(jobs_per_host)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        batches = _look_up_and_plan(
+            all_vcs_requirements,
+            cache,
+            tag_name_factory,
+            remote_tags_index,
+            executor,
+            host_limiter,
+            results_writer,
         )
+        on_result = None
+        if results_writer is not None:
+            on_result = _write_placement_results(
+                all_vcs_requirements, remote_tags_index, results_writer
+            )
+        results = _run_tag_placements(
+            batches, executor, cache, vcs_registry, host_limiter, on_result
+        )
+    # rewrite files whose requirements were all preserved successfully,
+    # in a deterministic order
+    first_error: Exception | None = None
+    for requirements_file_path, requirements_file, vcs_requirements in parsed_files:
+        try:
+            if _update_requirements_file(
+                requirements_file_path, requirements_file, vcs_requirements, results
+            ):
+                cache.set_file_processed(
+                    requirements_file_path,
+                    file_digest(requirements_file_path),
+                    config_digest,
+                )
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None:
+        raise first_error
+
+
+def _check_vcs_requirement(
+    vcs_requirement: _VcsRequirement,
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    remote_tags_index: RemoteTagsIndex,
+    allow_probe: bool,
+) -> tuple[str | None, bool]:
+    """Return a message if the requirement is not preserved,
+    and whether the remote was probed."""
+    pip_vcs_url = vcs_requirement.pip_vcs_url
+    assert pip_vcs_url is not None
+    if vcs_requirement.needs_push:
+        return "is not in a vault", False
+    if _has_cached_tag(pip_vcs_url, cache, tag_name_factory):
+        return None, False
+    probed = False
+    remote_tags = remote_tags_index.get_known_commit_tags(pip_vcs_url)
+    if remote_tags is None:
+        if not allow_probe:
+            return "has no tag in cache", False
+        remote_tags = remote_tags_index.get_commit_tags(pip_vcs_url)
+        probed = True
+    if not any(tag_name_factory.matches_tag(tag) for tag in remote_tags):
+        return "is not tagged", probed
+    return None, probed
+
+
+def check_requirements_files(
+    requirements_files: Sequence[Path],
+    vcs_vaults: Sequence[VcsVault],
+    cache: Cache,
+    tag_name_factory: TagNameFactory,
+    vcs_registry: VcsRegistry = vcs_registry,
+    max_probes: int = 0,
+    incremental: bool = False,
+    fast_scan: bool = False,
+    parse_jobs: int = 1,
+    results_writer: ResultsWriter | None = None,
+) -> int:
+    """Report pinned VCS references that are not preserved yet,
+    without modifying the requirements files nor the remotes.
+
+    Tags are looked up in the cache. At most max_probes remote repositories
+    are listed for commits that have no tag in cache.
+    In incremental mode, files that were processed successfully with the same
+    content and configuration are not checked again.
+    The outcome of each requirement is written to results_writer, if any.
+    Return the number of requirements that are not preserved.
+    """
+    config_digest = _config_digest(vcs_vaults, tag_name_factory, fast_scan)
+    remote_tags_index = RemoteTagsIndex(cache, tag_name_factory, vcs_registry)
+    probes = 0
+    missing = 0
+    for requirements_file_path, requirements_file in _parse_requirements_files(
+        _files_to_process(requirements_files, cache, config_digest, incremental),
+        fast_scan,
+        parse_jobs,
+    ):
+        for vcs_requirement in _get_vcs_requirements(
+            requirements_file_path, requirements_file, vcs_vaults
+        ):
+            url = vcs_requirement.requirement.link.url
+            if vcs_requirement.pip_vcs_url is None:
+                log_warning(f"Can't preserve unsupported requirement URL: {url}")
+                if results_writer is not None:
+                    results_writer.write(
+                        vcs_requirement.result(
+                            SKIPPED, error="unsupported requirement URL"
+                        )
+                    )
+                continue
+            message, probed = _check_vcs_requirement(
+                vcs_requirement,
+                cache,
+                tag_name_factory,
+                remote_tags_index,
+                allow_probe=probes < max_probes,
+            )
+            if probed:
+                probes += 1
+            if message is not None:
+                log_warning(f"{requirements_file_path}: {url} {message}")
+                missing += 1
+            if results_writer is not None:
+                if message is not None:
+                    result = vcs_requirement.result(MISSING, error=message)
+                elif probed:
+                    result = vcs_requirement.result(VERIFIED)
+                else:
+                    result = vcs_requirement.result(CACHED, cached=True)
+                results_writer.write(result)
+    return missing
@@ -1,6 +1,14 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
 import typer
 
 _verbosity = 0
@@ -35,3 +43,43 @@ def log_warning(msg: str) -> None:
 
 def log_error(msg: str) -> None:
     typer.secho(msg, fg=typer.colors.RED, err=True)
+
+
+def write_text_if_changed(
+    path: Path, text: str, encoding: str = "utf-8", newline: str | None = None
+) -> bool:
+    """Write text to a file, unless it already has this exact content.
+
+    The file is replaced atomically, so concurrent readers never see
+    a partially written file. Return True if the file was written.
+    """
+    # follow symlinks, so we replace the target and not the link
+    path = Path(os.path.realpath(path))
+    # same newline translation as Path.write_text
+    if newline is None:
+        newline = os.linesep
+    if newline:
+        text = text.replace("\n", newline)
+    data = text.encode(encoding)
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        if path.exists():
+            shutil.copymode(path, tmp_name)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return True
+
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
@@ -1,14 +1,118 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+import dataclasses
+import os
 from abc import ABC, abstractmethod
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+
+class VcsError(Exception):
+    pass
+
+
+class VcsTimeoutError(VcsError):
+    pass
+
+
+@dataclasses.dataclass
+class TagRequest:
+    """A request to place a tag on a commit of a source repository."""
+
+    source_repo: str
+    sha: str
+    tag: str
+    mirror_dir: Path | None = None
+    # a git --filter spec, for a partial fetch of the commit
+    fetch_filter: str = ""
+    # whether the target repository is a fork of the source repository,
+    # so it may already have the commit
+    target_is_fork: bool = False
+
+
+def common_tag_prefix(tags: Sequence[str]) -> str:
+    """The longest common prefix of the tags, to list them all at once."""
+    # a string prefix, not a path
+    return os.path.commonprefix(list(tags))  # noqa: RUF071
+
+
+def select_tag_commits(
+    remote_tags: Mapping[str, Sequence[str]], tags: Sequence[str]
+) -> dict[str, str]:
+    """Return the commit sha of each of the given tags found in a listing of
+    remote tags indexed by commit sha."""
+    wanted = set(tags)
+    return {
+        tag: sha
+        for sha, sha_tags in remote_tags.items()
+        for tag in sha_tags
+        if tag in wanted
+    }
 
 
 class Vcs(ABC):
     @abstractmethod
-    def get_remote_tags_for_commit(self, url: str, commit: str) -> list[str]: ...
+    def get_remote_tags(self, url: str, tag_prefix: str = "") -> dict[str, list[str]]:
+        """Return the tags of the remote repository starting with tag_prefix,
+        indexed by commit sha."""
+
+    def get_remote_tags_for_commit(
+        self, url: str, commit: str, tag_prefix: str = ""
+    ) -> list[str]:
+        return self.get_remote_tags(url, tag_prefix).get(commit, [])
+
+    def get_remote_tag_commits(self, url: str, tags: Sequence[str]) -> dict[str, str]:
+        """Return the commit sha of each of the given tags that exists in the
+        remote repository.
+
+        This implementation lists the tags starting with their common prefix.
+        Implementations that can look up tags by name should override it.
+        """
+        remote_tags = self.get_remote_tags(url, common_tag_prefix(tags))
+        return select_tag_commits(remote_tags, tags)
 
     @abstractmethod
     def place_tag_on_commit(
-        self, source_repo: str, target_repo: str, sha: str, tag: str
-    ) -> None: ...
+        self,
+        source_repo: str,
+        target_repo: str,
+        sha: str,
+        tag: str,
+        mirror_dir: Path | None = None,
+        fetch_filter: str = "",
+    ) -> None:
+        """Tag the commit of the source repo and push the tag to the target repo.
+
+        If mirror_dir is provided, it is a persistent local mirror of the
+        source repo, that can be reused across calls. fetch_filter is a git
+        --filter spec, such as blob:none, to fetch the commit partially.
+        """
+
+    def place_tags_on_commits(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, Exception | None]:
+        """Place several tags and push them to the same target repo.
+
+        Return the outcome for each tag: None on success, or the error
+        that prevented it from being pushed. Implementations may push
+        all tags at once.
+        """
+        results: dict[str, Exception | None] = {}
+        for tag_request in tag_requests:
+            try:
+                self.place_tag_on_commit(
+                    tag_request.source_repo,
+                    target_repo,
+                    tag_request.sha,
+                    tag_request.tag,
+                    mirror_dir=tag_request.mirror_dir,
+                    fetch_filter=tag_request.fetch_filter,
+                )
+            except Exception as e:
+                results[tag_request.tag] = e
+            else:
+                results[tag_request.tag] = None
+        return results
@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Coroutine, Sequence
+from typing import Any, TypeVar
+
+from ._vcs import TagRequest, common_tag_prefix, select_tag_commits
+
+_T = TypeVar("_T")
+
+# the event loop running the coroutines of synchronous callers
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="vcs-event-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, _T]) -> _T:
+    """Run a coroutine in the event loop thread, and wait for its result.
+
+    Coroutines of concurrent callers run concurrently. They run in a copy of
+    the context of the caller, so their profiling spans are nested in the spans
+    of the caller. They are cancelled if the caller is interrupted.
+    """
+    loop = _get_loop()
+    result: concurrent.futures.Future[_T] = concurrent.futures.Future()
+    tasks: list[asyncio.Task[_T]] = []
+
+    def set_result(task: asyncio.Task[_T]) -> None:
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start() -> None:
+        # the task copies the current context, which is the one of the caller
+        task = loop.create_task(coro)
+        task.add_done_callback(set_result)
+        tasks.append(task)
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    try:
+        return result.result()
+    except BaseException:
+        if not result.done():
+            # callbacks run in order, so the task is started
+            loop.call_soon_threadsafe(lambda: tasks[0].cancel())
+        raise
+
+
+class AsyncVcs(ABC):
+    """The asynchronous counterpart of Vcs, for concurrent remote operations
+    that can be cancelled."""
+
+    @abstractmethod
+    async def get_remote_tags(
+        self, url: str, tag_prefix: str = ""
+    ) -> dict[str, list[str]]:
+        """Return the tags of the remote repository starting with tag_prefix,
+        indexed by commit sha."""
+
+    async def get_remote_tag_commits(
+        self, url: str, tags: Sequence[str]
+    ) -> dict[str, str]:
+        """Return the commit sha of each of the given tags that exists in the
+        remote repository.
+
+        This implementation lists the tags starting with their common prefix.
+        Implementations that can look up tags by name should override it.
+        """
+        remote_tags = await self.get_remote_tags(url, common_tag_prefix(tags))
+        return select_tag_commits(remote_tags, tags)
+
+    @abstractmethod
+    async def place_tags_on_commits(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, Exception | None]:
+        """Place several tags and push them to the same target repo.
+
+        Return the outcome for each tag: None on success, or the error
+        that prevented it from being pushed.
+        """
@@ -0,0 +1,282 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Mapping, Sequence
+from typing import Any
+from urllib.parse import urlsplit
+
+from ._profile import repo_attributes, span
+from ._utils import log_debug
+from ._vcs import TagRequest, VcsError
+from ._vcs_git import GitVcs
+
+# the maximum number of refs queried in one GraphQL request
+MAX_GRAPHQL_REFS = 100
+
+
+class ForgeApiError(VcsError):
+    pass
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP connections to a server, shared by threads."""
+
+    def __init__(self, url: str) -> None:
+        split_result = urlsplit(url)
+        self._https = split_result.scheme == "https"
+        self._netloc = split_result.netloc
+        self._lock = threading.Lock()
+        self._idle: list[http.client.HTTPConnection] = []
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._https:
+            return http.client.HTTPSConnection(self._netloc, timeout=60)
+        return http.client.HTTPConnection(self._netloc, timeout=60)
+
+    def _send(
+        self,
+        conn: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        body: bytes | None,
+        headers: Mapping[str, str],
+    ) -> tuple[int, bytes]:
+        try:
+            conn.request(method, path, body=body, headers=dict(headers))
+            response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                self._idle.append(conn)
+        return response.status, data
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> tuple[int, bytes]:
+        """Send a request and return the response status and body."""
+        headers = headers or {}
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            try:
+                return self._send(conn, method, path, body, headers)
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed the idle connection, retry with a new one
+                pass
+        return self._send(self._connect(), method, path, body, headers)
+
+
+class ForgeApi(ABC):
+    """The API of a forge, such as GitHub, giving access to its repositories."""
+
+    @abstractmethod
+    def get_tag_commits(
+        self, owner: str, repo: str, tags: Sequence[str]
+    ) -> dict[str, str]:
+        """Return the commit sha of each of the given tags that exists in
+        the repository."""
+
+    @abstractmethod
+    def create_tag(self, owner: str, repo: str, tag: str, sha: str) -> bool:
+        """Create a lightweight tag on a commit of the repository.
+
+        Return False if the commit is not in the repository.
+        """
+
+
+class GitHubApi(ForgeApi):
+    def __init__(
+        self, api_url: str, token: str, graphql_url: str | None = None
+    ) -> None:
+        self._api_url = api_url.rstrip("/")
+        self._graphql_url = graphql_url or f"{self._api_url}/graphql"
+        self._token = token
+        self._pool = _ConnectionPool(self._api_url)
+
+    def _request(self, method: str, url: str, payload: Any) -> tuple[int, Any]:
+        with span("http", method=method, url=url) as attributes:
+            status, data = self._pool.request(
+                method,
+                urlsplit(url).path,
+                body=json.dumps(payload).encode(),
+                headers={
+                    "Accept": "application/vnd.github+json",
+                    "Authorization": f"Bearer {self._token}",
+                    "Content-Type": "application/json",
+                    "User-Agent": "pip-preserve-requirements",
+                },
+            )
+            attributes["status"] = status
+            attributes["bytes"] = len(data)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError as e:
+            raise ForgeApiError(f"Invalid response from {url}: {e}") from e
+
+    def _query_refs(self, owner: str, repo: str, tags: Sequence[str]) -> dict[str, str]:
+        # query each ref with an alias, in a single request
+        variables = {"owner": owner, "name": repo}
+        declarations = ["$owner: String!", "$name: String!"]
+        fields = []
+        for i, tag in enumerate(tags):
+            variables[f"t{i}"] = f"refs/tags/{tag}"
+            declarations.append(f"$t{i}: String!")
+            fields.append(
+                f"t{i}: ref(qualifiedName: $t{i}) "
+                "{ target { oid ... on Tag { target { oid } } } }"
+            )
+        query = (
+            f"query({', '.join(declarations)}) "
+            f"{{ repository(owner: $owner, name: $name) {{ {' '.join(fields)} }} }}"
+        )
+        status, response = self._request(
+            "POST", self._graphql_url, {"query": query, "variables": variables}
+        )
+        if status != 200 or not isinstance(response, dict) or response.get("errors"):
+            raise ForgeApiError(
+                f"Could not query tags of {owner}/{repo}: {status} {response}"
+            )
+        refs = response["data"]["repository"]
+        tag_commits = {}
+        for i, tag in enumerate(tags):
+            ref = refs[f"t{i}"]
+            if ref is None:
+                continue
+            target = ref["target"]
+            # annotated tags are peeled to the commit they point to
+            tag_commits[tag] = target.get("target", target)["oid"]
+        return tag_commits
+
+    def get_tag_commits(
+        self, owner: str, repo: str, tags: Sequence[str]
+    ) -> dict[str, str]:
+        tag_commits = {}
+        for i in range(0, len(tags), MAX_GRAPHQL_REFS):
+            tag_commits.update(
+                self._query_refs(owner, repo, tags[i : i + MAX_GRAPHQL_REFS])
+            )
+        return tag_commits
+
+    def create_tag(self, owner: str, repo: str, tag: str, sha: str) -> bool:
+        status, response = self._request(
+            "POST",
+            f"{self._api_url}/repos/{owner}/{repo}/git/refs",
+            {"ref": f"refs/tags/{tag}", "sha": sha},
+        )
+        if status == 201:
+            return True
+        message = response.get("message", "") if isinstance(response, dict) else ""
+        if status == 422 and message == "Object does not exist":
+            return False
+        if status == 422 and message == "Reference already exists":
+            if self.get_tag_commits(owner, repo, [tag]).get(tag) == sha:
+                return True
+        raise ForgeApiError(f"Could not create tag {tag} in {owner}/{repo}: {status}")
+
+    @classmethod
+    def from_env(cls) -> dict[str, ForgeApi]:
+        """Return the API of the GitHub server of the environment, indexed by
+        host, if GITHUB_TOKEN is set.
+
+        The server is configured with the environment variables of GitHub
+        Actions, defaulting to github.com.
+        """
+        token = os.environ.get("GITHUB_TOKEN")
+        if not token:
+            return {}
+        server_url = os.environ.get("GITHUB_SERVER_URL", "https://github.com")
+        host = urlsplit(server_url).hostname
+        if not host:
+            return {}
+        api = cls(
+            os.environ.get("GITHUB_API_URL", "https://api.github.com"),
+            token,
+            graphql_url=os.environ.get("GITHUB_GRAPHQL_URL"),
+        )
+        return {host: api}
+
+
+def _split_repo_url(url: str) -> tuple[str, str, str] | None:
+    """Return the host, owner and repository name of a repository URL."""
+    split_result = urlsplit(url)
+    parts = split_result.path.strip("/").split("/")
+    if not split_result.hostname or len(parts) != 2:
+        return None
+    owner, repo = parts
+    if repo.endswith(".git"):
+        repo = repo[: -len(".git")]
+    return split_result.hostname, owner, repo
+
+
+class ForgeVcs(GitVcs):
+    """Use the API of forges, where available, to look up and create tags.
+
+    Tags are created without transferring any object when the commit is
+    already in the target repository. Otherwise, and for repositories hosted
+    elsewhere or when the API fails, git is used.
+    """
+
+    def __init__(self, apis: Mapping[str, ForgeApi]) -> None:
+        self._apis = apis
+
+    def _api(self, url: str) -> tuple[ForgeApi, str, str] | None:
+        repo_url = _split_repo_url(url)
+        if repo_url is None:
+            return None
+        host, owner, repo = repo_url
+        api = self._apis.get(host)
+        if api is None:
+            return None
+        return api, owner, repo
+
+    def get_remote_tag_commits(self, url: str, tags: Sequence[str]) -> dict[str, str]:
+        api = self._api(url)
+        if api is not None:
+            try:
+                with span("forge.get_tag_commits", **repo_attributes(url)):
+                    return api[0].get_tag_commits(api[1], api[2], tags)
+            except (ForgeApiError, OSError, http.client.HTTPException) as e:
+                log_debug(f"Falling back to git: {e}")
+        return super().get_remote_tag_commits(url, tags)
+
+    def place_tags_on_commits(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, Exception | None]:
+        api = self._api(target_repo)
+        if api is None:
+            return super().place_tags_on_commits(target_repo, tag_requests)
+        results: dict[str, Exception | None] = {}
+        git_tag_requests = []
+        for tag_request in tag_requests:
+            try:
+                with span("forge.create_tag", **repo_attributes(target_repo)):
+                    created = api[0].create_tag(
+                        api[1], api[2], tag_request.tag, tag_request.sha
+                    )
+            except (ForgeApiError, OSError, http.client.HTTPException) as e:
+                log_debug(f"Falling back to git: {e}")
+                created = False
+            if created:
+                results[tag_request.tag] = None
+            else:
+                # the commit must be pushed first
+                git_tag_requests.append(tag_request)
+        if git_tag_requests:
+            results.update(super().place_tags_on_commits(target_repo, git_tag_requests))
+        return results
@@ -1,11 +1,25 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
 import re
 import subprocess
 import tempfile
+import threading
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
 
-from ._vcs import Vcs
+from ._concurrency import FileLock
+from ._profile import run_subprocess, subprocess_span
+from ._ssh import use_shared_ssh_connections
+from ._vcs import TagRequest, Vcs, VcsError, VcsTimeoutError
+from ._vcs_async import AsyncVcs, run_sync
 
 GIT_VERSION_REGEX = re.compile(
     r"^git version "  # Prefix.
@@ -15,11 +29,56 @@ GIT_VERSION_REGEX = re.compile(
     r".*$"  # Suffix, including any pre- and post-release segments we don't care about.
 )
 
+# the maximum number of tags selected by name with one ls-remote command
+MAX_LS_REMOTE_TAGS = 100
+
+# the maximum number of seconds a remote lookup may take
+REMOTE_TIMEOUT = 300
+
+# serialize operations on each local mirror repository
+_mirror_locks: dict[Path, threading.Lock] = {}
+_mirror_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _mirror_lock(mirror_dir: Path) -> Iterator[None]:
+    """Lock a mirror repository against other threads, and against other
+    processes sharing the cache."""
+    with _mirror_locks_lock:
+        lock = _mirror_locks.setdefault(mirror_dir.resolve(), threading.Lock())
+    with lock, FileLock.for_directory(mirror_dir):
+        yield
+
+
+def _parse_tag_line(tag_line: str) -> tuple[str, str] | None:
+    """Return the (sha, tag) pair of a line of ls-remote --tags output,
+    annotated tags being peeled to the commit they point to."""
+    refs_prefix = "refs/tags/"
+    peeled_suffix = "^{}"
+    if not tag_line.strip():
+        return None
+    remote_sha, ref = tag_line.split()
+    assert ref.startswith(refs_prefix)
+    tag = ref[len(refs_prefix) :]
+    if tag.endswith(peeled_suffix):
+        # annotated tag, peeled to the commit it points to
+        tag = tag[: -len(peeled_suffix)]
+    return remote_sha, tag
+
 
 class GitVcs(Vcs):
+    """Look up and place tags with git.
+
+    Remote lookups run as AsyncGitVcs coroutines, so they are streamed and
+    time out after remote_timeout seconds.
+    """
+
+    remote_timeout: float | None = REMOTE_TIMEOUT
+
     @classmethod
+    @functools.cache
     def _get_git_version(cls) -> tuple[int, ...]:
-        version = subprocess.run(
+        version = run_subprocess(
             ["git", "version"],
             check=True,
             text=True,
@@ -30,38 +89,490 @@ class GitVcs(Vcs):
             return ()
         return (int(match.group(1)), int(match.group(2)))
 
-    def get_remote_tags_for_commit(self, url: str, sha: str) -> list[str]:
-        remote_tags = []
-        tag_prefix = "refs/tags/"
-        tag_lines = subprocess.run(
-            ["git", "ls-remote", "-t", url], text=True, capture_output=True, check=True
-        ).stdout
-        for tag_line in tag_lines.split("\n"):
-            if not tag_line:
-                continue
-            remote_sha, ref = tag_line.split()
-            if remote_sha == sha:
-                assert ref.startswith(tag_prefix)
-                remote_tags.append(ref[len(tag_prefix) :])
-        return remote_tags
+    @classmethod
+    def _ls_remote_cmd(cls, *args: str) -> list[str]:
+        cmd = ["git"]
+        if cls._get_git_version() >= (2, 18):
+            # protocol v2 lets the server send only the refs under the
+            # requested prefixes, such as refs/tags/ for --tags, and not all
+            # refs; ls-remote patterns are not sent as prefixes
+            cmd.extend(["-c", "protocol.version=2"])
+        cmd.extend(["ls-remote", *args])
+        return cmd
+
+    def _async_vcs(self) -> AsyncGitVcs:
+        return AsyncGitVcs(self.remote_timeout, self)
+
+    def get_remote_tags(self, url: str, tag_prefix: str = "") -> dict[str, list[str]]:
+        return run_sync(self._async_vcs().get_remote_tags(url, tag_prefix))
+
+    def get_remote_tag_commits(self, url: str, tags: Sequence[str]) -> dict[str, str]:
+        return run_sync(self._async_vcs().get_remote_tag_commits(url, tags))
 
     def place_tag_on_commit(
-        self, source_repo: str, target_repo: str, sha: str, tag: str
+        self,
+        source_repo: str,
+        target_repo: str,
+        sha: str,
+        tag: str,
+        mirror_dir: Path | None = None,
+        fetch_filter: str = "",
     ) -> None:
+        if mirror_dir is not None:
+            error = self.place_tags_on_commits(
+                target_repo,
+                [TagRequest(source_repo, sha, tag, mirror_dir, fetch_filter)],
+            )[tag]
+            if error is not None:
+                raise error
+            return
         with tempfile.TemporaryDirectory() as tmpdir:
-            subprocess.run(
-                ["git", "clone", "--bare", "--depth=1", source_repo, tmpdir],
-                check=True,
-            )
-            subprocess.run(
-                ["git", "-C", tmpdir, "fetch", source_repo, sha],
+            run_subprocess(
+                ["git", "init", "--bare", "--quiet", tmpdir],
                 check=True,
             )
-            subprocess.run(
+            self._fetch_commits(Path(tmpdir), source_repo, [sha], fetch_filter)
+            run_subprocess(
                 ["git", "-C", tmpdir, "tag", tag, sha],
                 check=True,
             )
-            subprocess.run(
+            use_shared_ssh_connections(target_repo)
+            run_subprocess(
                 ["git", "-C", tmpdir, "push", target_repo, tag],
                 check=True,
             )
+
+    @classmethod
+    def _present_commits(cls, repo_dir: Path, shas: Iterable[str]) -> set[str]:
+        """Return the commits of shas that are in the repository."""
+        shas = list(dict.fromkeys(shas))
+        if not shas or not (repo_dir / "HEAD").is_file():
+            return set()
+        output = run_subprocess(
+            ["git", "-C", str(repo_dir), "cat-file", "--batch-check"],
+            input="".join(f"{sha}\n" for sha in shas),
+            check=True,
+            text=True,
+            capture_output=True,
+        ).stdout
+        present = set()
+        for line in output.splitlines():
+            # "<sha> <type> <size>", or "<sha> missing"
+            parts = line.split()
+            if len(parts) == 3 and parts[1] == "commit":
+                present.add(parts[0])
+        return present
+
+    @classmethod
+    def _fetch_from_target(
+        cls, repo_dir: Path, target_repo: str, shas: Sequence[str]
+    ) -> None:
+        """Fetch the commit objects only, without their history."""
+        use_shared_ssh_connections(target_repo)
+        run_subprocess(
+            [
+                "git",
+                "-C",
+                str(repo_dir),
+                "fetch",
+                "--quiet",
+                "--depth=1",
+                # servers ignore the filter if they don't support it
+                "--filter=tree:0",
+                target_repo,
+                *shas,
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    def _tag_from_target(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> tuple[dict[str, Exception | None], list[TagRequest]]:
+        """Place the tags of commits that are not in their local mirror, but
+        may already be in the target repository, because it is a fork of
+        their source repository.
+
+        The commits are requested by sha from the target repository, all at
+        once, or one by one if some of them are not there. Only the commit
+        objects are fetched, and the push transfers no object, since push
+        negotiation finds that the target has them. Return the outcome of
+        these tags, and the requests that remain to be processed.
+        """
+        candidates = [
+            tag_request for tag_request in tag_requests if tag_request.target_is_fork
+        ]
+        in_mirrors: set[tuple[Path | None, str]] = set()
+        for mirror_dir in {tag_request.mirror_dir for tag_request in candidates}:
+            if mirror_dir is None:
+                continue
+            mirror_shas = [
+                tag_request.sha
+                for tag_request in candidates
+                if tag_request.mirror_dir == mirror_dir
+            ]
+            in_mirrors.update(
+                (mirror_dir, sha)
+                for sha in self._present_commits(mirror_dir, mirror_shas)
+            )
+        candidates = [
+            tag_request
+            for tag_request in candidates
+            if (tag_request.mirror_dir, tag_request.sha) not in in_mirrors
+        ]
+        if not candidates:
+            return {}, list(tag_requests)
+        shas = list(dict.fromkeys(tag_request.sha for tag_request in candidates))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            repo_dir = Path(tmpdir)
+            run_subprocess(
+                ["git", "init", "--bare", "--quiet", tmpdir],
+                check=True,
+            )
+            try:
+                self._fetch_from_target(repo_dir, target_repo, shas)
+            except subprocess.CalledProcessError:
+                # the whole fetch fails if any commit is not in the target
+                if len(shas) > 1:
+                    for sha in shas:
+                        try:
+                            self._fetch_from_target(repo_dir, target_repo, [sha])
+                        except subprocess.CalledProcessError:
+                            pass
+            in_target = self._present_commits(repo_dir, shas)
+            candidates = [
+                tag_request
+                for tag_request in candidates
+                if tag_request.sha in in_target
+            ]
+            if not candidates:
+                return {}, list(tag_requests)
+            for tag_request in candidates:
+                run_subprocess(
+                    ["git", "-C", tmpdir, "tag", tag_request.tag, tag_request.sha],
+                    check=True,
+                    capture_output=True,
+                )
+            push_results = self._push_tags(
+                repo_dir,
+                target_repo,
+                [tag_request.tag for tag_request in candidates],
+            )
+        # Servers may let us fetch commits that no ref of the target reaches,
+        # such as commits of other repositories of a fork network, and then
+        # reject the push from a shallow repository: push those from the mirror.
+        pushed = {tag for tag, error in push_results.items() if error is None}
+        return dict.fromkeys(pushed), [
+            tag_request for tag_request in tag_requests if tag_request.tag not in pushed
+        ]
+
+    def place_tags_on_commits(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, Exception | None]:
+        """Collect all tags in one local mirror, and push them at once.
+
+        The mirror of the first request is used. Commits of other source
+        repositories (such as forks) are fetched into it. Commits that are
+        already in a target repository that is a fork of their source are not
+        fetched from their source.
+        """
+        if not tag_requests:
+            return {}
+        results, tag_requests = self._tag_from_target(target_repo, tag_requests)
+        if not tag_requests:
+            return results
+        mirror_dir = tag_requests[0].mirror_dir
+        if mirror_dir is None:
+            results.update(super().place_tags_on_commits(target_repo, tag_requests))
+            return results
+        with _mirror_lock(mirror_dir):
+            self._init_mirror(mirror_dir)
+            fetch_errors = self._fetch_into_mirror(mirror_dir, tag_requests)
+            tags_to_push = []
+            for tag_request in tag_requests:
+                try:
+                    if tag_request.sha in fetch_errors:
+                        raise fetch_errors[tag_request.sha]
+                    self._tag_in_mirror(mirror_dir, tag_request)
+                except subprocess.CalledProcessError as e:
+                    results[tag_request.tag] = VcsError(
+                        f"Could not fetch {tag_request.sha} "
+                        f"from {tag_request.source_repo}: {e}"
+                    )
+                else:
+                    tags_to_push.append(tag_request.tag)
+            if tags_to_push:
+                results.update(self._push_tags(mirror_dir, target_repo, tags_to_push))
+        return results
+
+    @classmethod
+    def _init_mirror(cls, mirror_dir: Path) -> None:
+        if (mirror_dir / "HEAD").is_file():
+            return
+        mirror_dir.mkdir(parents=True, exist_ok=True)
+        run_subprocess(
+            ["git", "init", "--bare", "--quiet", str(mirror_dir)],
+            check=True,
+        )
+
+    @classmethod
+    def _promisor_remote(
+        cls, repo_dir: Path, source_repo: str, fetch_filter: str
+    ) -> str:
+        """Configure a remote for the source repository, from which objects
+        omitted by partial fetches are fetched on demand, and return its name.
+
+        git would use the URL as remote name, which does not work for paths.
+        """
+        name = "source-" + hashlib.sha1(source_repo.encode()).hexdigest()[:12]
+        for key, value in (
+            ("url", source_repo),
+            ("promisor", "true"),
+            ("partialclonefilter", fetch_filter),
+        ):
+            run_subprocess(
+                ["git", "-C", str(repo_dir), "config", f"remote.{name}.{key}", value],
+                check=True,
+            )
+        return name
+
+    @classmethod
+    def _fetch_commits(
+        cls, repo_dir: Path, source_repo: str, shas: Sequence[str], fetch_filter: str
+    ) -> None:
+        use_shared_ssh_connections(source_repo)
+        cmd = ["git", "-C", str(repo_dir), "fetch"]
+        if fetch_filter:
+            cmd.append(f"--filter={fetch_filter}")
+            source_repo = cls._promisor_remote(repo_dir, source_repo, fetch_filter)
+        run_subprocess([*cmd, source_repo, *shas], check=True)
+
+    def _fetch_into_mirror(
+        self, mirror_dir: Path, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, subprocess.CalledProcessError]:
+        """Fetch the missing commits, with one fetch per source repository.
+
+        Return the errors of the commits that could not be fetched.
+        """
+        in_mirror = self._present_commits(
+            mirror_dir, (tag_request.sha for tag_request in tag_requests)
+        )
+        shas_by_source: dict[tuple[str, str], list[str]] = {}
+        for tag_request in tag_requests:
+            if tag_request.sha in in_mirror:
+                continue
+            shas = shas_by_source.setdefault(
+                (tag_request.source_repo, tag_request.fetch_filter), []
+            )
+            if tag_request.sha not in shas:
+                shas.append(tag_request.sha)
+        errors = {}
+        for (source_repo, fetch_filter), shas in shas_by_source.items():
+            # Fetch incrementally: the tags of the mirror keep previously fetched
+            # objects reachable, and are advertised as haves during negotiation.
+            try:
+                self._fetch_commits(mirror_dir, source_repo, shas, fetch_filter)
+            except subprocess.CalledProcessError as e:
+                if len(shas) == 1:
+                    errors[shas[0]] = e
+                    continue
+                # find out which commits can't be fetched
+                for sha in shas:
+                    try:
+                        self._fetch_commits(
+                            mirror_dir, source_repo, [sha], fetch_filter
+                        )
+                    except subprocess.CalledProcessError as e:
+                        errors[sha] = e
+        return errors
+
+    @classmethod
+    def _tag_in_mirror(cls, mirror_dir: Path, tag_request: TagRequest) -> None:
+        run_subprocess(
+            [
+                "git",
+                "-C",
+                str(mirror_dir),
+                "tag",
+                "--force",
+                tag_request.tag,
+                tag_request.sha,
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    @classmethod
+    def _push_tags(
+        cls, mirror_dir: Path, target_repo: str, tags: Sequence[str]
+    ) -> dict[str, Exception | None]:
+        """Push tags with a single git push, and report the outcome of each."""
+        use_shared_ssh_connections(target_repo)
+        tag_prefix = "refs/tags/"
+        cmd = ["git", "-C", str(mirror_dir)]
+        if cls._get_git_version() >= (2, 29):
+            # find the commits the target already has, so they are not sent
+            # again, and their missing objects are not fetched on demand
+            cmd.extend(["-c", "push.negotiate=true"])
+        push = run_subprocess(
+            [
+                *cmd,
+                "push",
+                "--porcelain",
+                target_repo,
+                *(f"{tag_prefix}{tag}" for tag in tags),
+            ],
+            text=True,
+            capture_output=True,
+        )
+        # porcelain output has one "<flag>\t<from>:<to>\t<summary>" line per ref
+        ref_statuses = {}
+        for line in push.stdout.splitlines():
+            parts = line.split("\t")
+            if len(parts) != 3:
+                continue
+            flag, refspec, summary = parts
+            ref = refspec.split(":")[-1]
+            if ref.startswith(tag_prefix):
+                ref_statuses[ref[len(tag_prefix) :]] = (flag, summary)
+        results: dict[str, Exception | None] = {}
+        for tag in tags:
+            if tag not in ref_statuses:
+                results[tag] = VcsError(
+                    f"Could not push {tag} to {target_repo}: {push.stderr.strip()}"
+                )
+                continue
+            flag, summary = ref_statuses[tag]
+            if flag == "!":
+                results[tag] = VcsError(
+                    f"Could not push {tag} to {target_repo}: {summary}"
+                )
+            else:
+                results[tag] = None
+        return results
+
+
+class AsyncGitVcs(AsyncVcs):
+    """Look up remote tags with concurrent git subprocesses, parsing their
+    output as it is received, rather than buffering it.
+
+    Lookups are killed when they are cancelled, or take more than timeout
+    seconds. Tags are placed by GitVcs in a worker thread, and are not
+    interrupted, since they update local mirrors.
+    """
+
+    def __init__(
+        self, timeout: float | None = REMOTE_TIMEOUT, git_vcs: GitVcs | None = None
+    ) -> None:
+        self.timeout = timeout
+        self._git_vcs = git_vcs or GitVcs()
+
+    @classmethod
+    async def _stream(cls, cmd: Sequence[str], on_line: Callable[[str], None]) -> None:
+        """Run a command, passing the lines of its output as they come."""
+        with subprocess_span(cmd) as attributes:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            assert process.stdout is not None
+            assert process.stderr is not None
+            # read stderr concurrently, so the process can't block on a full pipe
+            stderr = asyncio.ensure_future(process.stderr.read())
+            output_bytes = 0
+            try:
+                async for line in process.stdout:
+                    output_bytes += len(line)
+                    on_line(line.decode())
+                returncode = await process.wait()
+                stderr_output = await stderr
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                stderr.cancel()
+            attributes["returncode"] = returncode
+            attributes["bytes"] = output_bytes
+        if returncode:
+            raise subprocess.CalledProcessError(
+                returncode, cmd, stderr=stderr_output.decode(errors="replace")
+            )
+
+    async def _ls_remote(
+        self, url: str, args: Sequence[str], on_line: Callable[[str], None]
+    ) -> None:
+        use_shared_ssh_connections(url)
+        cmd = self._git_vcs._ls_remote_cmd(*args)
+        try:
+            await asyncio.wait_for(self._stream(cmd, on_line), self.timeout)
+        except asyncio.TimeoutError as e:
+            raise VcsTimeoutError(
+                f"Listing the refs of {url} took more than {self.timeout} seconds"
+            ) from e
+
+    async def _ls_remote_tags(
+        self, url: str, patterns: Sequence[str], on_tag: Callable[[str, str], None]
+    ) -> None:
+        """Pass the (sha, tag) pairs of remote tags matching the patterns."""
+
+        def on_line(line: str) -> None:
+            parsed = _parse_tag_line(line)
+            if parsed is not None:
+                on_tag(*parsed)
+
+        await self._ls_remote(url, ["--tags", url, *patterns], on_line)
+
+    async def get_remote_tags(
+        self, url: str, tag_prefix: str = ""
+    ) -> dict[str, list[str]]:
+        remote_tags: dict[str, list[str]] = {}
+
+        def on_tag(remote_sha: str, tag: str) -> None:
+            if tag.startswith(tag_prefix):
+                remote_tags.setdefault(remote_sha, []).append(tag)
+
+        patterns = []
+        if tag_prefix:
+            # ls-remote patterns are not sent to the server, but unwanted
+            # tags are filtered before we parse them; tag names can't contain
+            # glob special characters
+            patterns.append(f"refs/tags/{tag_prefix}*")
+        await self._ls_remote_tags(url, patterns, on_tag)
+        return remote_tags
+
+    async def get_remote_tag_commits(
+        self, url: str, tags: Sequence[str]
+    ) -> dict[str, str]:
+        """Return the commit sha of each of the given tags that exists in the
+        remote repository.
+
+        The server still sends all the tags of the repository, but git only
+        outputs the requested ones, so the output we parse does not grow with
+        the number of remote tags.
+        """
+        if len(tags) > MAX_LS_REMOTE_TAGS:
+            # keep the command line short
+            return await super().get_remote_tag_commits(url, tags)
+        patterns = []
+        for tag in tags:
+            # the peeled ref of annotated tags must be requested explicitly
+            patterns.extend([f"refs/tags/{tag}", f"refs/tags/{tag}^{{}}"])
+        wanted = set(tags)
+        tag_commits: dict[str, str] = {}
+
+        def on_tag(remote_sha: str, tag: str) -> None:
+            # the peeled ref comes after the tag object ref, and overrides it
+            if tag in wanted:
+                tag_commits[tag] = remote_sha
+
+        await self._ls_remote_tags(url, patterns, on_tag)
+        return tag_commits
+
+    async def place_tags_on_commits(
+        self, target_repo: str, tag_requests: Sequence[TagRequest]
+    ) -> dict[str, Exception | None]:
+        return await asyncio.to_thread(
+            self._git_vcs.place_tags_on_commits, target_repo, tag_requests
+        )
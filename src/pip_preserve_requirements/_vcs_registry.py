@@ -1,15 +1,26 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import functools
 from typing import Callable
 
 from ._vcs import Vcs
+from ._vcs_forge import ForgeVcs, GitHubApi
 from ._vcs_git import GitVcs
 
 VcsRegistry = Callable[[str], Vcs]
 
 
+@functools.cache
+def _git_vcs() -> Vcs:
+    # a single instance, so forge API connections are reused
+    apis = GitHubApi.from_env()
+    if apis:
+        return ForgeVcs(apis)
+    return GitVcs()
+
+
 def vcs_registry(name: str) -> Vcs:
     if name == "git":
-        return GitVcs()
+        return _git_vcs()
     raise ValueError(f"Unsupported VCS: {name}")
@@ -0,0 +1,3 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+#
+# SPDX-License-Identifier: MIT
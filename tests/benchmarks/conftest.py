@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""Fixtures for benchmarks.
+
+Benchmarks require pytest-benchmark, and run against a fake forge made of
+local bare repositories. Git is configured so that https://forge.test/ and
+ssh://git@forge.test/ URLs are rewritten to file:// URLs in the fake forge.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements._profile import Profiler, Span
+
+from ..conftest import git
+
+pytest.importorskip("pytest_benchmark")
+
+FORGE_HOST = "forge.test"
+
+
+def dir_size(path: Path) -> int:
+    size = 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.lstat(os.path.join(dirpath, filename)).st_size
+    return size
+
+
+@dataclasses.dataclass
+class FakeForge:
+    root: Path
+
+    def create_repo(
+        self, owner: str, repo: str, commits: int = 0, blob_size: int = 0
+    ) -> list[str]:
+        """Create a bare repository with a linear history, each commit adding
+        a random blob of blob_size bytes, and return the shas of its commits,
+        oldest first."""
+        repo_dir = self.root / owner / repo
+        repo_dir.mkdir(parents=True)
+        git(repo_dir, "init", "--bare", "--quiet")
+        # like GitHub, allow partial fetches; this must be in the repository
+        # configuration, as local transports don't pass the environment one
+        git(repo_dir, "config", "uploadpack.allowFilter", "true")
+        if not commits:
+            return []
+        # git fast-import is much faster than one git commit per commit
+        stream = []
+        for i in range(commits):
+            content = f"commit {i}\n"
+            if blob_size:
+                bits = random.Random(i).getrandbits(blob_size * 4)
+                content += f"{bits:0{blob_size}x}\n"
+            message = f"commit {i}\n"
+            stream.append(
+                "commit refs/heads/main\n"
+                f"committer Test <test@example.com> {1700000000 + i} +0000\n"
+                f"data {len(message)}\n{message}"
+                f"M 644 inline file.txt\ndata {len(content)}\n{content}\n"
+            )
+        git(repo_dir, "fast-import", "--quiet", input="".join(stream))
+        git(repo_dir, "symbolic-ref", "HEAD", "refs/heads/main")
+        return git(repo_dir, "rev-list", "--reverse", "main").split()
+
+    def tags(self, owner: str, repo: str) -> list[str]:
+        return git(self.root / owner / repo, "tag").split()
+
+
+@pytest.fixture
+def fake_forge(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeForge:
+    root = tmp_path / "forge"
+    root.mkdir()
+    base_url = root.as_uri() + "/"
+    config = {
+        f"url.{base_url}.insteadOf": [
+            f"https://{FORGE_HOST}/",
+            f"ssh://git@{FORGE_HOST}/",
+        ],
+    }
+    i = 0
+    for key, values in config.items():
+        for value in values:
+            monkeypatch.setenv(f"GIT_CONFIG_KEY_{i}", key)
+            monkeypatch.setenv(f"GIT_CONFIG_VALUE_{i}", value)
+            i += 1
+    monkeypatch.setenv("GIT_CONFIG_COUNT", str(i))
+    # keep benchmarks quiet and independent of the user configuration
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", os.devnull)
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    monkeypatch.setenv("GIT_TERMINAL_PROMPT", "0")
+    return FakeForge(root)
+
+
+@dataclasses.dataclass
+class SubprocessStats:
+    """The subprocesses recorded by the profiler, synchronous or asynchronous."""
+
+    profiler: Profiler
+
+    @property
+    def _spans(self) -> list[Span]:
+        return [span for span in self.profiler.spans if span.name == "subprocess"]
+
+    @property
+    def count(self) -> int:
+        return len(self._spans)
+
+    @property
+    def output_bytes(self) -> int:
+        return sum(span.attributes.get("bytes", 0) for span in self._spans)
+
+    def reset(self) -> None:
+        self.profiler.spans.clear()
+
+
+@pytest.fixture
+def subprocess_stats(profiler: Profiler) -> SubprocessStats:
+    """Count subprocesses and the bytes of their captured output."""
+    return SubprocessStats(profiler)
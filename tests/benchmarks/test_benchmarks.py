@@ -0,0 +1,269 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pip_requirements_parser import RequirementsFile  # type: ignore[import-untyped]
+
+from pip_preserve_requirements._cache import Cache
+from pip_preserve_requirements._discover import discover_requirements_files
+from pip_preserve_requirements._pip_vcs_url import PipVcsUrl
+from pip_preserve_requirements._scan_reqs import ScannedRequirementsFile
+from pip_preserve_requirements._schemas import VcsVault
+from pip_preserve_requirements._tag_name_factory import TagNameFactory
+from pip_preserve_requirements._tag_requirements import (
+    _get_vcs_requirements,
+    _parse_requirements_files,
+    tag_requirements_files,
+)
+
+from ..conftest import git
+from .conftest import FORGE_HOST, FakeForge, SubprocessStats, dir_size
+
+SIZES = [10, 1000, 10000]
+# end-to-end runs use real git operations against the fake forge
+E2E_SIZES = [10, 100]
+E2E_REPOS = 5
+UPSTREAM = "oca"
+VAULT = "acme"
+
+
+def _fake_sha(i: int) -> str:
+    return hashlib.sha1(str(i).encode()).hexdigest()
+
+
+def _requirement_line(i: int, owner: str, repo: str, sha: str) -> str:
+    return (
+        f"pkg{i} @ git+https://{FORGE_HOST}/{owner}/{repo}@{sha}#subdirectory=pkg{i}\n"
+    )
+
+
+def _write_requirements(path: Path, pins: list[tuple[str, str]]) -> None:
+    """Write a requirements file with a (repo, sha) pin per line,
+    mixed with regular requirements."""
+    lines = []
+    for i, (repo, sha) in enumerate(pins):
+        lines.append(_requirement_line(i, UPSTREAM, repo, sha))
+        if i % 10 == 0:
+            lines.append(f"regular{i}==1.0\n")
+    path.write_text("".join(lines))
+
+
+def _synthetic_pins(n: int, repos: int = 10) -> list[tuple[str, str]]:
+    return [(f"repo{i % repos}", _fake_sha(i)) for i in range(n)]
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_parse_requirements(benchmark: Any, tmp_path: Path, n: int) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    _write_requirements(requirements_file_path, _synthetic_pins(n))
+    vcs_vaults = [VcsVault(provider=FORGE_HOST, owner=VAULT, default=True)]
+
+    def parse() -> int:
+        requirements_file = RequirementsFile.from_file(requirements_file_path)
+        return len(
+            _get_vcs_requirements(requirements_file_path, requirements_file, vcs_vaults)
+        )
+
+    assert benchmark(parse) == n
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_scan_requirements(benchmark: Any, tmp_path: Path, n: int) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    _write_requirements(requirements_file_path, _synthetic_pins(n))
+    vcs_vaults = [VcsVault(provider=FORGE_HOST, owner=VAULT, default=True)]
+
+    def scan() -> int:
+        requirements_file = ScannedRequirementsFile.from_file(requirements_file_path)
+        return len(
+            _get_vcs_requirements(requirements_file_path, requirements_file, vcs_vaults)
+        )
+
+    assert benchmark(scan) == n
+
+
+@pytest.mark.parametrize("parse_jobs", [1, 4])
+def test_discover_and_parse_tree(
+    benchmark: Any, tmp_path: Path, parse_jobs: int
+) -> None:
+    """Discover and parse a tree of 2000 requirements files with 10 pins each."""
+    for i in range(2000):
+        directory = tmp_path / f"project{i // 20}" / f"module{i % 20}"
+        directory.mkdir(parents=True)
+        _write_requirements(directory / "requirements.txt", _synthetic_pins(10))
+        (directory / "setup.py").write_text("")
+
+    def discover_and_parse() -> int:
+        return len(
+            list(
+                _parse_requirements_files(
+                    discover_requirements_files([tmp_path], ["requirements*.txt"]),
+                    fast_scan=False,
+                    parse_jobs=parse_jobs,
+                )
+            )
+        )
+
+    assert benchmark.pedantic(discover_and_parse, rounds=1) == 2000
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_pip_vcs_url(benchmark: Any, n: int) -> None:
+    urls = [
+        f"git+https://{FORGE_HOST}/{UPSTREAM}/{repo}@{sha}#subdirectory=pkg{i}"
+        for i, (repo, sha) in enumerate(_synthetic_pins(n))
+    ]
+
+    def handle_urls() -> None:
+        for url in urls:
+            pip_vcs_url = PipVcsUrl.from_url(url)
+            str(pip_vcs_url.with_provider(FORGE_HOST, VAULT))
+            pip_vcs_url.vcs_url(for_push=True)
+
+    benchmark(handle_urls)
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_cache_lookup(benchmark: Any, tmp_path: Path, n: int) -> None:
+    cache = Cache(tmp_path)
+    pins = _synthetic_pins(n)
+    for repo, sha in pins:
+        cache.update_commit_tags(FORGE_HOST, UPSTREAM, repo, sha, ["v1", f"ppr-{sha}"])
+
+    def lookup() -> None:
+        for repo, sha in pins:
+            assert cache.get_commit_tags(FORGE_HOST, UPSTREAM, repo, sha)
+
+    benchmark(lookup)
+
+
+def _forge_pins(fake_forge: FakeForge, n: int) -> list[tuple[str, str]]:
+    """Create upstream repositories with n commits overall, and empty vault
+    repositories, and return one (repo, sha) pin per commit."""
+    pins: list[tuple[str, str]] = []
+    for r in range(E2E_REPOS):
+        repo = f"repo{r}"
+        shas = fake_forge.create_repo(UPSTREAM, repo, commits=n // E2E_REPOS)
+        fake_forge.create_repo(VAULT, repo)
+        pins.extend((repo, sha) for sha in shas)
+    return pins
+
+
+def _reset_vault(fake_forge: FakeForge) -> None:
+    for r in range(E2E_REPOS):
+        shutil.rmtree(fake_forge.root / VAULT / f"repo{r}")
+        fake_forge.create_repo(VAULT, f"repo{r}")
+
+
+def _run(
+    requirements_file_path: Path,
+    project_root: Path,
+    fetch_filter: str = "",
+    forks: bool = False,
+) -> None:
+    tag_requirements_files(
+        [requirements_file_path],
+        [
+            VcsVault(
+                provider=FORGE_HOST,
+                owner=VAULT,
+                default=True,
+                fetch_filter=fetch_filter,
+                forks=forks,
+            )
+        ],
+        Cache(project_root),
+        TagNameFactory("ppr-"),
+        jobs=4,
+        jobs_per_host=4,
+    )
+
+
+@pytest.mark.parametrize("n", E2E_SIZES)
+def test_end_to_end_cold(
+    benchmark: Any,
+    tmp_path: Path,
+    fake_forge: FakeForge,
+    subprocess_stats: SubprocessStats,
+    n: int,
+) -> None:
+    """Push all pins to an empty vault, starting from an empty cache."""
+    pins = _forge_pins(fake_forge, n)
+    requirements_file_path = tmp_path / "requirements.txt"
+    rounds = iter(range(1000))
+
+    def setup() -> tuple[tuple[Path, Path], dict[str, Any]]:
+        _reset_vault(fake_forge)
+        _write_requirements(requirements_file_path, pins)
+        project_root = tmp_path / f"project{next(rounds)}"
+        project_root.mkdir()
+        subprocess_stats.reset()
+        return (requirements_file_path, project_root), {}
+
+    benchmark.pedantic(_run, setup=setup, rounds=3)
+    benchmark.extra_info["subprocesses"] = subprocess_stats.count
+    benchmark.extra_info["subprocess_output_bytes"] = subprocess_stats.output_bytes
+    benchmark.extra_info["vault_bytes"] = dir_size(fake_forge.root / VAULT)
+    assert f"//{FORGE_HOST}/{VAULT}/" in requirements_file_path.read_text()
+    assert len(fake_forge.tags(VAULT, "repo0")) == n // E2E_REPOS
+
+
+@pytest.mark.parametrize("n", E2E_SIZES)
+def test_end_to_end_warm(
+    benchmark: Any,
+    tmp_path: Path,
+    fake_forge: FakeForge,
+    subprocess_stats: SubprocessStats,
+    n: int,
+) -> None:
+    """Run again on requirements already preserved, with a warm cache."""
+    pins = _forge_pins(fake_forge, n)
+    requirements_file_path = tmp_path / "requirements.txt"
+    _write_requirements(requirements_file_path, pins)
+    _run(requirements_file_path, tmp_path)
+    subprocess_stats.reset()
+    forge_size = dir_size(fake_forge.root)
+
+    benchmark(_run, requirements_file_path, tmp_path)
+    benchmark.extra_info["subprocesses"] = subprocess_stats.count
+    benchmark.extra_info["bytes_transferred"] = dir_size(fake_forge.root) - forge_size
+    assert subprocess_stats.count == 0
+
+
+@pytest.mark.parametrize("fetch_filter", ["", "blob:none"])
+def test_push_to_fork(
+    benchmark: Any, tmp_path: Path, fake_forge: FakeForge, fetch_filter: str
+) -> None:
+    """Push recent commits of a large repository to a vault that forked it
+    earlier, starting from an empty cache."""
+    shas = fake_forge.create_repo(UPSTREAM, "big", commits=200, blob_size=100_000)
+    vault_dir = fake_forge.root / VAULT / "big"
+    fake_forge.create_repo(VAULT, "big")
+    git(
+        fake_forge.root / UPSTREAM / "big",
+        "push",
+        "--quiet",
+        str(vault_dir),
+        f"{shas[-11]}:refs/heads/main",
+    )
+    pins = [("big", sha) for sha in shas[-10:]]
+    requirements_file_path = tmp_path / "requirements.txt"
+    rounds = iter(range(1000))
+
+    def setup() -> tuple[tuple[Path, Path, str, bool], dict[str, Any]]:
+        for tag in fake_forge.tags(VAULT, "big"):
+            git(vault_dir, "tag", "-d", tag)
+        _write_requirements(requirements_file_path, pins)
+        project_root = tmp_path / f"project{next(rounds)}"
+        project_root.mkdir()
+        return (requirements_file_path, project_root, fetch_filter, True), {}
+
+    benchmark.pedantic(_run, setup=setup, rounds=3)
+    mirrors_dir = tmp_path / "project0" / ".pip_preserve_requirements_cache" / "mirrors"
+    benchmark.extra_info["mirror_bytes"] = dir_size(mirrors_dir)
+    assert len(fake_forge.tags(VAULT, "big")) == len(pins)
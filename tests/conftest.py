@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+"""Helpers and fixtures shared by tests and benchmarks."""
+
+from __future__ import annotations
+
+import subprocess
+import textwrap
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from pip_preserve_requirements._profile import (
+    Profiler,
+    disable_profiling,
+    enable_profiling,
+)
+
+SHA = "a" * 40
+
+
+def git(repo_dir: Path, *args: str, **kwargs: Any) -> str:
+    """Run a git command in repo_dir, and return its stripped output."""
+    result: subprocess.CompletedProcess[str] = subprocess.run(
+        ["git", "-C", str(repo_dir), *args],
+        check=True,
+        text=True,
+        capture_output=True,
+        **kwargs,
+    )
+    return result.stdout.strip()
+
+
+def write_project(project_root: Path) -> Path:
+    """Write a project with a vault and a requirements file pinning SHA,
+    and return the path of the requirements file."""
+    (project_root / "pyproject.toml").write_text(
+        textwrap.dedent(
+            """\
+            [[tool.pip-preserve-requirements.vcs_vaults]]
+            provider = "github.com"
+            owner = "acme"
+            """
+        )
+    )
+    requirements_file_path = project_root / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA}\n")
+    return requirements_file_path
+
+
+@pytest.fixture
+def profiler() -> Iterator[Profiler]:
+    try:
+        yield enable_profiling()
+    finally:
+        disable_profiling()
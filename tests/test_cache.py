@@ -1,9 +1,19 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
 from pathlib import Path
 
-from pip_preserve_requirements._cache import Cache
+import pytest
+
+from pip_preserve_requirements import _cache
+from pip_preserve_requirements._cache import SCHEMA_VERSION, Cache
+from pip_preserve_requirements._concurrency import FileLock
 
 
 def test_cache_initialize(tmp_path: Path) -> None:
@@ -76,3 +86,307 @@ def test_cache_update_tags(tmp_path: Path) -> None:
         "tag1",
         "tag2",
     ]
+
+
+def test_cache_mirror_dir(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    assert cache.mirror_dir("github.com", "acsone", "repo.git") == (
+        tmp_path
+        / ".pip_preserve_requirements_cache"
+        / "mirrors"
+        / "github.com"
+        / "acsone"
+        / "repo.git"
+    )
+    assert cache.mirror_dir("github.com", "acsone", "repo") == cache.mirror_dir(
+        "github.com", "acsone", "repo.git"
+    )
+
+
+def test_cache_evict_mirrors(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    now = time.time()
+    mirror_dirs = []
+    for i, age in enumerate([10, 20, 30, 100]):
+        mirror_dir = cache.mirror_dir("github.com", "acsone", f"repo{i}")
+        mirror_dir.mkdir(parents=True)
+        (mirror_dir / "pack").write_bytes(b"x" * 100)
+        os.utime(mirror_dir, (now - age, now - age))
+        mirror_dirs.append(mirror_dir)
+    # the oldest mirror is evicted by age, then the least recently used
+    # one is evicted by size
+    cache.evict_mirrors(max_age=50, max_size=250)
+    assert [mirror_dir.is_dir() for mirror_dir in mirror_dirs] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    # mirror_dir() records the last use
+    assert cache.mirror_dir("github.com", "acsone", "repo1").stat().st_mtime >= now
+
+
+def test_cache_evict_mirrors_in_use(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    mirror_dir = cache.mirror_dir("github.com", "acsone", "repo")
+    mirror_dir.mkdir(parents=True)
+    os.utime(mirror_dir, (0, 0))
+    with FileLock.for_directory(mirror_dir):
+        cache.evict_mirrors(max_age=0, max_size=0)
+        assert mirror_dir.is_dir()
+    cache.evict_mirrors(max_age=0, max_size=0)
+    assert not mirror_dir.is_dir()
+
+
+def test_cache_evict_mirrors_recorded_sizes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    cache = Cache(tmp_path)
+    mirror_dirs = []
+    for i in range(2):
+        mirror_dir = cache.mirror_dir("github.com", "acsone", f"repo{i}")
+        mirror_dir.mkdir(parents=True)
+        (mirror_dir / "pack").write_bytes(b"x" * 100)
+        os.utime(mirror_dir, (i, i))
+        mirror_dirs.append(mirror_dir)
+    cache.evict_mirrors(max_age=float("inf"), max_size=1000)
+    measured_dirs = []
+    get_dir_size = Cache._get_dir_size
+
+    def _get_dir_size(path: Path) -> int:
+        measured_dirs.append(path)
+        return get_dir_size(path)
+
+    monkeypatch.setattr(Cache, "_get_dir_size", staticmethod(_get_dir_size))
+    # mirrors are not looked at when none was used
+    Cache(tmp_path).evict_mirrors(max_age=0, max_size=0)
+    assert all(mirror_dir.is_dir() for mirror_dir in mirror_dirs)
+    # only the used mirror is measured again
+    cache = Cache(tmp_path)
+    cache.mirror_dir("github.com", "acsone", "repo1")
+    (mirror_dirs[1] / "pack").write_bytes(b"x" * 300)
+    cache.evict_mirrors(max_age=float("inf"), max_size=350)
+    assert measured_dirs == [mirror_dirs[1]]
+    assert [mirror_dir.is_dir() for mirror_dir in mirror_dirs] == [False, True]
+
+
+def test_cache_shared_dir(tmp_path: Path) -> None:
+    """Test that a cache directory can be shared by concurrent processes."""
+    cache_dir = tmp_path / "cache" / "ppr"
+    cache = Cache(tmp_path / "prj", cache_dir=cache_dir)
+    assert (cache_dir / "tags.db").is_file()
+    assert not (tmp_path / "prj").exists()
+    script = (
+        "import sys\n"
+        "from pathlib import Path\n"
+        "from pip_preserve_requirements._cache import Cache\n"
+        "cache = Cache(Path(), cache_dir=Path(sys.argv[1]))\n"
+        "for i in range(50):\n"
+        "    cache.add_commit_tag('github.com', 'a', 'repo', sys.argv[2], str(i))\n"
+    )
+    processes = [
+        subprocess.Popen([sys.executable, "-c", script, str(cache_dir), f"sha{i}"])
+        for i in range(4)
+    ]
+    assert [process.wait() for process in processes] == [0] * 4
+    for i in range(4):
+        tags = cache.get_commit_tags("github.com", "a", "repo", f"sha{i}")
+        assert len(tags) == 50
+
+
+def test_cache_positive_ttl(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    cache.add_commit_tag("github.com", "acsone", "repo", "sha", "tag")
+    assert Cache(tmp_path, positive_ttl=60).get_commit_tags(
+        "github.com", "acsone", "repo", "sha"
+    ) == ["tag"]
+    assert not Cache(tmp_path, positive_ttl=-1).get_commit_tags(
+        "github.com", "acsone", "repo", "sha"
+    )
+    # refresh ignores entries recorded before the cache was created
+    refreshed_cache = Cache(tmp_path, refresh=True)
+    assert not refreshed_cache.get_commit_tags("github.com", "acsone", "repo", "sha")
+    refreshed_cache.update_commit_tags("github.com", "acsone", "repo", "sha", ["tag"])
+    assert refreshed_cache.get_commit_tags("github.com", "acsone", "repo", "sha") == [
+        "tag"
+    ]
+
+
+def test_cache_remote_tags(tmp_path: Path) -> None:
+    cache = Cache(tmp_path, negative_ttl=60)
+    assert cache.get_remote_tags("github.com", "acsone", "repo") is None
+    cache.add_commit_tag("github.com", "acsone", "repo", "sha0", "tag0")
+    cache.update_remote_tags(
+        "github.com", "acsone", "repo", {"sha1": ["tag1", "tag2"], "sha2": ["tag3"]}
+    )
+    assert cache.get_remote_tags("github.com", "acsone", "repo") == {
+        "sha1": ["tag1", "tag2"],
+        "sha2": ["tag3"],
+    }
+    # the listing replaces previously cached tags of the repository
+    assert not cache.get_commit_tags("github.com", "acsone", "repo", "sha0")
+    assert cache.get_commit_tags("github.com", "acsone", "repo", "sha2") == ["tag3"]
+    # expired listing
+    assert (
+        Cache(tmp_path, negative_ttl=-1).get_remote_tags("github.com", "acsone", "repo")
+        is None
+    )
+    assert (
+        Cache(tmp_path, negative_ttl=60, refresh=True).get_remote_tags(
+            "github.com", "acsone", "repo"
+        )
+        is None
+    )
+
+
+def test_cache_remote_tags_prefix(tmp_path: Path) -> None:
+    cache = Cache(tmp_path, negative_ttl=60)
+    cache.add_commit_tag("github.com", "acsone", "repo", "sha0", "v0")
+    cache.add_commit_tag("github.com", "acsone", "repo", "sha0", "ppr-0")
+    cache.update_remote_tags(
+        "github.com", "acsone", "repo", {"sha1": ["ppr-1"]}, tag_prefix="ppr-"
+    )
+    assert cache.get_remote_tags("github.com", "acsone", "repo", "ppr-") == {
+        "sha1": ["ppr-1"]
+    }
+    # a listing with a longer prefix is included in the listing
+    assert cache.get_remote_tags("github.com", "acsone", "repo", "ppr-1") == {
+        "sha1": ["ppr-1"]
+    }
+    # other tags are not included in the listing
+    assert cache.get_remote_tags("github.com", "acsone", "repo") is None
+    assert cache.get_remote_tags("github.com", "acsone", "repo", "v") is None
+    # and are kept in cache
+    assert cache.get_commit_tags("github.com", "acsone", "repo", "sha0") == ["v0"]
+    # a complete listing includes all prefixes
+    cache.update_remote_tags("github.com", "acsone", "repo", {"sha1": ["ppr-1", "v1"]})
+    assert cache.get_remote_tags("github.com", "acsone", "repo", "ppr-") == {
+        "sha1": ["ppr-1"]
+    }
+    assert not cache.get_commit_tags("github.com", "acsone", "repo", "sha0")
+
+
+def test_cache_missing_tags(tmp_path: Path) -> None:
+    cache = Cache(tmp_path, negative_ttl=60)
+    cache.set_tags_missing("github.com", "acsone", "repo", ["ppr-1", "ppr-2"])
+    assert cache.is_tag_missing("github.com", "acsone", "repo", "ppr-1")
+    assert not cache.is_tag_missing("github.com", "acsone", "repo", "ppr-3")
+    assert not cache.is_tag_missing("github.com", "acsone", "other", "ppr-1")
+    # a tag placed on the remote is not missing anymore
+    cache.add_commit_tag("github.com", "acsone", "repo", "sha1", "ppr-1")
+    assert not cache.is_tag_missing("github.com", "acsone", "repo", "ppr-1")
+    assert cache.is_tag_missing("github.com", "acsone", "repo", "ppr-2")
+    # missing tags expire with negative_ttl
+    assert not Cache(tmp_path).is_tag_missing("github.com", "acsone", "repo", "ppr-2")
+
+
+def test_cache_set_tags_missing_one_transaction(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    statements: list[str] = []
+    cache._tags_db_conn.set_trace_callback(statements.append)
+    tags = [f"ppr-{i}" for i in range(100)]
+    cache.set_tags_missing("github.com", "acsone", "repo", tags)
+    assert statements.count("COMMIT") == 1
+
+
+def test_cache_migrate_checked_at(tmp_path: Path) -> None:
+    cache_dir = tmp_path / ".pip_preserve_requirements_cache"
+    cache_dir.mkdir()
+    conn = sqlite3.connect(cache_dir / "tags.db")
+    conn.execute(
+        "CREATE TABLE tags (provider TEXT NOT NULL, owner TEXT NOT NULL, "
+        "repo TEXT NOT NULL, sha TEXT NOT NULL, tag TEXT NOT NULL)"
+    )
+    conn.execute("INSERT INTO tags VALUES ('github.com', 'acsone', 'repo', 'sha', 't')")
+    conn.commit()
+    conn.close()
+    cache = Cache(tmp_path)
+    assert cache.get_commit_tags("github.com", "acsone", "repo", "sha") == ["t"]
+    assert not Cache(tmp_path, positive_ttl=60).get_commit_tags(
+        "github.com", "acsone", "repo", "sha"
+    )
+
+
+def test_cache_processed_files(tmp_path: Path) -> None:
+    path = tmp_path / "requirements.txt"
+    cache = Cache(tmp_path)
+    assert not cache.is_file_processed(path, "digest", "config")
+    cache.set_file_processed(path, "digest", "config")
+    assert cache.is_file_processed(path, "digest", "config")
+    assert not cache.is_file_processed(path, "other", "config")
+    assert not cache.is_file_processed(path, "digest", "other")
+    cache.set_file_processed(path, "other", "config")
+    assert cache.is_file_processed(path, "other", "config")
+    assert not cache.is_file_processed(path, "digest", "config")
+    # processing is only valid as long as the tags it relied on
+    assert not Cache(tmp_path, positive_ttl=-1).is_file_processed(
+        path, "other", "config"
+    )
+    assert not Cache(tmp_path, refresh=True).is_file_processed(path, "other", "config")
+
+
+def test_cache_add_tag_dedup(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    for _ in range(3):
+        cache.add_commit_tag("github.com", "acsone", "repo", "sha", "tag")
+    assert cache.get_commit_tags("github.com", "acsone", "repo", "sha") == ["tag"]
+
+
+def test_cache_schema(tmp_path: Path) -> None:
+    cache = Cache(tmp_path)
+    conn = cache._tags_db_conn
+    assert conn.execute("PRAGMA user_version").fetchone() == (SCHEMA_VERSION,)
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT tag FROM tags WHERE "
+        "provider = ? AND owner = ? AND repo = ? AND sha = ?",
+        ["github.com", "acsone", "repo", "sha"],
+    ).fetchall()
+    assert "INDEX tags_commit_tag (provider=? AND owner=? AND repo=? AND sha=?)" in str(
+        plan
+    )
+
+
+def test_cache_migrate_duplicates(tmp_path: Path) -> None:
+    cache_dir = tmp_path / ".pip_preserve_requirements_cache"
+    cache_dir.mkdir()
+    conn = sqlite3.connect(cache_dir / "tags.db")
+    conn.execute(
+        "CREATE TABLE tags (provider TEXT NOT NULL, owner TEXT NOT NULL, "
+        "repo TEXT NOT NULL, sha TEXT NOT NULL, tag TEXT NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO tags VALUES ('github.com', 'acsone', 'repo', 'sha', ?)",
+        [("t2",), ("t1",), ("t2",), ("t1",)],
+    )
+    conn.commit()
+    conn.close()
+    cache = Cache(tmp_path)
+    assert cache.get_commit_tags("github.com", "acsone", "repo", "sha") == [
+        "t2",
+        "t1",
+    ]
+    # reopening a migrated database is a no-op
+    cache2 = Cache(tmp_path)
+    assert cache2.get_commit_tags("github.com", "acsone", "repo", "sha") == [
+        "t2",
+        "t1",
+    ]
+
+
+def test_cache_keep_connections_open(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(_cache, "_open_connections", None)
+    assert Cache(tmp_path)._tags_db_conn is not Cache(tmp_path)._tags_db_conn
+    _cache.keep_connections_open()
+    cache = Cache(tmp_path)
+    cache.add_commit_tag("github.com", "acme", "repo", "sha", "tag")
+    cache2 = Cache(tmp_path)
+    assert cache2._tags_db_conn is cache._tags_db_conn
+    assert cache2.get_commit_tags("github.com", "acme", "repo", "sha") == ["tag"]
+    # the cache directory is removed, for instance by the user
+    shutil.rmtree(tmp_path / ".pip_preserve_requirements_cache")
+    cache3 = Cache(tmp_path)
+    assert cache3._tags_db_conn is not cache._tags_db_conn
+    assert cache3.get_commit_tags("github.com", "acme", "repo", "sha") == []
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pip_preserve_requirements._concurrency import FileLock, HostLimiter
+
+
+def test_host_limiter() -> None:
+    host_limiter = HostLimiter(2)
+    lock = threading.Lock()
+    running: dict[str, int] = {"a": 0, "b": 0}
+    max_running: dict[str, int] = {"a": 0, "b": 0}
+
+    def work(host: str) -> None:
+        with host_limiter.limit(host):
+            with lock:
+                running[host] += 1
+                max_running[host] = max(max_running[host], running[host])
+            time.sleep(0.01)
+            with lock:
+                running[host] -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(work, ["a", "b"] * 8))
+    assert max_running["a"] <= 2
+    assert max_running["b"] <= 2
+
+
+def test_host_limiter_several_hosts() -> None:
+    host_limiter = HostLimiter(1)
+    with host_limiter.limit("a", "b", "a"):
+        pass
+    with host_limiter.limit("b", "a"):
+        pass
+
+
+def test_file_lock(tmp_path: Path) -> None:
+    directory = tmp_path / "a" / "repo.git"
+    lock = FileLock.for_directory(directory)
+    assert lock.path == tmp_path / "a" / "repo.git.lock"
+    other_lock = FileLock.for_directory(directory)
+    with lock:
+        assert not other_lock.acquire(blocking=False)
+        # the lock is held across processes
+        script = (
+            "import sys\n"
+            "from pathlib import Path\n"
+            "from pip_preserve_requirements._concurrency import FileLock\n"
+            "sys.exit(0 if FileLock(Path(sys.argv[1])).acquire(False) else 3)\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script, str(lock.path)])
+        assert result.returncode == 3
+    assert other_lock.acquire(blocking=False)
+    other_lock.release()
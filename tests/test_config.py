@@ -8,6 +8,7 @@ import pydantic
 import pytest
 
 from pip_preserve_requirements._config import Config
+from pip_preserve_requirements._schemas import VcsVault
 
 
 def test_config(tmp_path: Path) -> None:
@@ -30,6 +31,8 @@ def test_config(tmp_path: Path) -> None:
             provider = "gitlab.acme.com"
             owner = "acme"
             ssh_only = true
+            fetch_filter = "blob:none"
+            forks = true
             """
         )
     )
@@ -42,6 +45,29 @@ def test_config(tmp_path: Path) -> None:
     assert config.vcs_vaults[1].owner == "acme"
     assert config.vcs_vaults[1].ssh_only is True
     assert config.vcs_vaults[1].default is False
+    assert config.vcs_vaults[0].fetch_filter == ""
+    assert config.vcs_vaults[1].fetch_filter == "blob:none"
+    assert config.vcs_vaults[0].forks is False
+    assert config.vcs_vaults[1].forks is True
+
+
+def test_config_coerced(tmp_path: Path) -> None:
+    """Test that values of other types are validated by pydantic."""
+    pyproject_toml_path = tmp_path / "pyproject.toml"
+    pyproject_toml_path.write_text(
+        textwrap.dedent(
+            """\
+            [[tool.pip-preserve-requirements.vcs_vaults]]
+            provider = "github.com"
+            owner = "acsone"
+            ssh_only = 1
+            """
+        )
+    )
+    config = Config.from_pyproject_toml(tmp_path)
+    assert config.vcs_vaults == [
+        VcsVault(provider="github.com", owner="acsone", ssh_only=True)
+    ]
 
 
 def test_config_error(tmp_path: Path) -> None:
@@ -65,3 +91,27 @@ def test_config_error(tmp_path: Path) -> None:
 def test_config_no_pyproject_toml(tmp_path: Path) -> None:
     config = Config.from_pyproject_toml(tmp_path)
     assert config.vcs_vaults == []
+
+
+def test_config_reloaded(tmp_path: Path) -> None:
+    pyproject_toml_path = tmp_path / "pyproject.toml"
+    pyproject_toml_path.write_text(
+        textwrap.dedent(
+            """\
+            [[tool.pip-preserve-requirements.vcs_vaults]]
+            provider = "github.com"
+            owner = "acsone"
+            """
+        )
+    )
+    config = Config.from_pyproject_toml(tmp_path)
+    # changes to a configuration don't affect the next loads
+    config.vcs_vaults.clear()
+    assert Config.from_pyproject_toml(tmp_path).vcs_vaults == [
+        VcsVault(provider="github.com", owner="acsone")
+    ]
+    pyproject_toml_path.write_text(
+        pyproject_toml_path.read_text().replace("acsone", "acme")
+    )
+    config = Config.from_pyproject_toml(tmp_path)
+    assert config.vcs_vaults == [VcsVault(provider="github.com", owner="acme")]
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import io
+import json
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements import _cache
+from pip_preserve_requirements._cache import Cache
+from pip_preserve_requirements._daemon import Daemon, daemon_main, run_client
+
+from .conftest import SHA, write_project
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="no Unix sockets"
+)
+
+
+@pytest.fixture
+def socket_path() -> Iterator[Path]:
+    # not in tmp_path, which may be longer than the ~100 characters allowed
+    # in the path of sockets
+    socket_dir = tempfile.mkdtemp(prefix="ppr-test-")
+    try:
+        yield Path(socket_dir) / "daemon.sock"
+    finally:
+        shutil.rmtree(socket_dir)
+
+
+@pytest.fixture
+def daemon(socket_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Daemon]:
+    # don't leak the open connections of the daemon to other tests
+    monkeypatch.setattr(_cache, "_open_connections", None)
+    daemon = Daemon(socket_path)
+    ready = threading.Event()
+    thread = threading.Thread(target=daemon.serve, args=(ready,), daemon=True)
+    thread.start()
+    assert ready.wait(timeout=60), "the daemon did not start"
+    try:
+        yield daemon
+    finally:
+        daemon.shutdown()
+        thread.join()
+    assert not daemon.socket_path.exists()
+
+
+def _run_client(daemon: Daemon, *args: str) -> tuple[int | None, str, str]:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    exit_code = run_client(args, daemon.socket_path, stdout, stderr)
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+def test_run_client(
+    daemon: Daemon, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    write_project(tmp_path)
+    # the command runs in the working directory of the client
+    monkeypatch.chdir(tmp_path)
+    exit_code, stdout, stderr = _run_client(daemon, "--check", "requirements.txt")
+    assert exit_code == 1
+    assert "has no tag in cache" in stdout + stderr
+    Cache(tmp_path).add_commit_tag("github.com", "acme", "repo", SHA, f"ppr-{SHA}")
+    exit_code, stdout, stderr = _run_client(
+        daemon, "--check", "--format", "json", "requirements.txt"
+    )
+    assert exit_code == 0, stderr
+    assert json.loads(stdout)["action"] == "cached"
+
+
+def test_run_client_usage_error(daemon: Daemon) -> None:
+    exit_code, _, stderr = _run_client(daemon, "--bogus")
+    assert exit_code == 2
+    assert "--bogus" in stderr
+
+
+def test_run_client_no_daemon(socket_path: Path) -> None:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    assert run_client([], socket_path, stdout, stderr) is None
+
+
+def test_daemon_already_running(daemon: Daemon) -> None:
+    with pytest.raises(RuntimeError, match="already listening"):
+        Daemon(daemon.socket_path).serve()
+
+
+def test_daemon_stale_socket(
+    socket_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # the socket of a daemon that was killed
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(socket_path))
+    assert socket_path.exists()
+    monkeypatch.setattr(_cache, "_open_connections", None)
+    daemon = Daemon(socket_path)
+    ready = threading.Event()
+    thread = threading.Thread(target=daemon.serve, args=(ready,), daemon=True)
+    thread.start()
+    assert ready.wait(timeout=60), "the daemon did not start"
+    daemon.shutdown()
+    thread.join()
+    assert not socket_path.exists()
+
+
+def test_daemon_main_unsupported(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    monkeypatch.delattr(socket, "AF_UNIX")
+    monkeypatch.setattr(sys, "argv", ["pip-preserve-requirements-daemon"])
+    with pytest.raises(SystemExit) as exc_info:
+        daemon_main()
+    assert exc_info.value.code == 1
+    assert "not supported on this platform" in capsys.readouterr().err
@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements._discover import (
+    PathPattern,
+    discover_requirements_files,
+)
+
+from .conftest import git
+
+INCLUDE = ["*requirements*.txt", "**/requirements/*.txt"]
+
+
+def _touch(root: Path, *paths: str) -> None:
+    for path in paths:
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text("prj==1.0\n")
+
+
+@pytest.mark.parametrize(
+    ("pattern", "path", "matches"),
+    [
+        ("requirements*.txt", "requirements.txt", True),
+        ("requirements*.txt", "a/b/requirements-dev.txt", True),
+        ("requirements*.txt", "requirements.in", False),
+        ("/requirements.txt", "a/requirements.txt", False),
+        ("a/*.txt", "a/requirements.txt", True),
+        ("a/*.txt", "a/b/requirements.txt", False),
+        ("a/**/*.txt", "a/b/c/requirements.txt", True),
+        ("a/**/*.txt", "a/requirements.txt", True),
+        ("**/requirements/*.txt", "requirements/base.txt", True),
+        ("**/requirements/*.txt", "a/requirements/base.txt", True),
+        ("req[0-9].txt", "req1.txt", True),
+        ("req[!0-9].txt", "req1.txt", False),
+        ("req?.txt", "req/.txt", False),
+    ],
+)
+def test_path_pattern(pattern: str, path: str, matches: bool) -> None:
+    assert PathPattern(pattern).matches(path) is matches
+
+
+def test_discover_requirements_files(tmp_path: Path) -> None:
+    git(tmp_path, "init")
+    (tmp_path / ".gitignore").write_text("build/\n")
+    _touch(
+        tmp_path,
+        "requirements.txt",
+        "a/dev-requirements.txt",
+        "a/requirements/base.txt",
+        "a/requirements/legacy.txt",
+        "a/other.txt",
+        "build/requirements.txt",
+    )
+    assert discover_requirements_files(
+        [tmp_path, tmp_path / "requirements.txt"],
+        INCLUDE,
+        ["a/requirements/legacy.txt"],
+    ) == [
+        tmp_path / "a" / "dev-requirements.txt",
+        tmp_path / "a" / "requirements" / "base.txt",
+        tmp_path / "requirements.txt",
+    ]
+    # explicit files and glob patterns
+    assert discover_requirements_files(
+        [tmp_path / "a" / "other.txt", tmp_path / "*" / "requirements*.txt"], INCLUDE
+    ) == [
+        tmp_path / "a" / "other.txt",
+        tmp_path / "build" / "requirements.txt",
+    ]
+    with pytest.raises(FileNotFoundError):
+        discover_requirements_files([tmp_path / "*.in"], INCLUDE)
+    with pytest.raises(FileNotFoundError):
+        discover_requirements_files([tmp_path / "missing.txt"], INCLUDE)
+
+
+def test_discover_requirements_files_ignored_by_git(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    excludes_file_path = tmp_path / "excludes"
+    excludes_file_path.write_text("global-requirements.txt\n")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(tmp_path / "gitconfig"))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    git(tmp_path, "config", "--global", "core.excludesFile", str(excludes_file_path))
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    git(repo_dir, "init")
+    (repo_dir / ".git" / "info" / "exclude").write_text("local-requirements.txt\n")
+    (repo_dir / ".gitignore").write_text("a/**/\\#requirements.txt\n")
+    _touch(
+        repo_dir,
+        "requirements.txt",
+        "global-requirements.txt",
+        "local-requirements.txt",
+        "a/b/#requirements.txt",
+        "a/b/dev-requirements.txt",
+    )
+    assert discover_requirements_files([repo_dir], INCLUDE) == [
+        repo_dir / "a" / "b" / "dev-requirements.txt",
+        repo_dir / "requirements.txt",
+    ]
+    # tracked files are not ignored
+    git(repo_dir, "add", "--force", "local-requirements.txt")
+    (repo_dir / ".gitignore").write_text("*.txt\n")
+    assert discover_requirements_files([repo_dir], INCLUDE) == [
+        repo_dir / "local-requirements.txt",
+    ]
+
+
+def test_discover_requirements_files_outside_git(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path.parent))
+    # not read outside a git working tree
+    (tmp_path / ".gitignore").write_text("requirements.txt\n")
+    _touch(tmp_path, "requirements.txt", "a/requirements.txt")
+    assert discover_requirements_files([tmp_path], INCLUDE) == [
+        tmp_path / "a" / "requirements.txt",
+        tmp_path / "requirements.txt",
+    ]
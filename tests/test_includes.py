@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import textwrap
+from pathlib import Path
+
+from pytest import CaptureFixture
+
+from pip_preserve_requirements._includes import find_includes, walk_includes
+
+
+def test_find_includes(tmp_path: Path, capsys: CaptureFixture[str]) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(
+        textwrap.dedent(
+            """\
+            -r a.txt
+            -rb.txt
+            --requirement=c.txt  # comment
+            -c sub/d.txt
+            --constraint e.txt
+            -r https://example.com/f.txt
+            --config-settings x=y
+            # -r g.txt
+            prj==1.0
+            """
+        )
+    )
+    assert list(find_includes(requirements_file_path)) == [
+        tmp_path / "a.txt",
+        tmp_path / "b.txt",
+        tmp_path / "c.txt",
+        tmp_path / "sub" / "d.txt",
+        tmp_path / "e.txt",
+    ]
+    assert capsys.readouterr().err == (
+        f"{requirements_file_path}: can't follow https://example.com/f.txt\n"
+    )
+
+
+def test_walk_includes(tmp_path: Path, capsys: CaptureFixture[str]) -> None:
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "requirements.txt").write_text("-r base.txt\n-c sub/constraints.txt\n")
+    (tmp_path / "dev.txt").write_text("-r base.txt\n-r missing.txt\n")
+    (tmp_path / "base.txt").write_text("-r requirements.txt\n")
+    (tmp_path / "sub" / "constraints.txt").write_text("-c ../base.txt\n")
+    assert walk_includes(
+        [tmp_path / "requirements.txt", tmp_path / "dev.txt", tmp_path / "base.txt"]
+    ) == [
+        tmp_path / "requirements.txt",
+        tmp_path / "base.txt",
+        tmp_path / "sub" / "constraints.txt",
+        tmp_path / "dev.txt",
+    ]
+    assert capsys.readouterr().err == (
+        f"Include cycle: {tmp_path / 'requirements.txt'} -> "
+        f"{tmp_path / 'base.txt'} -> {tmp_path / 'requirements.txt'}\n"
+        f"{tmp_path / 'dev.txt'}: included file {tmp_path / 'missing.txt'} "
+        "not found\n"
+    )
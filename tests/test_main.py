@@ -0,0 +1,183 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from typer.testing import CliRunner
+
+from pip_preserve_requirements.__main__ import app
+from pip_preserve_requirements._cache import Cache
+
+from .conftest import SHA, write_project
+
+
+def test_check(tmp_path: Path) -> None:
+    requirements_file_path = write_project(tmp_path)
+    runner = CliRunner()
+    args = ["--check", "-r", str(tmp_path), str(requirements_file_path)]
+    result = runner.invoke(app, args)
+    assert result.exit_code == 1
+    assert "has no tag in cache" in result.output
+    Cache(tmp_path).add_commit_tag("github.com", "acme", "repo", SHA, f"ppr-{SHA}")
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0, result.output
+
+
+def test_check_follow_includes(tmp_path: Path) -> None:
+    requirements_file_path = write_project(tmp_path)
+    dev_requirements_file_path = tmp_path / "dev.txt"
+    dev_requirements_file_path.write_text(f"-r {requirements_file_path.name}\n")
+    runner = CliRunner()
+    args = ["--check", "-r", str(tmp_path), str(dev_requirements_file_path)]
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(app, [*args, "--follow-includes"])
+    assert result.exit_code == 1
+    assert f"{requirements_file_path}: " in result.output
+
+
+def test_check_directory(tmp_path: Path) -> None:
+    requirements_file_path = write_project(tmp_path)
+    requirements_file_path.rename(tmp_path / "requirements-dev.txt")
+    runner = CliRunner()
+    result = runner.invoke(app, ["--check", "-r", str(tmp_path), str(tmp_path)])
+    assert result.exit_code == 1
+    assert "requirements-dev.txt: " in result.output
+    result = runner.invoke(
+        app,
+        ["--check", "-r", str(tmp_path), "--exclude", "*-dev.txt", str(tmp_path)],
+    )
+    assert result.exit_code == 0, result.output
+
+
+def _imported_modules(*args: str) -> set[str]:
+    """Run the command with -X importtime and return the imported modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "pip_preserve_requirements", *args],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_fast_path_imports(tmp_path: Path, cached: bool) -> None:
+    """Test that fast paths do not import pydantic nor the requirements parser."""
+    requirements_file_path = write_project(tmp_path)
+    if cached:
+        Cache(tmp_path).add_commit_tag("github.com", "acme", "repo", SHA, f"ppr-{SHA}")
+        args = ["--check", "--fast-scan"]
+    else:
+        # no VCS requirement
+        requirements_file_path.write_text("prj==1.0\n")
+        args = []
+    modules = _imported_modules(*args, "-r", str(tmp_path), str(requirements_file_path))
+    assert "pip_preserve_requirements._tag_requirements" in modules
+    assert "pydantic" not in modules
+    assert "pip_requirements_parser" not in modules
+    assert _imported_modules("--help").isdisjoint(
+        {"sqlite3", "pip_preserve_requirements._tag_requirements"}
+    )
+
+
+def test_check_shared_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that projects find the tags recorded by others in a shared cache."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    monkeypatch.delenv("PIP_PRESERVE_REQUIREMENTS_CACHE_DIR", raising=False)
+    shared_cache_dir = tmp_path / "shared"
+    Cache(tmp_path, cache_dir=shared_cache_dir).add_commit_tag(
+        "github.com", "acme", "repo", SHA, f"ppr-{SHA}"
+    )
+    runner = CliRunner()
+    for project in ("prj1", "prj2"):
+        project_root = tmp_path / project
+        project_root.mkdir()
+        requirements_file_path = write_project(project_root)
+        args = ["--check", "-r", str(project_root), str(requirements_file_path)]
+        result = runner.invoke(app, args)
+        assert result.exit_code == 1
+        result = runner.invoke(
+            app,
+            args,
+            env={"PIP_PRESERVE_REQUIREMENTS_CACHE_DIR": str(shared_cache_dir)},
+        )
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, [*args, "--shared-cache"])
+        assert result.exit_code == 1
+    assert (tmp_path / "xdg" / "pip-preserve-requirements" / "tags.db").is_file()
+
+
+def test_check_cache_dir_in_pyproject(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a relative cache_dir is relative to the project root."""
+    monkeypatch.delenv("PIP_PRESERVE_REQUIREMENTS_CACHE_DIR", raising=False)
+    requirements_file_path = write_project(tmp_path)
+    with (tmp_path / "pyproject.toml").open("a") as f:
+        f.write('[tool.pip-preserve-requirements]\ncache_dir = "cache"\n')
+    subdir = tmp_path / "subdir"
+    subdir.mkdir()
+    monkeypatch.chdir(subdir)
+    args = ["--check", "-r", str(tmp_path), str(requirements_file_path)]
+    result = CliRunner().invoke(app, args)
+    assert result.exit_code == 1, result.output
+    assert (tmp_path / "cache" / "tags.db").is_file()
+    assert not (subdir / "cache").exists()
+
+
+def test_profile(tmp_path: Path) -> None:
+    requirements_file_path = write_project(tmp_path)
+    Cache(tmp_path).add_commit_tag("github.com", "acme", "repo", SHA, f"ppr-{SHA}")
+    profile_output_path = tmp_path / "profile.json"
+    result = CliRunner().invoke(
+        app,
+        [
+            "--check",
+            "--profile",
+            "--profile-output",
+            str(profile_output_path),
+            "-r",
+            str(tmp_path),
+            str(requirements_file_path),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "cache.get_commit_tags" in result.output
+    assert "Cache hit ratio: 1/1 (100%)" in result.output
+    profile = json.loads(profile_output_path.read_text())
+    span_names = {
+        span["name"] for span in profile["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+    assert {"parse", "tags.cached", "cache.get_commit_tags"} <= span_names
+
+
+def test_check_format_json(tmp_path: Path) -> None:
+    requirements_file_path = write_project(tmp_path)
+    result = CliRunner().invoke(
+        app,
+        [
+            "--check",
+            "--format",
+            "json",
+            "-r",
+            str(tmp_path),
+            str(requirements_file_path),
+        ],
+    )
+    assert result.exit_code == 1
+    (record,) = [
+        json.loads(line) for line in result.stdout.splitlines() if line.startswith("{")
+    ]
+    assert record["file"] == str(requirements_file_path)
+    assert record["line"] == 1
+    assert record["url"] == f"git+https://github.com/acme/repo@{SHA}"
+    assert record["action"] == "missing"
@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements._profile import (
+    Profiler,
+    profiled,
+    repo_attributes,
+    run_subprocess,
+    span,
+)
+
+
+def test_span_disabled() -> None:
+    with span("op", a=1) as attributes:
+        attributes["b"] = 2
+    assert attributes == {"a": 1, "b": 2}
+
+
+def test_span(profiler: Profiler) -> None:
+    with span("outer", cached=False) as attributes:
+        with span("inner", cached=True):
+            pass
+        attributes["bytes"] = 3
+    with pytest.raises(ValueError), span("failing"):
+        raise ValueError()
+    inner, outer, failing = profiler.spans
+    assert (outer.name, outer.parent_id, outer.attributes) == (
+        "outer",
+        None,
+        {"cached": False, "bytes": 3},
+    )
+    assert inner.parent_id == outer.span_id
+    assert outer.duration >= inner.duration
+    assert failing.attributes == {"error": "ValueError"}
+    assert "Cache hit ratio: 1/2 (50%)" in profiler.report()
+
+
+def test_profiled(profiler: Profiler) -> None:
+    @profiled("add")
+    def add(a: int, b: int) -> int:
+        return a + b
+
+    assert add(1, 2) == 3
+    assert [s.name for s in profiler.spans] == ["add"]
+
+
+def test_run_subprocess(profiler: Profiler, tmp_path: Path) -> None:
+    script_path = tmp_path / "hello.py"
+    script_path.write_text("print('hello')")
+    script = str(script_path)
+    result = run_subprocess(
+        [sys.executable, script, "https://github.com/acme/repo.git"],
+        capture_output=True,
+        check=True,
+    )
+    assert result.stdout.strip() == b"hello"
+    with pytest.raises(subprocess.CalledProcessError):
+        run_subprocess([sys.executable, "-c", "raise SystemExit(3)"], check=True)
+    ok, failed = profiler.spans
+    assert ok.attributes == {
+        "command": f"{sys.executable} {script}",
+        "host": "github.com",
+        "repo": "github.com/acme/repo",
+        "returncode": 0,
+        "bytes": len(result.stdout),
+    }
+    assert failed.attributes["returncode"] == 3
+    report = profiler.report()
+    assert f"Subprocesses: 2 ({len(result.stdout)} bytes of output)" in report
+    assert "github.com/acme/repo" in report
+
+
+def test_to_otlp_json(profiler: Profiler) -> None:
+    with span("outer", host="github.com"), span("inner", cached=True, bytes=3):
+        pass
+    (resource_spans,) = json.loads(profiler.to_otlp_json())["resourceSpans"]
+    (scope_spans,) = resource_spans["scopeSpans"]
+    outer, inner = scope_spans["spans"]
+    assert outer["name"] == "outer"
+    assert "parentSpanId" not in outer
+    assert inner["parentSpanId"] == outer["spanId"]
+    assert inner["traceId"] == outer["traceId"] == profiler.trace_id
+    assert int(outer["startTimeUnixNano"]) <= int(inner["startTimeUnixNano"])
+    assert inner["attributes"] == [
+        {"key": "cached", "value": {"boolValue": True}},
+        {"key": "bytes", "value": {"intValue": "3"}},
+    ]
+
+
+def test_repo_attributes() -> None:
+    assert repo_attributes("ssh://git@github.com/acme/repo.git") == {
+        "host": "github.com",
+        "repo": "github.com/acme/repo",
+    }
+    assert repo_attributes("/tmp/repo") == {}
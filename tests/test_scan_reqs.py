@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements._scan_reqs import (
+    ScannedLink,
+    ScannedRequirementsFile,
+    scan_requirements_file,
+)
+
+SHA = "a" * 40
+
+
+def test_scan_requirements_file(tmp_path: Path) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_bytes(
+        (
+            "# a comment \\\r\n"
+            "\r\n"
+            "--index-url https://pypi.org/simple\r\n"
+            "prj==1.0  # with a comment\r\n"
+            "prj[extra]>=1 ; python_version >= '3.9'\r\n"
+            f"name@ git+https://github.com/acme/a@{SHA} ; python_version >= '3.9'\r\n"
+            f"name[extra] @ git+https://github.com/acme/b@{SHA}#egg=name\r\n"
+            f"  -e git+https://github.com/acme/c@{SHA}#egg=name\r\n"
+            f"--editable=git+https://github.com/acme/d@{SHA}#egg=name\r\n"
+            f"git+ssh://git@github.com/acme/e@{SHA}#egg=name --hash=sha256:abc\r\n"
+            "-e .\r\n"
+            "https://example.com/pkgb-1.0.tar.gz"
+        ).encode()
+    )
+    requirements_file = ScannedRequirementsFile.from_file(requirements_file_path)
+    assert [r.link.url for r in requirements_file.requirements] == [
+        f"git+https://github.com/acme/a@{SHA}",
+        f"git+https://github.com/acme/b@{SHA}#egg=name",
+        f"git+https://github.com/acme/c@{SHA}#egg=name",
+        f"git+https://github.com/acme/d@{SHA}#egg=name",
+        f"git+ssh://git@github.com/acme/e@{SHA}#egg=name",
+        ".",
+        "https://example.com/pkgb-1.0.tar.gz",
+    ]
+    assert requirements_file.dumps().encode() == requirements_file_path.read_bytes()
+    for requirement in requirements_file.requirements:
+        requirement.link = ScannedLink(requirement.link.url.replace("acme", "vault"))
+    assert requirements_file.dumps().encode() == (
+        requirements_file_path.read_bytes().replace(b"/acme/", b"/vault/")
+    )
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "-r base.txt",
+        "-cconstraints.txt",
+        "--requirement=base.txt",
+        f"name @ git+https://github.com/acme/a@{SHA} \\",
+        "git+https://${TOKEN}@github.com/acme/a",
+        "(not a requirement)",
+    ],
+)
+def test_scan_requirements_file_unsupported(tmp_path: Path, line: str) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"prj==1.0\n{line}\n")
+    assert scan_requirements_file(requirements_file_path) is None
+
+
+def test_scan_requirements_file_not_utf8(tmp_path: Path) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_bytes(b"pr\xe9==1.0\n")
+    assert scan_requirements_file(requirements_file_path) is None
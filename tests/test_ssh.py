@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from pip_preserve_requirements._ssh import (
+    shared_ssh_connections,
+    ssh_command,
+    use_shared_ssh_connections,
+)
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="no ControlMaster")
+
+URL = "ssh://git@example.com/acme/repo"
+
+
+@pytest.fixture
+def ssh_log_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Put a fake ssh in PATH, which logs its arguments and fails."""
+    ssh_log_path = tmp_path / "ssh.log"
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    ssh_path = bin_dir / "ssh"
+    ssh_path.write_text(
+        textwrap.dedent(
+            f"""\
+            #!/bin/sh
+            echo "$@" >> {ssh_log_path}
+            exit 255
+            """
+        )
+    )
+    ssh_path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(tmp_path / "gitconfig"))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    return ssh_log_path
+
+
+def _git_ssh(ssh_log_path: Path) -> str:
+    """Let git connect to a host with SSH, and return the ssh command line."""
+    ssh_log_path.unlink(missing_ok=True)
+    subprocess.run(
+        ["git", "ls-remote", URL],
+        capture_output=True,
+    )
+    return ssh_log_path.read_text().splitlines()[0]
+
+
+def test_ssh_command(tmp_path: Path) -> None:
+    assert ssh_command("ssh -i key", tmp_path) == (
+        f"ssh -i key -o ControlMaster=auto -o ControlPath={tmp_path}/%C "
+        "-o ControlPersist=120"
+    )
+
+
+def test_shared_ssh_connections(ssh_log_path: Path) -> None:
+    with shared_ssh_connections():
+        # not set up until a remote is accessed with SSH
+        use_shared_ssh_connections("https://example.com/acme/repo")
+        assert "GIT_SSH_COMMAND" not in os.environ
+        use_shared_ssh_connections(URL)
+        ssh_args = _git_ssh(ssh_log_path)
+        assert ssh_args.startswith("-o ControlMaster=auto -o ControlPath=")
+        control_dir = Path(ssh_args.split()[3].split("=")[1]).parent
+        assert control_dir.is_dir()
+        # nested uses keep the same connections
+        git_ssh_command = os.environ["GIT_SSH_COMMAND"]
+        with shared_ssh_connections():
+            use_shared_ssh_connections("git@example.com:acme/repo")
+            assert os.environ["GIT_SSH_COMMAND"] == git_ssh_command
+        assert os.environ["GIT_SSH_COMMAND"] == git_ssh_command
+        # a master connection, as started by ssh
+        (control_dir / "0123abcd").touch()
+        ssh_log_path.unlink()
+    assert "GIT_SSH_COMMAND" not in os.environ
+    assert not control_dir.exists()
+    # the master connection was asked to exit
+    assert ssh_log_path.read_text() == (
+        f"-o ControlPath={control_dir}/0123abcd -O exit host\n"
+    )
+
+
+def test_shared_ssh_connections_not_used(ssh_log_path: Path) -> None:
+    with shared_ssh_connections():
+        pass
+    use_shared_ssh_connections(URL)
+    assert "GIT_SSH_COMMAND" not in os.environ
+
+
+def test_shared_ssh_connections_user_command(
+    ssh_log_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    subprocess.run(
+        ["git", "config", "--global", "core.sshCommand", "ssh -i 'my key'"],
+        check=True,
+    )
+    with shared_ssh_connections():
+        use_shared_ssh_connections(URL)
+        ssh_args = _git_ssh(ssh_log_path)
+        assert ssh_args.startswith("-i my key -o ControlMaster=auto ")
+        control_dir = Path(ssh_args.split()[6].split("=")[1]).parent
+        (control_dir / "0123abcd").touch()
+        ssh_log_path.unlink()
+    # masters are asked to exit with the same command
+    assert ssh_log_path.read_text() == (
+        f"-i my key -o ControlPath={control_dir}/0123abcd -O exit host\n"
+    )
+    monkeypatch.setenv("GIT_SSH_COMMAND", "ssh -p 2222")
+    with shared_ssh_connections():
+        use_shared_ssh_connections(URL)
+        assert _git_ssh(ssh_log_path).startswith("-p 2222 -o ControlMaster=auto ")
+    assert os.environ["GIT_SSH_COMMAND"] == "ssh -p 2222"
+
+
+def test_shared_ssh_connections_disabled(
+    ssh_log_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    with shared_ssh_connections(enabled=False):
+        use_shared_ssh_connections(URL)
+        assert "GIT_SSH_COMMAND" not in os.environ
+    # a program that may not accept OpenSSH options
+    monkeypatch.setenv("GIT_SSH", "plink")
+    with shared_ssh_connections():
+        use_shared_ssh_connections(URL)
+        assert "GIT_SSH_COMMAND" not in os.environ
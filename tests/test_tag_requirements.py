@@ -1,28 +1,53 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import functools
+import io
+import json
+import os
 import textwrap
+import threading
 from pathlib import Path
+from typing import Any
 from unittest.mock import Mock
 
+import pytest
 from pytest import CaptureFixture
 
 from pip_preserve_requirements._cache import Cache
 from pip_preserve_requirements._pip_vcs_url import PipVcsUrl
+from pip_preserve_requirements._results import ResultsWriter
 from pip_preserve_requirements._schemas import VcsVault
 from pip_preserve_requirements._tag_name_factory import TagNameFactory
 from pip_preserve_requirements._tag_requirements import (
+    _config_digest,
     _tag_commit_if_needed,
+    check_requirements_files,
     get_vault_for_pip_vcs_url,
     tag_requirements_file,
     tag_requirements_files,
 )
+from pip_preserve_requirements._utils import file_digest
+from pip_preserve_requirements._vcs import Vcs, VcsError
 
 SHA = "a" * 40
 SHA2 = "b" * 40
 SHA3 = "c" * 40
 
 
+def _mock_vcs() -> Mock:
+    vcs = Mock()
+    # batch tag placement delegates to place_tag_on_commit
+    vcs.place_tags_on_commits.side_effect = functools.partial(
+        Vcs.place_tags_on_commits, vcs
+    )
+    # tag lookups by name delegate to get_remote_tags
+    vcs.get_remote_tag_commits.side_effect = functools.partial(
+        Vcs.get_remote_tag_commits, vcs
+    )
+    return vcs
+
+
 def test_get_vault_for_pip_vcs_url_vault_found() -> None:
     pip_vcs_url = PipVcsUrl.from_url(
         f"git+https://github.com/sbidoul/pip-preserve-requirements.git@{SHA}"
@@ -68,19 +93,30 @@ def test_tag_commit_if_needed_needed(tmp_path: Path) -> None:
     )
     cache = Cache(tmp_path)
     tag_name_factory = TagNameFactory("ppr-", match_any_tag=False)
-    vcs = Mock()
-    vcs.get_remote_tags_for_commit.return_value = ["v1.1"]
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {SHA: ["v1.1"], SHA2: ["v1.2"]}
     _tag_commit_if_needed(
         pip_vcs_url, cache, tag_name_factory, vcs_registry=lambda _name: vcs
     )
     assert cache.get_commit_tags(
         pip_vcs_url.provider, pip_vcs_url.owner, pip_vcs_url.repo, pip_vcs_url.revision
-    ) == ["v1.1", f"ppr-{SHA}"]
+    ) == [f"ppr-{SHA}"]
+    # only the expected tag is looked up
+    vcs.get_remote_tag_commits.assert_called_once_with(
+        "https://github.com/sbidoul/pip-preserve-requirements.git", [f"ppr-{SHA}"]
+    )
     vcs.place_tag_on_commit.assert_called_once_with(
         "https://github.com/sbidoul/pip-preserve-requirements.git",
         "ssh://git@github.com/sbidoul/pip-preserve-requirements.git",
         SHA,
         f"ppr-{SHA}",
+        mirror_dir=tmp_path
+        / ".pip_preserve_requirements_cache"
+        / "mirrors"
+        / "github.com"
+        / "sbidoul"
+        / "pip-preserve-requirements.git",
+        fetch_filter="",
     )
 
 
@@ -91,8 +127,8 @@ def test_tag_commit_if_needed_not_needed(tmp_path: Path) -> None:
     )
     cache = Cache(tmp_path)
     tag_name_factory = TagNameFactory("ppr-", match_any_tag=False)
-    vcs = Mock()
-    vcs.get_remote_tags_for_commit.return_value = [f"ppr-{SHA}"]
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {SHA: [f"ppr-{SHA}"]}
     _tag_commit_if_needed(
         pip_vcs_url, cache, tag_name_factory, vcs_registry=lambda _name: vcs
     )
@@ -102,6 +138,23 @@ def test_tag_commit_if_needed_not_needed(tmp_path: Path) -> None:
     vcs.place_tag_on_commit.assert_not_called()
 
 
+def test_tag_commit_if_needed_tag_elsewhere(tmp_path: Path) -> None:
+    """Test that a tag is placed if the expected tag is on another commit."""
+    pip_vcs_url = PipVcsUrl.from_url(
+        f"git+https://github.com/sbidoul/pip-preserve-requirements.git@{SHA}"
+    )
+    cache = Cache(tmp_path)
+    tag_name_factory = TagNameFactory("ppr-", match_any_tag=False)
+    vcs = _mock_vcs()
+    vcs.get_remote_tag_commits.side_effect = None
+    vcs.get_remote_tag_commits.return_value = {f"ppr-{SHA}": SHA2}
+    _tag_commit_if_needed(
+        pip_vcs_url, cache, tag_name_factory, vcs_registry=lambda _name: vcs
+    )
+    vcs.get_remote_tags.assert_not_called()
+    vcs.place_tag_on_commit.assert_called_once()
+
+
 def test_tag_commit_if_needed_cached(tmp_path: Path) -> None:
     """Test that no VCS operation is attempted if the commit tag is already cached."""
     pip_vcs_url = PipVcsUrl.from_url(
@@ -117,11 +170,11 @@ def test_tag_commit_if_needed_cached(tmp_path: Path) -> None:
         pip_vcs_url.provider, pip_vcs_url.owner, pip_vcs_url.repo, SHA, f"ppr-{SHA}"
     )
     tag_name_factory = TagNameFactory("ppr-", match_any_tag=False)
-    vcs = Mock()
+    vcs = _mock_vcs()
     _tag_commit_if_needed(
         pip_vcs_url, cache, tag_name_factory, vcs_registry=lambda _name: vcs
     )
-    vcs.get_remote_tags_for_commit.assert_not_called()
+    vcs.get_remote_tags.assert_not_called()
     vcs.place_tag_on_commit.assert_not_called()
 
 
@@ -132,8 +185,8 @@ def test_tag_commit_if_needed_any_tag(tmp_path: Path) -> None:
     )
     cache = Cache(tmp_path)
     tag_name_factory = TagNameFactory("ppr-", match_any_tag=True)
-    vcs = Mock()
-    vcs.get_remote_tags_for_commit.return_value = ["v1.1"]
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {SHA: ["v1.1"], SHA2: ["v1.2"]}
     _tag_commit_if_needed(
         pip_vcs_url, cache, tag_name_factory, vcs_registry=lambda _name: vcs
     )
@@ -161,8 +214,8 @@ def test_tag_requirements_file_basic(
         )
     )
     cache = Cache(tmp_path)
-    vcs = Mock()
-    vcs.get_remote_tags_for_commit.return_value = []
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
     tag_requirements_files(
         [requirements_file_path],
         [VcsVault(provider="gitlab.acme.com", owner="acme", default=True)],
@@ -189,15 +242,16 @@ def test_tag_requirements_file_basic(
     assert cache.get_commit_tags("gitlab.acme.com", "acme", "private-repo", SHA3) == [
         f"ppr-{SHA3}"
     ]
+    # repositories whose tags need no lookup are planned first
     assert capsys.readouterr().err == (
         "Pushing https://github.com/OCA/mis-builder to "
         "ssh://git@gitlab.acme.com/acme/mis-builder and "
         "tagging as ppr-aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa\n"
-        "Creating tag ppr-bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb on "
-        "https://gitlab.acme.com/acme/my-repo\n"
         "Pushing ssh://git@github.com/upstream/private-repo to "
         "ssh://git@gitlab.acme.com/acme/private-repo and "
         "tagging as ppr-cccccccccccccccccccccccccccccccccccccccc\n"
+        "Creating tag ppr-bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb on "
+        "https://gitlab.acme.com/acme/my-repo\n"
         "Can't preserve unsupported requirement URL: "
         "https://example.com/pkgb-1.0.tar.gz\n"
     )
@@ -214,8 +268,8 @@ def test_tag_requirements_file_private_vault(tmp_path: Path) -> None:
         )
     )
     cache = Cache(tmp_path)
-    vcs = Mock()
-    vcs.get_remote_tags_for_commit.return_value = []
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
     tag_requirements_file(
         requirements_file_path,
         [
@@ -233,3 +287,589 @@ def test_tag_requirements_file_private_vault(tmp_path: Path) -> None:
             git+ssh://git@gitlab.acme.com/acme/mis-builder@{SHA}
         """
     )
+
+
+def test_tag_requirements_file_fast_scan(tmp_path: Path) -> None:
+    """Test that only URLs are rewritten when scanning files."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_bytes(
+        (
+            "--find-links=https://example.com/wheelhouse\r\n"
+            "\r\n"
+            f"mis-builder@git+https://github.com/OCA/mis-builder@{SHA}  # pinned\r\n"
+        ).encode()
+    )
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
+    tag_requirements_files(
+        [requirements_file_path],
+        [VcsVault(provider="github.com", owner="acme", default=True)],
+        Cache(tmp_path),
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+        fast_scan=True,
+    )
+    assert (
+        requirements_file_path.read_bytes()
+        == (
+            "--find-links=https://example.com/wheelhouse\r\n"
+            "\r\n"
+            f"mis-builder@git+https://github.com/acme/mis-builder@{SHA}  # pinned\r\n"
+        ).encode()
+    )
+
+
+def test_tag_requirements_files_one_listing_per_repo(tmp_path: Path) -> None:
+    """Test that remote tags are listed once per repository across files."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/acme/repo1@{SHA}#egg=a&subdirectory=a
+            git+https://github.com/acme/repo1@{SHA2}#egg=b&subdirectory=b
+            git+https://github.com/acme/repo2@{SHA}
+            """
+        )
+    )
+    requirements_file_path2 = tmp_path / "requirements2.txt"
+    requirements_file_path2.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/acme/repo1@{SHA3}#egg=c&subdirectory=c
+            git+https://github.com/acme/repo2@{SHA}
+            """
+        )
+    )
+    cache = Cache(tmp_path)
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {
+        SHA: [f"ppr-{SHA}"],
+        SHA2: [f"ppr-{SHA2}"],
+        SHA3: [f"ppr-{SHA3}"],
+    }
+    tag_requirements_files(
+        [requirements_file_path, requirements_file_path2],
+        [VcsVault(provider="github.com", owner="acme")],
+        cache,
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+    )
+    assert sorted(call.args for call in vcs.get_remote_tag_commits.call_args_list) == [
+        (
+            "https://github.com/acme/repo1",
+            [f"ppr-{SHA}", f"ppr-{SHA2}", f"ppr-{SHA3}"],
+        ),
+        ("https://github.com/acme/repo2", [f"ppr-{SHA}"]),
+    ]
+    vcs.place_tag_on_commit.assert_not_called()
+    assert cache.get_commit_tags("github.com", "acme", "repo1", SHA3) == [f"ppr-{SHA3}"]
+
+
+def test_tag_requirements_files_concurrent(tmp_path: Path) -> None:
+    """Test that files are rewritten deterministically with concurrent jobs,
+    and that each distinct commit is pushed only once."""
+    requirements_file_paths = []
+    for i in range(5):
+        requirements_file_path = tmp_path / f"requirements{i}.txt"
+        requirements_file_path.write_text(
+            textwrap.dedent(
+                f"""\
+                git+https://github.com/OCA/repo{i}@{SHA}
+                git+https://github.com/OCA/common@{SHA2}
+                git+https://gitlab.acme.com/acme/my-repo@{SHA3}
+                """
+            )
+        )
+        requirements_file_paths.append(requirements_file_path)
+    cache = Cache(tmp_path)
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
+    tag_requirements_files(
+        requirements_file_paths,
+        [VcsVault(provider="gitlab.acme.com", owner="acme", default=True)],
+        cache,
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+        jobs=4,
+        jobs_per_host=2,
+    )
+    for i, requirements_file_path in enumerate(requirements_file_paths):
+        assert requirements_file_path.read_text() == textwrap.dedent(
+            f"""\
+            git+https://gitlab.acme.com/acme/repo{i}@{SHA}
+            git+https://gitlab.acme.com/acme/common@{SHA2}
+            git+https://gitlab.acme.com/acme/my-repo@{SHA3}
+            """
+        )
+    # 5 distinct repos + 1 common repo pushed, 1 tag created in vault
+    assert vcs.place_tag_on_commit.call_count == 7
+    vcs.get_remote_tag_commits.assert_called_once_with(
+        "https://gitlab.acme.com/acme/my-repo", [f"ppr-{SHA3}"]
+    )
+
+
+def test_tag_requirements_files_error(tmp_path: Path) -> None:
+    """Test that files with failed requirements are not rewritten,
+    while the others are."""
+    ok_path = tmp_path / "ok.txt"
+    ok_path.write_text(f"git+https://github.com/OCA/ok@{SHA}\n")
+    ko_path = tmp_path / "ko.txt"
+    ko_path.write_text(f"git+https://github.com/OCA/ko@{SHA}\n")
+    cache = Cache(tmp_path)
+    vcs = _mock_vcs()
+
+    def place_tag_on_commit(source_repo: str, *_args: Any, **_kwargs: Any) -> None:
+        if source_repo.endswith("/ko"):
+            raise RuntimeError("push failed")
+
+    vcs.place_tag_on_commit.side_effect = place_tag_on_commit
+    with pytest.raises(RuntimeError):
+        tag_requirements_files(
+            [ko_path, ok_path],
+            [VcsVault(provider="gitlab.acme.com", owner="acme", default=True)],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=False),
+            vcs_registry=lambda _name: vcs,
+            jobs=2,
+        )
+    assert ko_path.read_text() == f"git+https://github.com/OCA/ko@{SHA}\n"
+    assert ok_path.read_text() == f"git+https://gitlab.acme.com/acme/ok@{SHA}\n"
+
+
+def test_tag_requirements_files_lookup_error(tmp_path: Path) -> None:
+    """Test that a failed tag lookup fails the requirements of that repository
+    only, and that the other files are rewritten."""
+    ok_path = tmp_path / "ok.txt"
+    ok_path.write_text(f"git+https://github.com/OCA/ok@{SHA}\n")
+    ko_path = tmp_path / "ko.txt"
+    ko_path.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/acme/ko@{SHA}#egg=a&subdirectory=a
+            git+https://github.com/acme/ko@{SHA2}#egg=b&subdirectory=b
+            """
+        )
+    )
+    ko_path2 = tmp_path / "ko2.txt"
+    ko_path2.write_text(f"git+https://github.com/acme/ko@{SHA}\n")
+    cache = Cache(tmp_path)
+    vcs = _mock_vcs()
+
+    def get_remote_tag_commits(url: str, _tags: list[str]) -> dict[str, str]:
+        raise VcsError(f"Could not list {url}")
+
+    vcs.get_remote_tag_commits.side_effect = get_remote_tag_commits
+    stream = io.StringIO()
+    with pytest.raises(VcsError):
+        tag_requirements_files(
+            [ko_path, ok_path, ko_path2],
+            [
+                VcsVault(provider="github.com", owner="acme"),
+                VcsVault(provider="gitlab.acme.com", owner="acme", default=True),
+            ],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=False),
+            vcs_registry=lambda _name: vcs,
+            jobs=2,
+            results_writer=ResultsWriter(stream),
+        )
+    # the repository is looked up once, and no tag is placed on it
+    vcs.get_remote_tag_commits.assert_called_once()
+    vcs.place_tag_on_commit.assert_called_once()
+    assert "github.com/acme/ko" in ko_path.read_text()
+    assert "github.com/acme/ko" in ko_path2.read_text()
+    assert ok_path.read_text() == f"git+https://gitlab.acme.com/acme/ok@{SHA}\n"
+    records = sorted(
+        (
+            (record["file"], record["line"], record["action"], record["error"])
+            for record in map(json.loads, stream.getvalue().splitlines())
+        ),
+    )
+    error = "Could not list https://github.com/acme/ko"
+    assert records == [
+        (str(ko_path), 1, "failed", error),
+        (str(ko_path), 2, "failed", error),
+        (str(ko_path2), 1, "failed", error),
+        (str(ok_path), 1, "pushed", None),
+    ]
+
+
+def test_tag_requirements_files_one_push_per_vault_repo(tmp_path: Path) -> None:
+    """Test that tags for the same vault repository are pushed in one batch,
+    and that a rejected tag does not prevent the others from being recorded."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/OCA/repo@{SHA}#egg=a&subdirectory=a
+            git+https://github.com/OCA/repo@{SHA2}#egg=b&subdirectory=b
+            """
+        )
+    )
+    requirements_file_path2 = tmp_path / "requirements2.txt"
+    requirements_file_path2.write_text(
+        f"git+https://github.com/OCA/repo@{SHA3}#egg=c&subdirectory=c\n"
+    )
+    cache = Cache(tmp_path)
+    vcs = Mock()
+    vcs.place_tags_on_commits.return_value = {
+        f"ppr-{SHA}": None,
+        f"ppr-{SHA2}": None,
+        f"ppr-{SHA3}": VcsError("rejected"),
+    }
+    with pytest.raises(VcsError):
+        tag_requirements_files(
+            [requirements_file_path, requirements_file_path2],
+            [VcsVault(provider="gitlab.acme.com", owner="acme", default=True)],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=False),
+            vcs_registry=lambda _name: vcs,
+        )
+    vcs.place_tag_on_commit.assert_not_called()
+    vcs.place_tags_on_commits.assert_called_once()
+    target_repo, tag_requests = vcs.place_tags_on_commits.call_args.args
+    assert target_repo == "ssh://git@gitlab.acme.com/acme/repo"
+    assert [tag_request.sha for tag_request in tag_requests] == [SHA, SHA2, SHA3]
+    assert cache.get_commit_tags("gitlab.acme.com", "acme", "repo", SHA2) == [
+        f"ppr-{SHA2}"
+    ]
+    assert cache.get_commit_tags("gitlab.acme.com", "acme", "repo", SHA3) == []
+    assert "gitlab.acme.com/acme/repo" in requirements_file_path.read_text()
+    assert "github.com/OCA/repo" in requirements_file_path2.read_text()
+
+
+def test_tag_requirements_files_negative_cache(tmp_path: Path) -> None:
+    """Test that a recent lookup of a missing tag is reused from the cache."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA}\n")
+    vaults = [VcsVault(provider="github.com", owner="acme")]
+    tag_name_factory = TagNameFactory("ppr-", match_any_tag=False)
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {SHA: ["v1"]}
+    vcs.place_tags_on_commits.side_effect = None
+    vcs.place_tags_on_commits.return_value = {f"ppr-{SHA}": VcsError("failed")}
+    with pytest.raises(VcsError):
+        tag_requirements_files(
+            [requirements_file_path],
+            vaults,
+            Cache(tmp_path, negative_ttl=60),
+            tag_name_factory,
+            vcs_registry=lambda _name: vcs,
+        )
+    vcs.get_remote_tag_commits.assert_called_once()
+    # the next run does not look up the tag again, but retries the tag creation
+    vcs.place_tags_on_commits.return_value = {f"ppr-{SHA}": None}
+    cache = Cache(tmp_path, negative_ttl=60)
+    tag_requirements_files(
+        [requirements_file_path],
+        vaults,
+        cache,
+        tag_name_factory,
+        vcs_registry=lambda _name: vcs,
+    )
+    vcs.get_remote_tag_commits.assert_called_once()
+    assert vcs.place_tags_on_commits.call_count == 2
+    assert cache.get_commit_tags("github.com", "acme", "repo", SHA) == [f"ppr-{SHA}"]
+    # with refresh, the tag is looked up again
+    tag_requirements_files(
+        [requirements_file_path],
+        vaults,
+        Cache(tmp_path, negative_ttl=60, refresh=True),
+        tag_name_factory,
+        vcs_registry=lambda _name: vcs,
+    )
+    assert vcs.get_remote_tag_commits.call_count == 2
+
+
+def test_tag_requirements_files_results(tmp_path: Path) -> None:
+    """Test that the outcome of each requirement is written as JSON lines."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/acme/cached@{SHA}
+            git+https://github.com/acme/verified@{SHA}
+            git+https://github.com/acme/tagged@{SHA}
+            git+https://github.com/OCA/pushed@{SHA}
+            git+https://github.com/acme/failed@{SHA}
+            https://example.com/pkgb-1.0.tar.gz
+            """
+        )
+    )
+    cache = Cache(tmp_path)
+    cache.add_commit_tag("github.com", "acme", "cached", SHA, f"ppr-{SHA}")
+    vcs = _mock_vcs()
+
+    def get_remote_tags(url: str, _tag_prefix: str = "") -> dict[str, list[str]]:
+        return {SHA: [f"ppr-{SHA}"]} if url.endswith("/verified") else {}
+
+    def place_tag_on_commit(source_repo: str, *_args: Any, **_kwargs: Any) -> None:
+        if source_repo.endswith("/failed"):
+            raise VcsError("push failed")
+
+    vcs.get_remote_tags.side_effect = get_remote_tags
+    vcs.place_tag_on_commit.side_effect = place_tag_on_commit
+    stream = io.StringIO()
+    with pytest.raises(VcsError):
+        tag_requirements_files(
+            [requirements_file_path],
+            [
+                VcsVault(provider="github.com", owner="acme"),
+                VcsVault(provider="gitlab.acme.com", owner="acme", default=True),
+            ],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=False),
+            vcs_registry=lambda _name: vcs,
+            results_writer=ResultsWriter(stream),
+        )
+    records = sorted(
+        (json.loads(line) for line in stream.getvalue().splitlines()),
+        key=lambda record: record["line"],
+    )
+    assert all(record["elapsed"] >= 0 for record in records)
+    assert all(record["file"] == str(requirements_file_path) for record in records)
+    assert [
+        (record["line"], record["action"], record["cached"], record["error"])
+        for record in records
+    ] == [
+        (1, "cached", True, None),
+        (2, "verified", False, None),
+        (3, "tagged", False, None),
+        (4, "pushed", False, None),
+        (5, "failed", False, "push failed"),
+        (6, "skipped", False, "unsupported requirement URL"),
+    ]
+    assert records[0]["url"] == records[0]["vaulted_url"]
+    assert records[3]["url"] == f"git+https://github.com/OCA/pushed@{SHA}"
+    assert records[3]["vaulted_url"] == f"git+https://gitlab.acme.com/acme/pushed@{SHA}"
+    assert records[4]["vaulted_url"] is None
+
+
+def test_tag_requirements_files_results_streamed(tmp_path: Path) -> None:
+    """Test that the results of a repository are written as soon as its tags
+    are looked up, while the lookups of other repositories go on."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(
+        textwrap.dedent(
+            f"""\
+            git+https://github.com/acme/slow@{SHA}
+            git+https://github.com/acme/fast@{SHA}
+            """
+        )
+    )
+    vcs = _mock_vcs()
+    fast_written = threading.Event()
+
+    class Stream(io.StringIO):
+        def write(self, s: str) -> int:
+            if '"verified"' in s:
+                fast_written.set()
+            return super().write(s)
+
+    def get_remote_tag_commits(url: str, tags: list[str]) -> dict[str, str]:
+        if url.endswith("/slow"):
+            assert fast_written.wait(timeout=60)
+        return {tags[0]: SHA}
+
+    vcs.get_remote_tag_commits.side_effect = get_remote_tag_commits
+    stream = Stream()
+    tag_requirements_files(
+        [requirements_file_path],
+        [VcsVault(provider="github.com", owner="acme")],
+        Cache(tmp_path),
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+        jobs=2,
+        jobs_per_host=2,
+        results_writer=ResultsWriter(stream),
+    )
+    assert [
+        (record["line"], record["action"])
+        for record in map(json.loads, stream.getvalue().splitlines())
+    ] == [(2, "verified"), (1, "verified")]
+
+
+def test_check_requirements_files(tmp_path: Path, capsys: CaptureFixture[str]) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_content = textwrap.dedent(
+        f"""\
+        git+https://github.com/acme/cached@{SHA}
+        git+https://github.com/acme/probed@{SHA}
+        git+https://github.com/acme/not-probed@{SHA}
+        git+https://github.com/OCA/mis-builder@{SHA}
+        https://example.com/pkgb-1.0.tar.gz
+        """
+    )
+    requirements_file_path.write_text(requirements_content)
+    cache = Cache(tmp_path)
+    cache.add_commit_tag("github.com", "acme", "cached", SHA, f"ppr-{SHA}")
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {SHA: ["v1"]}
+    stream = io.StringIO()
+    missing = check_requirements_files(
+        [requirements_file_path],
+        [VcsVault(provider="github.com", owner="acme")],
+        cache,
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+        max_probes=1,
+        results_writer=ResultsWriter(stream),
+    )
+    assert missing == 3
+    assert [
+        (record["line"], record["action"], record["error"])
+        for record in map(json.loads, stream.getvalue().splitlines())
+    ] == [
+        (1, "cached", None),
+        (2, "missing", "is not tagged"),
+        (3, "missing", "has no tag in cache"),
+        (4, "missing", "is not in a vault"),
+        (5, "skipped", "unsupported requirement URL"),
+    ]
+    vcs.get_remote_tag_commits.assert_called_once_with(
+        "https://github.com/acme/probed", [f"ppr-{SHA}"]
+    )
+    vcs.place_tag_on_commit.assert_not_called()
+    vcs.place_tags_on_commits.assert_not_called()
+    assert requirements_file_path.read_text() == requirements_content
+    assert capsys.readouterr().err == (
+        f"{requirements_file_path}: "
+        f"git+https://github.com/acme/probed@{SHA} is not tagged\n"
+        f"{requirements_file_path}: "
+        f"git+https://github.com/acme/not-probed@{SHA} has no tag in cache\n"
+        f"{requirements_file_path}: "
+        f"git+https://github.com/OCA/mis-builder@{SHA} is not in a vault\n"
+        "Can't preserve unsupported requirement URL: "
+        "https://example.com/pkgb-1.0.tar.gz\n"
+    )
+
+
+def test_check_requirements_files_ok(tmp_path: Path) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA}\n")
+    cache = Cache(tmp_path, negative_ttl=60)
+    # a recent listing in cache is used without probing
+    cache.update_remote_tags("github.com", "acme", "repo", {SHA: ["v1", "v2"]})
+    vcs = _mock_vcs()
+    assert (
+        check_requirements_files(
+            [requirements_file_path],
+            [VcsVault(provider="github.com", owner="acme")],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=True),
+            vcs_registry=lambda _name: vcs,
+        )
+        == 0
+    )
+    vcs.get_remote_tags.assert_not_called()
+
+
+def test_tag_requirements_file_unchanged(tmp_path: Path) -> None:
+    """Test that a requirements file is not rewritten when its content
+    does not change."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA}\n")
+    os.utime(requirements_file_path, (0, 0))
+    cache = Cache(tmp_path)
+    cache.add_commit_tag("github.com", "acme", "repo", SHA, f"ppr-{SHA}")
+    tag_requirements_file(
+        requirements_file_path,
+        [VcsVault(provider="github.com", owner="acme")],
+        cache,
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: _mock_vcs(),
+    )
+    assert requirements_file_path.stat().st_mtime == 0
+
+
+def test_tag_requirements_files_incremental(tmp_path: Path) -> None:
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA}\n")
+    vaults = [VcsVault(provider="github.com", owner="acme")]
+    cache = Cache(tmp_path)
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
+
+    def _tag(
+        tag_prefix: str = "ppr-", all_files: bool = False, fast_scan: bool = False
+    ) -> None:
+        tag_requirements_files(
+            [requirements_file_path],
+            vaults,
+            cache,
+            TagNameFactory(tag_prefix, match_any_tag=False),
+            vcs_registry=lambda _name: vcs,
+            incremental=not all_files,
+            fast_scan=fast_scan,
+        )
+
+    _tag()
+    assert vcs.place_tag_on_commit.call_count == 1
+    # unchanged file is skipped
+    cache.remove_commit_tags("github.com", "acme", "repo", SHA)
+    _tag()
+    assert vcs.place_tag_on_commit.call_count == 1
+    # unless all files are requested
+    _tag(all_files=True)
+    assert vcs.place_tag_on_commit.call_count == 2
+    # or the configuration changes
+    _tag(tag_prefix="other-")
+    assert vcs.place_tag_on_commit.call_count == 3
+    # or the file changes
+    requirements_file_path.write_text(f"git+https://github.com/acme/repo@{SHA2}\n")
+    _tag(tag_prefix="other-")
+    assert vcs.place_tag_on_commit.call_count == 4
+    # or the file is scanned instead of parsed, which rewrites it differently
+    cache.remove_commit_tags("github.com", "acme", "repo", SHA2)
+    _tag(tag_prefix="other-", fast_scan=True)
+    assert vcs.place_tag_on_commit.call_count == 5
+    _tag(tag_prefix="other-", fast_scan=True)
+    assert vcs.place_tag_on_commit.call_count == 5
+
+
+def test_tag_requirements_files_incremental_not_preserved(tmp_path: Path) -> None:
+    """Test that files with requirements that could not be preserved
+    are processed again."""
+    requirements_file_path = tmp_path / "requirements.txt"
+    requirements_file_path.write_text(f"git+https://github.com/OCA/repo@{SHA}\n")
+    cache = Cache(tmp_path)
+    for _ in range(2):
+        tag_requirements_files(
+            [requirements_file_path],
+            [VcsVault(provider="github.com", owner="acme")],
+            cache,
+            TagNameFactory("ppr-", match_any_tag=False),
+            vcs_registry=lambda _name: _mock_vcs(),
+            incremental=True,
+        )
+    assert not cache.is_file_processed(
+        requirements_file_path,
+        file_digest(requirements_file_path),
+        _config_digest(
+            [VcsVault(provider="github.com", owner="acme")],
+            TagNameFactory("ppr-", match_any_tag=False),
+            fast_scan=False,
+        ),
+    )
+
+
+def test_tag_requirements_files_parse_jobs(tmp_path: Path) -> None:
+    requirements_file_paths = []
+    for i, sha in enumerate([SHA, SHA2, SHA3]):
+        requirements_file_path = tmp_path / f"requirements{i}.txt"
+        requirements_file_path.write_text(f"git+https://github.com/OCA/repo@{sha}\n")
+        requirements_file_paths.append(requirements_file_path)
+    vcs = _mock_vcs()
+    vcs.get_remote_tags.return_value = {}
+    tag_requirements_files(
+        requirements_file_paths,
+        [VcsVault(provider="github.com", owner="acme", default=True)],
+        Cache(tmp_path),
+        TagNameFactory("ppr-", match_any_tag=False),
+        vcs_registry=lambda _name: vcs,
+        parse_jobs=2,
+    )
+    for requirements_file_path, sha in zip(requirements_file_paths, [SHA, SHA2, SHA3]):
+        assert requirements_file_path.read_text() == (
+            f"git+https://github.com/acme/repo@{sha}\n"
+        )
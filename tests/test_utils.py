@@ -1,6 +1,11 @@
 # SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import os
+import stat
+from pathlib import Path
+
+import pytest
 from pytest import CaptureFixture
 
 from pip_preserve_requirements._utils import (
@@ -11,6 +16,7 @@ from pip_preserve_requirements._utils import (
     log_info,
     log_notice,
     log_warning,
+    write_text_if_changed,
 )
 
 
@@ -45,3 +51,41 @@ def test_log_warning(capsys: CaptureFixture[str]) -> None:
 def test_log_error(capsys: CaptureFixture[str]) -> None:
     log_error("error")
     assert capsys.readouterr().err == "error\n"
+
+
+def test_write_text_if_changed(tmp_path: Path) -> None:
+    path = tmp_path / "requirements.txt"
+    assert write_text_if_changed(path, "a\n")
+    assert path.read_text() == "a\n"
+    path.chmod(0o640)
+    os.utime(path, (0, 0))
+    assert not write_text_if_changed(path, "a\n")
+    assert path.stat().st_mtime == 0
+    assert write_text_if_changed(path, "b\n")
+    assert path.read_text() == "b\n"
+    assert path.stat().st_mtime != 0
+    if os.name == "posix":
+        assert stat.S_IMODE(path.stat().st_mode) == 0o640
+    # no temporary file is left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["requirements.txt"]
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="no symlinks")
+def test_write_text_if_changed_newline(tmp_path: Path) -> None:
+    path = tmp_path / "requirements.txt"
+    assert write_text_if_changed(path, "a\r\nb\n", newline="")
+    assert path.read_bytes() == b"a\r\nb\n"
+    assert not write_text_if_changed(path, "a\r\nb\n", newline="")
+
+
+def test_write_text_if_changed_symlink(tmp_path: Path) -> None:
+    target = tmp_path / "target.txt"
+    target.write_text("a\n")
+    link = tmp_path / "link.txt"
+    try:
+        link.symlink_to(target)
+    except OSError:
+        pytest.skip("symlinks not supported")
+    assert write_text_if_changed(link, "b\n")
+    assert link.is_symlink()
+    assert target.read_text() == "b\n"
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from pip_preserve_requirements._profile import (
+    Profiler,
+    span,
+)
+from pip_preserve_requirements._vcs_async import run_sync
+
+_var: contextvars.ContextVar[str] = contextvars.ContextVar("var", default="")
+
+
+def test_run_sync() -> None:
+    async def get_var() -> tuple[str, bool]:
+        await asyncio.sleep(0)
+        return _var.get(), threading.current_thread() is threading.main_thread()
+
+    # the coroutine runs in the event loop thread, with the context of the caller
+    _var.set("caller")
+    try:
+        assert run_sync(get_var()) == ("caller", False)
+    finally:
+        _var.set("")
+
+    async def fail() -> None:
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        run_sync(fail())
+
+
+def test_run_sync_concurrent() -> None:
+    barrier = asyncio.Event()
+
+    async def wait() -> str:
+        await barrier.wait()
+        return "waited"
+
+    async def release() -> str:
+        barrier.set()
+        return "released"
+
+    # the first coroutine waits for the second one, started by another thread
+    thread_result = []
+    thread = threading.Thread(target=lambda: thread_result.append(run_sync(wait())))
+    thread.start()
+    assert run_sync(release()) == "released"
+    thread.join()
+    assert thread_result == ["waited"]
+
+
+def test_run_sync_spans(profiler: Profiler) -> None:
+    async def operation() -> None:
+        with span("inner"):
+            await asyncio.sleep(0)
+
+    async def operations() -> None:
+        await asyncio.gather(operation(), operation())
+
+    with span("outer"):
+        run_sync(operations())
+    inner1, inner2, outer = profiler.spans
+    assert inner1.parent_id == inner2.parent_id == outer.span_id
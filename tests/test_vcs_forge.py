@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2023-present Stéphane Bidoul <stephane.bidoul@gmail.com>
+# SPDX-License-Identifier: MIT
+
+import json
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+
+from pip_preserve_requirements._vcs import TagRequest
+from pip_preserve_requirements._vcs_forge import ForgeVcs, GitHubApi
+from pip_preserve_requirements._vcs_git import GitVcs
+
+SHA = "a" * 40
+SHA2 = "b" * 40
+TAG_OBJECT_SHA = "f" * 40
+
+
+class FakeGitHub:
+    """A stand-in for the GitHub API of a repository, acme/repo."""
+
+    def __init__(self) -> None:
+        # tag -> target, a commit sha or an annotated tag object
+        self.tags: dict[str, Any] = {}
+        self.commits = {SHA, SHA2}
+        self.requests: list[tuple[str, str, Any]] = []
+        self.connections: set[int] = set()
+
+    def graphql(self, payload: Any) -> tuple[int, Any]:
+        variables = payload["variables"]
+        if (variables["owner"], variables["name"]) != ("acme", "repo"):
+            return 200, {"data": {"repository": None}, "errors": [{"type": "x"}]}
+        refs = {}
+        for alias, ref in variables.items():
+            if not alias.startswith("t"):
+                continue
+            target = self.tags.get(ref[len("refs/tags/") :])
+            refs[alias] = None if target is None else {"target": target}
+        return 200, {"data": {"repository": refs}}
+
+    def create_ref(self, payload: Any) -> tuple[int, Any]:
+        tag = payload["ref"][len("refs/tags/") :]
+        if payload["sha"] not in self.commits:
+            return 422, {"message": "Object does not exist"}
+        if tag in self.tags:
+            return 422, {"message": "Reference already exists"}
+        self.tags[tag] = {"oid": payload["sha"]}
+        return 201, {"ref": payload["ref"]}
+
+    def handle(self, method: str, path: str, payload: Any) -> tuple[int, Any]:
+        self.requests.append((method, path, payload))
+        if (method, path) == ("POST", "/graphql"):
+            return self.graphql(payload)
+        if (method, path) == ("POST", "/repos/acme/repo/git/refs"):
+            return self.create_ref(payload)
+        return 404, {"message": "Not Found"}
+
+
+@pytest.fixture
+def fake_github() -> Iterator[tuple[FakeGitHub, str]]:
+    fake = FakeGitHub()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:
+            fake.connections.add(self.client_address[1])
+            assert self.headers["Authorization"] == "Bearer secret"
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            status, response = fake.handle("POST", self.path, json.loads(body))
+            data = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield fake, f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_get_remote_tag_commits(fake_github: tuple[FakeGitHub, str]) -> None:
+    fake, api_url = fake_github
+    fake.tags["ppr-1"] = {"oid": SHA}
+    fake.tags["ppr-annotated"] = {"oid": TAG_OBJECT_SHA, "target": {"oid": SHA2}}
+    vcs = ForgeVcs({"github.com": GitHubApi(api_url, "secret")})
+    tags = ["ppr-1", "ppr-annotated", "ppr-missing"]
+    assert vcs.get_remote_tag_commits("https://github.com/acme/repo", tags) == {
+        "ppr-1": SHA,
+        "ppr-annotated": SHA2,
+    }
+    # all refs are queried at once
+    assert len(fake.requests) == 1
+    assert vcs.get_remote_tag_commits("ssh://git@github.com/acme/repo.git", tags)
+    # connections are kept alive
+    assert len(fake.requests) == 2
+    assert len(fake.connections) == 1
+
+
+def test_get_remote_tag_commits_batches(fake_github: tuple[FakeGitHub, str]) -> None:
+    fake, api_url = fake_github
+    fake.tags["ppr-150"] = {"oid": SHA}
+    api = GitHubApi(api_url, "secret")
+    tags = [f"ppr-{i}" for i in range(250)]
+    assert api.get_tag_commits("acme", "repo", tags) == {"ppr-150": SHA}
+    assert len(fake.requests) == 3
+
+
+def test_get_remote_tag_commits_fallback(
+    fake_github: tuple[FakeGitHub, str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that git is used for other hosts, or when the API fails."""
+    fake, api_url = fake_github
+    git_get_remote_tag_commits = Mock(return_value={})
+    monkeypatch.setattr(GitVcs, "get_remote_tag_commits", git_get_remote_tag_commits)
+    vcs = ForgeVcs({"github.com": GitHubApi(api_url, "secret")})
+    vcs.get_remote_tag_commits("https://gitlab.com/acme/repo", ["ppr-1"])
+    assert not fake.requests
+    vcs.get_remote_tag_commits("https://github.com/acme/unknown", ["ppr-1"])
+    assert len(fake.requests) == 1
+    assert [call.args for call in git_get_remote_tag_commits.call_args_list] == [
+        ("https://gitlab.com/acme/repo", ["ppr-1"]),
+        ("https://github.com/acme/unknown", ["ppr-1"]),
+    ]
+
+
+def test_place_tags_on_commits(
+    fake_github: tuple[FakeGitHub, str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    """Test that tags are created with the API, and pushed with git
+    when the commit is not in the target repository."""
+    fake, api_url = fake_github
+    fake.tags["ppr-existing"] = {"oid": SHA}
+    git_place_tags_on_commits = Mock(return_value={"ppr-3": None})
+    monkeypatch.setattr(GitVcs, "place_tags_on_commits", git_place_tags_on_commits)
+    vcs = ForgeVcs({"github.com": GitHubApi(api_url, "secret")})
+    missing_commit_request = TagRequest("https://x.org/a/b", "c" * 40, "ppr-3")
+    results = vcs.place_tags_on_commits(
+        "ssh://git@github.com/acme/repo",
+        [
+            TagRequest("https://github.com/acme/repo", SHA, "ppr-1", tmp_path),
+            TagRequest("https://github.com/acme/repo", SHA, "ppr-existing"),
+            missing_commit_request,
+        ],
+    )
+    assert results == {"ppr-1": None, "ppr-existing": None, "ppr-3": None}
+    assert fake.tags["ppr-1"] == {"oid": SHA}
+    git_place_tags_on_commits.assert_called_once_with(
+        "ssh://git@github.com/acme/repo", [missing_commit_request]
+    )
+
+
+def test_github_api_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+    assert GitHubApi.from_env() == {}
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    monkeypatch.setenv("GITHUB_SERVER_URL", "https://github.acme.com")
+    assert list(GitHubApi.from_env()) == ["github.acme.com"]
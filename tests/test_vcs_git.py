@@ -1,15 +1,19 @@
 # SPDX-FileCopyrightText: 2025-present Stéphane Bidoul <stephane.bidoul@gmail.com>
 # SPDX-License-Identifier: MIT
 
+import asyncio
 import subprocess
+import time
 from pathlib import Path
 
 import pytest
 
-from pip_preserve_requirements._vcs import Vcs
-from pip_preserve_requirements._vcs_git import GitVcs
+from pip_preserve_requirements._vcs import TagRequest, Vcs, VcsError, VcsTimeoutError
+from pip_preserve_requirements._vcs_git import AsyncGitVcs, GitVcs
 from pip_preserve_requirements._vcs_registry import vcs_registry
 
+from .conftest import git
+
 
 @pytest.fixture(scope="module")
 def git_vcs() -> Vcs:
@@ -38,3 +42,276 @@ def test_place_tag_on_commit(git_vcs: GitVcs, tmp_path: Path) -> None:
         sha="7b5bf15c487293a7cdbd19e3715993ed38457c4d",
         tag="test-tag",
     )
+
+
+@pytest.fixture
+def git_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    for var in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{var}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{var}_EMAIL", "test@example.com")
+
+
+def test_get_remote_tags(git_vcs: GitVcs, tmp_path: Path, git_env: None) -> None:
+    git(tmp_path, "init")
+    git(tmp_path, "commit", "--allow-empty", "-m", "1")
+    sha1 = git(tmp_path, "rev-parse", "HEAD")
+    git(tmp_path, "tag", "lightweight")
+    git(tmp_path, "tag", "-a", "annotated", "-m", "annotated")
+    git(tmp_path, "commit", "--allow-empty", "-m", "2")
+    sha2 = git(tmp_path, "rev-parse", "HEAD")
+    git(tmp_path, "tag", "other")
+    tags = git_vcs.get_remote_tags(str(tmp_path))
+    assert sorted(tags[sha1]) == ["annotated", "lightweight"]
+    assert tags[sha2] == ["other"]
+
+
+def test_get_remote_tags_prefix(git_vcs: GitVcs, tmp_path: Path, git_env: None) -> None:
+    git(tmp_path, "init")
+    git(tmp_path, "commit", "--allow-empty", "-m", "1")
+    sha = git(tmp_path, "rev-parse", "HEAD")
+    for tag in ["ppr-1", "ppr-2", "v1", "other/ppr-4"]:
+        git(tmp_path, "tag", tag)
+    git(tmp_path, "tag", "-a", "ppr-annotated", "-m", "annotated")
+    tags = git_vcs.get_remote_tags(str(tmp_path), "ppr-")
+    assert sorted(tags[sha]) == ["ppr-1", "ppr-2", "ppr-annotated"]
+    assert {tag for sha_tags in tags.values() for tag in sha_tags} == {
+        "ppr-1",
+        "ppr-2",
+        "ppr-annotated",
+    }
+
+
+def test_get_remote_tag_commits(git_vcs: GitVcs, tmp_path: Path, git_env: None) -> None:
+    git(tmp_path, "init")
+    git(tmp_path, "commit", "--allow-empty", "-m", "1")
+    sha = git(tmp_path, "rev-parse", "HEAD")
+    for tag in ["ppr-1", "ppr-10", "other/ppr-1"]:
+        git(tmp_path, "tag", tag)
+    git(tmp_path, "tag", "-a", "ppr-annotated", "-m", "annotated")
+    assert git_vcs.get_remote_tag_commits(
+        str(tmp_path), ["ppr-1", "ppr-annotated", "ppr-missing"]
+    ) == {"ppr-1": sha, "ppr-annotated": sha}
+    # many tags are looked up in a listing
+    tags = [f"ppr-{i}" for i in range(200)]
+    assert git_vcs.get_remote_tag_commits(str(tmp_path), tags) == {
+        "ppr-1": sha,
+        "ppr-10": sha,
+    }
+
+
+def test_place_tag_on_commit_with_mirror(
+    git_vcs: GitVcs, tmp_path: Path, git_env: None
+) -> None:
+    source_dir = tmp_path / "source"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "source.git"
+    git(tmp_path, "init", str(source_dir))
+    git(tmp_path, "init", "--bare", str(target_dir))
+    git(source_dir, "commit", "--allow-empty", "-m", "1")
+    sha1 = git(source_dir, "rev-parse", "HEAD")
+    git_vcs.place_tag_on_commit(
+        str(source_dir), str(target_dir), sha1, f"ppr-{sha1}", mirror_dir=mirror_dir
+    )
+    git(source_dir, "commit", "--allow-empty", "-m", "2")
+    sha2 = git(source_dir, "rev-parse", "HEAD")
+    git_vcs.place_tag_on_commit(
+        str(source_dir), str(target_dir), sha2, f"ppr-{sha2}", mirror_dir=mirror_dir
+    )
+    # the mirror is reused, and the operation is idempotent
+    git_vcs.place_tag_on_commit(
+        str(source_dir), str(target_dir), sha2, f"ppr-{sha2}", mirror_dir=mirror_dir
+    )
+    assert git_vcs.get_remote_tags(str(target_dir)) == {
+        sha1: [f"ppr-{sha1}"],
+        sha2: [f"ppr-{sha2}"],
+    }
+    assert git_vcs.get_remote_tags(str(mirror_dir)) == {
+        sha1: [f"ppr-{sha1}"],
+        sha2: [f"ppr-{sha2}"],
+    }
+
+
+def test_place_tags_on_commits(git_vcs: GitVcs, tmp_path: Path, git_env: None) -> None:
+    source_dir = tmp_path / "source"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "source.git"
+    git(tmp_path, "init", str(source_dir))
+    git(tmp_path, "init", "--bare", str(target_dir))
+    shas = []
+    for i in range(3):
+        git(source_dir, "commit", "--allow-empty", "-m", str(i))
+        shas.append(git(source_dir, "rev-parse", "HEAD"))
+    # an existing tag pointing to another commit makes the push of that tag fail
+    git(source_dir, "push", str(target_dir), f"{shas[0]}:refs/tags/tag2")
+    results = git_vcs.place_tags_on_commits(
+        str(target_dir),
+        [
+            TagRequest(str(source_dir), shas[1], "tag1", mirror_dir),
+            TagRequest(str(source_dir), shas[2], "tag2", mirror_dir),
+            TagRequest(str(source_dir), "d" * 40, "tag3", mirror_dir),
+        ],
+    )
+    assert results["tag1"] is None
+    assert isinstance(results["tag2"], VcsError)
+    assert isinstance(results["tag3"], VcsError)
+    assert git_vcs.get_remote_tags(str(target_dir)) == {
+        shas[0]: ["tag2"],
+        shas[1]: ["tag1"],
+    }
+
+
+def test_place_tags_on_commits_in_target(
+    git_vcs: GitVcs, tmp_path: Path, git_env: None
+) -> None:
+    """Test that commits of a target repository that is a fork are tagged
+    without being fetched from their source, while the other commits are."""
+    upstream_dir = tmp_path / "upstream"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "upstream.git"
+    git(tmp_path, "init", str(upstream_dir))
+    git(upstream_dir, "commit", "--allow-empty", "-m", "1")
+    buried_sha = git(upstream_dir, "rev-parse", "HEAD")
+    git(upstream_dir, "commit", "--allow-empty", "-m", "2")
+    tip_sha = git(upstream_dir, "rev-parse", "HEAD")
+    git(tmp_path, "clone", "--bare", str(upstream_dir), str(target_dir))
+    git(upstream_dir, "commit", "--allow-empty", "-m", "3")
+    new_sha = git(upstream_dir, "rev-parse", "HEAD")
+    source = str(upstream_dir)
+    results = git_vcs.place_tags_on_commits(
+        str(target_dir),
+        [
+            TagRequest(source, buried_sha, "tag1", mirror_dir, target_is_fork=True),
+            TagRequest(source, tip_sha, "tag2", mirror_dir, target_is_fork=True),
+            TagRequest(source, new_sha, "tag3", mirror_dir, target_is_fork=True),
+        ],
+    )
+    assert results == {"tag1": None, "tag2": None, "tag3": None}
+    assert git_vcs.get_remote_tag_commits(
+        str(target_dir), ["tag1", "tag2", "tag3"]
+    ) == {"tag1": buried_sha, "tag2": tip_sha, "tag3": new_sha}
+    # only the commit that is not in the target was tagged from the mirror
+    assert git(mirror_dir, "tag") == "tag3"
+
+
+def test_place_tags_on_commits_not_fork(
+    git_vcs: GitVcs, tmp_path: Path, git_env: None
+) -> None:
+    """Test that targets that are not forks are not probed for commits."""
+    upstream_dir = tmp_path / "upstream"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "upstream.git"
+    git(tmp_path, "init", str(upstream_dir))
+    git(upstream_dir, "commit", "--allow-empty", "-m", "1")
+    sha = git(upstream_dir, "rev-parse", "HEAD")
+    git(tmp_path, "clone", "--bare", str(upstream_dir), str(target_dir))
+    results = git_vcs.place_tags_on_commits(
+        str(target_dir), [TagRequest(str(upstream_dir), sha, "tag1", mirror_dir)]
+    )
+    assert results == {"tag1": None}
+    assert git(mirror_dir, "tag") == "tag1"
+
+
+def test_place_tags_on_commits_unreachable_in_target(
+    git_vcs: GitVcs, tmp_path: Path, git_env: None
+) -> None:
+    """Test that commits the target has, but that none of its refs reaches,
+    are pushed from the mirror."""
+    upstream_dir = tmp_path / "upstream"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "upstream.git"
+    git(tmp_path, "init", str(upstream_dir))
+    git(upstream_dir, "commit", "--allow-empty", "-m", "1")
+    git(upstream_dir, "commit", "--allow-empty", "-m", "2")
+    sha = git(upstream_dir, "rev-parse", "HEAD")
+    git(tmp_path, "clone", "--bare", str(upstream_dir), str(target_dir))
+    # the commit object stays in the target
+    git(target_dir, "update-ref", "HEAD", "HEAD~1")
+    results = git_vcs.place_tags_on_commits(
+        str(target_dir),
+        [TagRequest(str(upstream_dir), sha, "tag1", mirror_dir, target_is_fork=True)],
+    )
+    assert results == {"tag1": None}
+    assert git_vcs.get_remote_tag_commits(str(target_dir), ["tag1"]) == {"tag1": sha}
+    assert mirror_dir.exists()
+
+
+def test_place_tags_on_commits_partial_fetch(
+    git_vcs: GitVcs, tmp_path: Path, git_env: None
+) -> None:
+    source_dir = tmp_path / "source"
+    target_dir = tmp_path / "target"
+    mirror_dir = tmp_path / "mirrors" / "source.git"
+    git(tmp_path, "init", str(source_dir))
+    git(source_dir, "config", "uploadpack.allowFilter", "true")
+    git(tmp_path, "init", "--bare", str(target_dir))
+    shas = []
+    for i in range(2):
+        (source_dir / "file.txt").write_text(f"content {i}\n")
+        git(source_dir, "add", "file.txt")
+        git(source_dir, "commit", "-m", str(i))
+        shas.append(git(source_dir, "rev-parse", "HEAD"))
+    results = git_vcs.place_tags_on_commits(
+        str(target_dir),
+        [
+            TagRequest(str(source_dir), shas[0], "tag1", mirror_dir, "blob:none"),
+            TagRequest(str(source_dir), shas[1], "tag2", mirror_dir, "blob:none"),
+            TagRequest(str(source_dir), "d" * 40, "tag3", mirror_dir, "blob:none"),
+        ],
+    )
+    assert results["tag1"] is None
+    assert results["tag2"] is None
+    assert isinstance(results["tag3"], VcsError)
+    # the mirror is a partial clone, but the target has all objects
+    assert git(mirror_dir, "config", "--get-regexp", r"remote\..*\.promisor")
+    git(target_dir, "fsck", "--connectivity-only")
+    assert git_vcs.get_remote_tags(str(target_dir)) == {
+        shas[0]: ["tag1"],
+        shas[1]: ["tag2"],
+    }
+
+
+def test_async_get_remote_tags(tmp_path: Path, git_env: None) -> None:
+    git(tmp_path, "init")
+    git(tmp_path, "commit", "--allow-empty", "-m", "1")
+    sha = git(tmp_path, "rev-parse", "HEAD")
+    for tag in ["ppr-1", "ppr-2", "v1"]:
+        git(tmp_path, "tag", tag)
+    git(tmp_path, "commit", "--allow-empty", "-m", "2")
+
+    async def lookup() -> tuple[dict[str, list[str]], dict[str, str]]:
+        # concurrent lookups
+        async_vcs = AsyncGitVcs()
+        return await asyncio.gather(
+            async_vcs.get_remote_tags(str(tmp_path), "ppr-"),
+            async_vcs.get_remote_tag_commits(str(tmp_path), ["v1", "v2"]),
+        )
+
+    remote_tags, tag_commits = asyncio.run(lookup())
+    assert remote_tags == {sha: ["ppr-1", "ppr-2"]}
+    assert tag_commits == {"v1": sha}
+
+
+def test_async_ls_remote_error(tmp_path: Path) -> None:
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        asyncio.run(AsyncGitVcs().get_remote_tags(str(tmp_path / "missing")))
+    assert "missing" in e.value.stderr
+
+
+def test_async_ls_remote_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    # a remote that does not respond
+    monkeypatch.setenv("GIT_SSH_COMMAND", "sh -c 'sleep 5' --")
+    start = time.perf_counter()
+    with pytest.raises(VcsTimeoutError, match=r"more than 0\.5 seconds"):
+        asyncio.run(
+            AsyncGitVcs(timeout=0.5).get_remote_tags("ssh://git@example.com/a/b")
+        )
+    assert time.perf_counter() - start < 4
+
+
+def test_remote_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that synchronous lookups time out too."""
+    monkeypatch.setenv("GIT_SSH_COMMAND", "sh -c 'sleep 5' --")
+    git_vcs = GitVcs()
+    git_vcs.remote_timeout = 0.5
+    with pytest.raises(VcsTimeoutError):
+        git_vcs.get_remote_tag_commits("ssh://git@example.com/a/b", ["v1"])